@@ -0,0 +1,402 @@
+# Public Domain (-) 2010-2012 The Assetgen Authors.
+# See the Assetgen UNLICENSE file for details.
+
+"""Benchmark harness for assetgen builds.
+
+Running ``python -m assetgen.bench`` generates a synthetic project, along
+with stub ``coffee``, ``tsc``, ``sass`` and ``uglifyjs2`` executables which
+just echo their inputs after an optional delay, and then times:
+
+* ``cold`` -- a build from scratch;
+* ``noop`` -- a rebuild with nothing changed;
+* ``edit`` -- a rebuild after editing a single source file;
+* ``watch`` -- the time from editing a file whilst ``--watch`` is running
+  until the manifest gets updated;
+* ``startup`` -- a no-op rebuild of a tiny project, which is dominated by
+  interpreter startup and imports.
+
+The results, including the peak memory usage of each build, are written out
+as JSON so that they can be compared across revisions.
+"""
+
+import os
+import sys
+
+from optparse import OptionParser
+from os.path import abspath, dirname, exists, getmtime, join
+from shutil import rmtree
+from subprocess import Popen
+from tempfile import mkdtemp
+from time import sleep, time
+
+from simplejson import dumps as enc_json
+
+# ------------------------------------------------------------------------------
+# Stub Compilers
+# ------------------------------------------------------------------------------
+
+STUB = '''#! %(python)s
+
+import os
+import sys
+import time
+
+delay = float(os.environ.get('ASSETGEN_BENCH_DELAY') or 0)
+if delay:
+    time.sleep(delay)
+
+name = os.path.basename(sys.argv[0])
+args = sys.argv[1:]
+
+# The values of these options are never treated as sources.
+VALUE_OPTIONS = ('--in-source-map', '--out', '--source-map')
+
+sources = []
+skip = False
+for arg in args:
+    if skip:
+        skip = False
+    elif arg in VALUE_OPTIONS:
+        skip = True
+    elif os.path.isfile(arg):
+        sources.append(arg)
+
+def write_map(path, source):
+    lines = open(source, 'rb').read().count('\\n')
+    file = open(path, 'wb')
+    file.write('{"version": 3, "sources": ["%%s"], "names": [], '
+               '"mappings": "%%s"}' %% (os.path.basename(source), ';' * lines))
+    file.close()
+
+# Record each invocation, so that tests can check what got recompiled.
+log = os.environ.get('ASSETGEN_BENCH_LOG')
+if log:
+    file = open(log, 'ab')
+    file.write(' '.join([name] + args) + '\\n')
+    file.close()
+
+if '--out' in args:
+    file = open(args[args.index('--out') + 1], 'wb')
+    for path in sources:
+        file.write(open(path, 'rb').read())
+    file.close()
+# Compilers which write their output next to each of the given files.
+elif (name == 'coffee' and '-c' in args) or name == 'tsc':
+    for path in sources:
+        base = os.path.splitext(path)[0]
+        file = open(base + '.js', 'wb')
+        file.write(open(path, 'rb').read())
+        file.close()
+        if '-m' in args or '-sourcemap' in args:
+            write_map(base + '.js.map', path)
+# Bundles are piped in on stdin when no files are given, e.g. uglifyjs2.
+elif not sources:
+    sys.stdout.write(sys.stdin.read())
+else:
+    for path in sources:
+        sys.stdout.write(open(path, 'rb').read())
+    if '--source-map' in args:
+        write_map(args[args.index('--source-map') + 1], sources[0])
+'''
+
+STUBS = ('coffee', 'sass', 'tsc', 'uglifyjs2')
+
+def write_stubs(directory):
+    os.makedirs(directory)
+    for name in STUBS:
+        path = join(directory, name)
+        write(path, STUB % {'python': sys.executable})
+        os.chmod(path, 0755)
+
+# ------------------------------------------------------------------------------
+# Synthetic Projects
+# ------------------------------------------------------------------------------
+
+PNG = (
+    '\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01'
+    '\x08\x06\x00\x00\x00\x1f\x15\xc4\x89\x00\x00\x00\rIDATx\x9cc\xf8\x0f'
+    '\x00\x00\x01\x01\x00\x05\x18\xd8N\x00\x00\x00\x00IEND\xaeB`\x82'
+    )
+
+def write(path, content):
+    directory = dirname(path)
+    if not exists(directory):
+        os.makedirs(directory)
+    file = open(path, 'wb')
+    file.write(content)
+    file.close()
+
+def get_source_dir(root, kind, bundle, idx, depth):
+    """Spread the sources of a bundle over nested directories."""
+    parts = [root, 'static', kind, 'b%d' % bundle]
+    parts.extend('d%d' % level for level in range(idx % (depth + 1)))
+    return join(*parts)
+
+def generate_project(root, bundles=10, sources=20, depth=2, images=10):
+    """Write a synthetic project to the root directory and return the path
+    of its config file.
+
+    Each bundle consists of a JS asset built from CoffeeScript sources, or
+    TypeScript ones for every other bundle, and an SCSS stylesheet which
+    embeds some of the images. All sources are picked up via ``**`` globs.
+    """
+
+    for idx in range(images):
+        write(join(root, 'static', 'gfx', 'img%d.png' % idx), PNG + str(idx))
+
+    config = ['generate:']
+    for bundle in range(bundles):
+        ext = bundle % 2 and 'ts' or 'coffee'
+        for idx in range(sources):
+            directory = get_source_dir(root, 'js', bundle, idx, depth)
+            write(join(directory, 'm%d.%s' % (idx, ext)), ''.join(
+                'var v%d_%d_%d = %d;\n' % (bundle, idx, line, line)
+                for line in range(50)
+                ))
+            directory = get_source_dir(root, 'css', bundle, idx, depth)
+            css = ['.b%d-s%d-r%d { color: #ffffff; margin: 0px }\n' % (
+                bundle, idx, rule
+                ) for rule in range(50)]
+            if images:
+                css.append(
+                    '.b%d-s%d-img { background: embed("gfx/img%d.png") }\n'
+                    % (bundle, idx, (bundle * sources + idx) % images)
+                    )
+            write(join(directory, 's%d.scss' % idx), ''.join(css))
+        config.extend([
+            '- js/bundle%d.js:' % bundle,
+            '    source: static/js/b%d/**/*.%s' % (bundle, ext),
+            '- css/bundle%d.css:' % bundle,
+            '    source: static/css/b%d/**/*.scss' % bundle,
+            '    embed.path.root: static',
+            ])
+    config.extend([
+        'cache.directory: .cache',
+        'output.directory: out',
+        'output.hashed: true',
+        'output.manifest: out/assets.json',
+        'state.directory: .state',
+        ])
+    path = join(root, 'assetgen.yaml')
+    write(path, '\n'.join(config) + '\n')
+    return path
+
+def get_edit_path(root, depth):
+    return join(get_source_dir(root, 'css', 0, 0, depth), 's0.scss')
+
+def edit(path, counter=[0]):
+    counter[0] += 1
+    file = open(path, 'ab')
+    file.write('.edit-%d { color: red }\n' % counter[0])
+    file.close()
+
+# ------------------------------------------------------------------------------
+# Measurements
+# ------------------------------------------------------------------------------
+
+def get_command(config, *args):
+    return [
+        sys.executable, '-c', 'from assetgen.main import main; main()', config
+        ] + list(args)
+
+def get_env(bin_dir, delay):
+    env = os.environ.copy()
+    env['PATH'] = bin_dir + os.pathsep + env.get('PATH', '')
+    env['ASSETGEN_BENCH_DELAY'] = str(delay)
+    # Make sure that this copy of assetgen is the one being benchmarked.
+    env['PYTHONPATH'] = dirname(dirname(abspath(__file__))) + os.pathsep + \
+        env.get('PYTHONPATH', '')
+    return env
+
+def run_build(config, env, args=()):
+    """Run a build and return its wall time and peak memory usage."""
+    cmd = get_command(config, *args)
+    devnull = open(os.devnull, 'wb')
+    start = time()
+    process = Popen(cmd, env=env, stdout=devnull, stderr=devnull)
+    # Wait via wait4, so as to get the resource usage of just this build.
+    _, status, usage = os.wait4(process.pid, 0)
+    duration = time() - start
+    process.returncode = status
+    devnull.close()
+    if status:
+        raise RuntimeError("Build failed: %s" % ' '.join(cmd))
+    return {'seconds': round(duration, 4), 'maxrss_kb': usage.ru_maxrss}
+
+def measure_watch(config, env, path, jobs, timeout=60):
+    """Return the seconds from editing a file until the manifest of a
+    running ``--watch`` process gets updated."""
+    manifest = join(dirname(config), 'out', 'assets.json')
+    devnull = open(os.devnull, 'wb')
+    process = Popen(
+        get_command(config, '--watch', '--jobs', str(jobs)), env=env,
+        stdout=devnull, stderr=devnull
+        )
+    try:
+        # Give the watcher time to finish its initial pass and set up its
+        # watches.
+        sleep(2)
+        before = getmtime(manifest)
+        # Make sure that the new mtime is distinguishable.
+        sleep(0.05)
+        start = time()
+        edit(path)
+        while time() - start < timeout:
+            if getmtime(manifest) != before:
+                return {'seconds': round(time() - start, 4)}
+            sleep(0.005)
+        raise RuntimeError("Timed out waiting for the watch rebuild")
+    finally:
+        process.terminate()
+        process.wait()
+        devnull.close()
+
+def measure_startup(root, env, runs=10):
+    """Return the fastest of several no-op builds of a tiny project."""
+    config = generate_project(join(root, 'startup'), 1, 1, 0, 0)
+    run_build(config, env)
+    return min(
+        (run_build(config, env) for attempt in range(runs)),
+        key=lambda item: item['seconds']
+        )
+
+def run_benchmark(root, bundles, sources, depth, images, delay, jobs, repeat):
+    config = generate_project(root, bundles, sources, depth, images)
+    bin_dir = join(root, 'bin')
+    write_stubs(bin_dir)
+    env = get_env(bin_dir, delay)
+    args = ['--jobs', str(jobs)]
+    path = get_edit_path(root, depth)
+    runs = {'cold': [], 'noop': [], 'edit': [], 'watch': []}
+    for attempt in range(repeat):
+        for name in ('.cache', '.state', 'out'):
+            if exists(join(root, name)):
+                rmtree(join(root, name))
+        runs['cold'].append(run_build(config, env, args))
+        runs['noop'].append(run_build(config, env, args))
+        edit(path)
+        runs['edit'].append(run_build(config, env, args))
+        runs['watch'].append(measure_watch(config, env, path, jobs))
+    results = {}
+    for name, items in runs.iteritems():
+        # Report the fastest of the runs, as the others are mostly slowed
+        # down by noise.
+        results[name] = min(items, key=lambda item: item['seconds'])
+    results['startup'] = measure_startup(root, env)
+    return results
+
+def get_revision():
+    directory = dirname(dirname(abspath(__file__)))
+    try:
+        process = Popen(
+            ['git', 'rev-parse', 'HEAD'], cwd=directory,
+            stdout=-1, stderr=open(os.devnull, 'wb')
+            )
+        revision = process.communicate()[0].strip()
+    except OSError:
+        return
+    if process.returncode:
+        return
+    return revision
+
+# ------------------------------------------------------------------------------
+# Main Runner
+# ------------------------------------------------------------------------------
+
+def main(argv=None):
+
+    argv = argv or sys.argv[1:]
+    op = OptionParser(usage="Usage: python -m assetgen.bench [options]")
+
+    op.add_option(
+        '--bundles', type='int', default=10, metavar='N',
+        help="number of JS and CSS bundle pairs [10]"
+        )
+
+    op.add_option(
+        '--delay', type='float', default=0, metavar='SECONDS',
+        help="time each stub compiler call should take [0]"
+        )
+
+    op.add_option(
+        '--depth', type='int', default=2, metavar='N',
+        help="number of directory levels to spread sources over [2]"
+        )
+
+    op.add_option(
+        '--images', type='int', default=10, metavar='N',
+        help="number of images to embed within stylesheets [10]"
+        )
+
+    op.add_option(
+        '-j', '--jobs', type='int', default=1, metavar='N',
+        help="value of the --jobs parameter to build with [1]"
+        )
+
+    op.add_option(
+        '--keep', action='store_true',
+        help="keep the generated project instead of removing it"
+        )
+
+    op.add_option(
+        '-o', '--output', metavar='FILE',
+        help="write the JSON results to FILE instead of stdout"
+        )
+
+    op.add_option(
+        '--repeat', type='int', default=1, metavar='N',
+        help="number of times to repeat each measurement [1]"
+        )
+
+    op.add_option(
+        '--sources', type='int', default=20, metavar='N',
+        help="number of source files within each bundle [20]"
+        )
+
+    op.add_option(
+        '--startup-limit', type='float', metavar='MS',
+        help="exit with an error if the startup run takes longer than MS"
+        )
+
+    options, args = op.parse_args(argv)
+
+    params = {
+        'bundles': options.bundles,
+        'delay': options.delay,
+        'depth': options.depth,
+        'images': options.images,
+        'jobs': options.jobs,
+        'repeat': options.repeat,
+        'sources': options.sources,
+        }
+
+    root = mkdtemp(prefix='assetgen-bench-')
+    try:
+        results = run_benchmark(root, **params)
+    finally:
+        if options.keep:
+            print >> sys.stderr, "Kept the benchmark project at %s" % root
+        else:
+            rmtree(root)
+
+    report = enc_json({
+        'params': params,
+        'results': results,
+        'revision': get_revision(),
+        'time': int(time()),
+        }, indent=2, sort_keys=True)
+
+    if options.output:
+        write(options.output, report + '\n')
+    else:
+        print report
+
+    limit = options.startup_limit
+    if limit and results['startup']['seconds'] * 1000 > limit:
+        print >> sys.stderr, "Startup took %dms, over the limit of %dms" % (
+            results['startup']['seconds'] * 1000, limit
+            )
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,593 @@
+# Public Domain (-) 2010-2012 The Assetgen Authors.
+# See the Assetgen UNLICENSE file for details.
+
+"""Transforms for compiled CSS stylesheets."""
+
+from re import compile as compile_regex, DOTALL, IGNORECASE
+
+# ------------------------------------------------------------------------------
+# Tokenizer
+# ------------------------------------------------------------------------------
+
+# Comments, strings and url()/embed() references are kept as opaque tokens so
+# that their contents never get transformed.
+token_regex = compile_regex(
+    r'(/\*.*?(?:\*/|\Z)'
+    r'|"(?:[^"\\\n]|\\.)*"?'
+    r"|'(?:[^'\\\n]|\\.)*'?"
+    r'|(?:url|embed)\((?:\s*"(?:[^"\\]|\\.)*"\s*|\s*\'(?:[^\'\\]|\\.)*\'\s*'
+    r'|[^)]*)\)'
+    r'|[{};])',
+    DOTALL | IGNORECASE
+    )
+
+def iter_tokens(css):
+    """Yield the text, opaque and punctuation tokens of the CSS."""
+
+    pos = 0
+    for match in token_regex.finditer(css):
+        start = match.start()
+        if start > pos:
+            yield css[pos:start]
+        yield match.group()
+        pos = match.end()
+    if pos < len(css):
+        yield css[pos:]
+
+def tokenize(css):
+    """Split the CSS into a list of text, opaque and punctuation tokens."""
+
+    return list(iter_tokens(css))
+
+def is_opaque(token):
+    char = token[:1]
+    if char in ('"', "'"):
+        return True
+    if token.startswith('/*'):
+        return True
+    lower = token[:6].lower()
+    return lower.startswith('url(') or lower.startswith('embed(')
+
+placeholder_regex = compile_regex(r'\x00(\d+)\x00')
+
+def protect(tokens):
+    """Join the tokens, replacing any opaque ones with placeholders."""
+
+    opaque = []
+    parts = []
+    for token in tokens:
+        if is_opaque(token):
+            parts.append('\x00%d\x00' % len(opaque))
+            opaque.append(token)
+        else:
+            parts.append(token)
+    return ''.join(parts), opaque
+
+def restore(text, opaque):
+    if not opaque:
+        return text
+    return placeholder_regex.sub(lambda match: opaque[int(match.group(1))], text)
+
+# ------------------------------------------------------------------------------
+# RTL Flipping
+# ------------------------------------------------------------------------------
+
+NOFLIP = '@noflip'
+
+CURSORS = {
+    'e-resize': 'w-resize', 'w-resize': 'e-resize',
+    'ne-resize': 'nw-resize', 'nw-resize': 'ne-resize',
+    'se-resize': 'sw-resize', 'sw-resize': 'se-resize',
+    }
+
+DIRECTIONS = {'ltr': 'rtl', 'rtl': 'ltr'}
+
+SIDES = {'left': 'right', 'right': 'left'}
+
+FOUR_VALUE_PROPERTIES = frozenset([
+    'border-color', 'border-style', 'border-width', 'margin', 'padding'
+    ])
+
+KEYWORD_PROPERTIES = frozenset([
+    'background', 'background-position', 'background-position-x', 'clear',
+    'float', 'text-align'
+    ])
+
+POSITIONS = frozenset(['bottom', 'center', 'left', 'right', 'top'])
+
+POSITION_PROPERTIES = frozenset([
+    'background', 'background-position', 'background-position-x'
+    ])
+
+declaration_regex = compile_regex(
+    r'^((?:\s|\x00\d+\x00)*)([-_a-zA-Z0-9*]+)(\s*:)(.*)$', DOTALL
+    )
+
+important_regex = compile_regex(r'(\s*!\s*important\s*)$', IGNORECASE)
+left_right_regex = compile_regex(r'(?<![-\w])(left|right)(?![-\w])', IGNORECASE)
+length_regex = compile_regex(r'^-?\d*\.?\d+[a-z]*$', IGNORECASE)
+percentage_regex = compile_regex(r'^(-?\d*\.?\d+)%$')
+
+def swap_left_right(text):
+    def replace(match):
+        word = match.group()
+        lower = word.lower()
+        new = lower == 'left' and 'right' or 'left'
+        if word.isupper():
+            return new.upper()
+        return new
+    return left_right_regex.sub(replace, text)
+
+def split_values(value):
+    """Split a value on whitespace, except within parentheses."""
+
+    values = []; current = []; depth = 0
+    for char in value:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        if depth <= 0 and char.isspace():
+            if current:
+                values.append(''.join(current))
+                current = []
+            continue
+        current.append(char)
+    if current:
+        values.append(''.join(current))
+    return values
+
+def flip_four_values(value):
+    values = split_values(value)
+    if len(values) == 4:
+        values[1], values[3] = values[3], values[1]
+        return ' '.join(values)
+    return value
+
+def flip_radius_values(value):
+    values = split_values(value)
+    if len(values) == 2:
+        values = [values[1], values[0]]
+    elif len(values) == 3:
+        values = [values[1], values[0], values[1], values[2]]
+    elif len(values) == 4:
+        values = [values[1], values[0], values[3], values[2]]
+    else:
+        return value
+    return ' '.join(values)
+
+def flip_border_radius(value):
+    return ' / '.join(
+        flip_radius_values(part.strip()) for part in value.split('/')
+        )
+
+def split_commas(value):
+    """Split a value on commas, except within parentheses."""
+
+    parts = []; start = 0; depth = 0
+    for idx, char in enumerate(value):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth <= 0:
+            parts.append(value[start:idx])
+            start = idx + 1
+    parts.append(value[start:])
+    return parts
+
+def iter_spans(value):
+    """Yield the (start, end) offsets of the whitespace separated items in
+    the value, treating anything within parentheses as part of an item."""
+
+    start = None; depth = 0
+    for idx, char in enumerate(value):
+        if depth <= 0 and char.isspace():
+            if start is not None:
+                yield start, idx
+                start = None
+            continue
+        if start is None:
+            start = idx
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+    if start is not None:
+        yield start, len(value)
+
+def flip_layer(layer):
+    for start, end in iter_spans(layer):
+        item = layer[start:end]
+        match = percentage_regex.match(item)
+        if match:
+            number = 100 - float(match.group(1))
+            if number == int(number):
+                number = int(number)
+            return '%s%s%%%s' % (layer[:start], number, layer[end:])
+        if length_regex.match(item) or item.lower() in POSITIONS:
+            break
+    return layer
+
+def flip_percentage(value):
+    """Mirror the horizontal position of each background layer, if it is
+    given as a percentage. Values within functions, e.g. gradient stops,
+    are left untouched."""
+
+    return ','.join(flip_layer(layer) for layer in split_commas(value))
+
+def flip_cursor(item):
+    """Flip a single cursor value, keeping its surrounding whitespace."""
+
+    stripped = item.strip()
+    cursor = CURSORS.get(stripped.lower())
+    if not cursor:
+        return item
+    start = item.index(stripped)
+    return item[:start] + cursor + item[start+len(stripped):]
+
+def flip_declaration(declaration):
+    """Return the declaration mirrored from left-to-right to right-to-left.
+
+    Any opaque tokens must have already been replaced by placeholders.
+    """
+
+    match = declaration_regex.match(declaration)
+    if not match:
+        return declaration
+    space, prop, colon, value = match.groups()
+    if prop.startswith('--'):
+        # Custom properties are referenced by name from var(), so renaming
+        # them would leave those references dangling.
+        return declaration
+    stripped = value.lstrip()
+    leading = value[:len(value) - len(stripped)]
+    value = stripped
+    suffix = ''
+    important = important_regex.search(value)
+    if important:
+        suffix = important.group()
+        value = value[:important.start()]
+    stripped = value.rstrip()
+    suffix = value[len(stripped):] + suffix
+    value = stripped
+    prop = '-'.join(
+        SIDES.get(part.lower(), part) for part in prop.split('-')
+        )
+    name = prop.lower()
+    if name.startswith('-'):
+        unprefixed = name.split('-', 2)[-1]
+    else:
+        unprefixed = name
+    if unprefixed in FOUR_VALUE_PROPERTIES:
+        value = flip_four_values(value)
+    elif unprefixed == 'border-radius':
+        value = flip_border_radius(value)
+    elif unprefixed == 'direction':
+        value = DIRECTIONS.get(value.lower(), value)
+    elif unprefixed == 'cursor':
+        value = ','.join(flip_cursor(item) for item in value.split(','))
+    if unprefixed in KEYWORD_PROPERTIES:
+        value = swap_left_right(value)
+    if unprefixed in POSITION_PROPERTIES:
+        value = flip_percentage(value)
+    return ''.join([space, prop, colon, leading, value, suffix])
+
+def flip_css(css):
+    """Return the CSS mirrored from left-to-right to right-to-left.
+
+    Property names, four-value shorthands, border-radius corners,
+    background positions, float/clear/text-align keywords, direction and
+    resize cursors are all flipped. A ``/* @noflip */`` comment preceding a
+    declaration or a rule stops it from being flipped.
+    """
+
+    output = []; out = output.append
+    buffer = []
+    # Each entry records whether the corresponding block is noflip.
+    blocks = []
+    noflip = False
+
+    def flush(flip):
+        if not buffer:
+            return
+        if not flip:
+            output.extend(buffer)
+        else:
+            text, opaque = protect(buffer)
+            out(restore(flip_declaration(text), opaque))
+        del buffer[:]
+
+    for token in tokenize(css):
+        if token == '{':
+            # The buffered text was a selector or at-rule prelude.
+            output.extend(buffer)
+            del buffer[:]
+            blocks.append(noflip or bool(blocks and blocks[-1]))
+            noflip = False
+            out(token)
+        elif token in (';', '}'):
+            if blocks:
+                flush(not (noflip or blocks[-1]))
+            else:
+                output.extend(buffer)
+                del buffer[:]
+            noflip = False
+            if token == '}' and blocks:
+                blocks.pop()
+            out(token)
+        elif token.startswith('/*') and NOFLIP in token:
+            flush(False)
+            noflip = True
+            out(token)
+        else:
+            buffer.append(token)
+
+    output.extend(buffer)
+    return ''.join(output)
+
+# ------------------------------------------------------------------------------
+# Minifier
+# ------------------------------------------------------------------------------
+
+CONTAINER_RULES = frozenset([
+    'container', 'document', 'keyframes', 'layer', 'media', 'supports'
+    ])
+
+color_regex = compile_regex(
+    r'#([0-9a-fA-F])\1([0-9a-fA-F])\2([0-9a-fA-F])\3(?![0-9a-fA-F])'
+    )
+
+important_space_regex = compile_regex(r'\s*!\s*important', IGNORECASE)
+
+# Browsers drop a whole rule if they don't recognise one of its selectors, so
+# rules are only combined if their selectors just use syntax which is
+# supported everywhere.
+safe_selector_regex = compile_regex(
+    r'^(?:[-\w.#*,>+ ]'
+    r'|::?(?:active|after|before|first-child|first-letter|first-line|focus'
+    r'|hover|link|visited)(?![-\w(]))+$',
+    IGNORECASE
+    )
+selector_space_regex = compile_regex(r'\s*([,>+~])\s*')
+space_regex = compile_regex(r'\s+')
+
+zero_regex = compile_regex(
+    r'(?<![\w.#-])-?0+(?:\.0+)?'
+    r'(?:px|em|rem|ex|pt|pc|cm|mm|in|vw|vh|vmin|vmax|ch)(?![\w%(])',
+    IGNORECASE
+    )
+
+# Properties where a unitless zero means something else, e.g. a flex-basis of
+# 0 is taken as a flex-grow or flex-shrink factor by some browsers.
+KEEP_UNIT_PROPERTIES = frozenset(['flex', 'flex-basis'])
+
+# The kinds of frames within which adjacent rules are never merged.
+UNMERGED_FRAMES = frozenset(['keyframes', 'nested'])
+
+def get_at_rule(prelude):
+    if not prelude.startswith('@'):
+        return ''
+    name = prelude[1:].split(' ', 1)[0].split('(', 1)[0].lower()
+    if name.startswith('-'):
+        name = name.split('-', 2)[-1]
+    return name
+
+def minify_prelude(tokens):
+    text, opaque = protect(tokens)
+    text = space_regex.sub(' ', text).strip()
+    if text.startswith('@'):
+        text = text.replace(', ', ',').replace(' ,', ',')
+    else:
+        text = selector_space_regex.sub(r'\1', text)
+    return restore(text, opaque)
+
+def minify_declaration(tokens):
+    text, opaque = protect(tokens)
+    text = text.strip()
+    if not text:
+        return ''
+    prop, colon, value = text.partition(':')
+    if not colon:
+        return restore(space_regex.sub(' ', text), opaque)
+    prop = prop.strip()
+    value = value.strip()
+    # Whitespace within custom properties may be significant.
+    if not prop.startswith('--'):
+        value = space_regex.sub(' ', value)
+        value = value.replace(', ', ',').replace(' ,', ',')
+        value = important_space_regex.sub('!important', value)
+        if not prop.lower().endswith('filter'):
+            value = color_regex.sub(
+                lambda match: ('#%s%s%s' % match.groups()).lower(), value
+                )
+        name = prop.lower()
+        if name.startswith('-'):
+            name = name.split('-', 2)[-1]
+        # Units are needed for zero values within calc() and the like.
+        if '(' not in value and name not in KEEP_UNIT_PROPERTIES:
+            value = zero_regex.sub('0', value)
+    return restore('%s:%s' % (prop, value), opaque)
+
+def iter_minified(css):
+    """Yield chunks of the minified CSS.
+
+    The CSS is processed in a single pass, only holding on to the current
+    rule and the previous rule at each nesting level, so that adjacent rules
+    with the same selector or the same declarations can be merged.
+    """
+
+    # Each frame is a [kind, declarations] pair, where kind is 'rule' for
+    # blocks of declarations, 'container' for @media and the like,
+    # 'keyframes', where the rules are never merged, or 'nested' for a rule
+    # which turned out to contain blocks of its own, e.g. with CSS nesting.
+    frames = []
+    # The pending rule at each container level, as a list of its selectors,
+    # its declarations and whether it can still be merged by declarations.
+    # Once a rule has been merged by selector, its declarations are no longer
+    # compared, so as to keep the comparisons linear.
+    pending = [None]
+    buffer = []
+
+    def flush_pending():
+        rule = pending[-1]
+        if rule:
+            pending[-1] = None
+            return '%s{%s}' % (','.join(rule[0]), ';'.join(rule[1]))
+        return ''
+
+    def close_block(kind):
+        # Text left within a nested rule is its last declaration, whereas
+        # within containers it is dropped, as it isn't valid there.
+        if kind == 'nested':
+            text = minify_declaration(buffer)
+        else:
+            text = ''
+        del buffer[:]
+        frames.pop()
+        chunk = flush_pending()
+        if chunk:
+            yield chunk
+        pending.pop()
+        yield text + '}'
+
+    for token in iter_tokens(css):
+        kind = frames and frames[-1][0]
+        if token.startswith('/*'):
+            if not token.startswith('/*!'):
+                buffer.append(' ')
+            elif kind == 'rule':
+                buffer.append(token)
+            else:
+                # Preserved comments outside of declarations are emitted on
+                # their own, so that they never end up within a selector.
+                chunk = flush_pending()
+                if chunk:
+                    yield chunk
+                yield token
+            continue
+        if token == '{':
+            prelude = minify_prelude(buffer)
+            del buffer[:]
+            if kind == 'rule':
+                # The enclosing rule can no longer be merged, so it is
+                # emitted in place, and the rest of its contents follow as
+                # they are seen.
+                _, body, selector = frames[-1]
+                frames[-1] = ['nested', None]
+                chunk = flush_pending()
+                if chunk:
+                    yield chunk
+                pending.append(None)
+                yield '%s{%s' % (selector, ''.join(
+                    declaration + ';' for declaration in body
+                    ))
+                kind = 'nested'
+            at_rule = get_at_rule(prelude)
+            if at_rule in CONTAINER_RULES:
+                if at_rule == 'keyframes':
+                    frames.append(['keyframes', None])
+                elif kind == 'nested':
+                    # Conditional rules within a rule hold declarations too.
+                    frames.append(['nested', None])
+                else:
+                    frames.append(['container', None])
+                chunk = flush_pending()
+                if chunk:
+                    yield chunk
+                pending.append(None)
+                yield prelude + '{'
+            else:
+                frames.append(['rule', [], prelude])
+        elif token == ';':
+            if kind == 'rule':
+                declaration = minify_declaration(buffer)
+                if declaration:
+                    frames[-1][1].append(declaration)
+            elif kind == 'nested':
+                declaration = minify_declaration(buffer)
+                if declaration:
+                    chunk = flush_pending()
+                    if chunk:
+                        yield chunk
+                    yield declaration + ';'
+            else:
+                statement = minify_prelude(buffer)
+                if statement:
+                    chunk = flush_pending()
+                    if chunk:
+                        yield chunk
+                    yield statement + ';'
+            del buffer[:]
+        elif token == '}':
+            if kind == 'rule':
+                declaration = minify_declaration(buffer)
+                del buffer[:]
+                _, body, selector = frames.pop()
+                if declaration:
+                    body.append(declaration)
+                if not body:
+                    continue
+                rule = pending[-1]
+                mergeable = selector[:1] != '@' and (
+                    not frames or frames[-1][0] not in UNMERGED_FRAMES
+                    )
+                if rule and mergeable:
+                    if len(rule[0]) == 1 and rule[0][0] == selector:
+                        rule[1].extend(body)
+                        rule[2] = False
+                        continue
+                    if rule[2] and rule[1] == body and \
+                            safe_selector_regex.match(selector) and \
+                            safe_selector_regex.match(rule[0][-1]):
+                        rule[0].append(selector)
+                        continue
+                chunk = flush_pending()
+                if chunk:
+                    yield chunk
+                if mergeable:
+                    pending[-1] = [[selector], body, True]
+                else:
+                    yield '%s{%s}' % (selector, ';'.join(body))
+            elif kind:
+                for chunk in close_block(kind):
+                    yield chunk
+            else:
+                buffer.append(token)
+        else:
+            buffer.append(token)
+
+    # Any blocks which are still open at the end are closed, as a browser
+    # would, rather than being dropped.
+    while frames:
+        kind = frames[-1][0]
+        if kind == 'rule':
+            declaration = minify_declaration(buffer)
+            del buffer[:]
+            _, body, selector = frames.pop()
+            if declaration:
+                body.append(declaration)
+            chunk = flush_pending()
+            if chunk:
+                yield chunk
+            if body:
+                yield '%s{%s}' % (selector, ';'.join(body))
+        else:
+            for chunk in close_block(kind):
+                yield chunk
+    chunk = flush_pending()
+    if chunk:
+        yield chunk
+    if buffer:
+        text = minify_prelude(buffer)
+        if text:
+            yield text
+
+def minify_css(css):
+    """Return the CSS with comments and redundant whitespace stripped, colors
+    and zero lengths shortened, and adjacent identical rules merged.
+
+    Comments starting with ``/*!`` are preserved.
+    """
+
+    return ''.join(iter_minified(css))
@@ -7,45 +7,61 @@ import os
 import sys
 import logging
 
+from atexit import register as atexit
 from base64 import b64encode
+from bisect import bisect_left, insort
+from collections import OrderedDict
 from contextlib import contextmanager
-from fnmatch import fnmatch
-from hashlib import sha1
-from mimetypes import guess_type
+from fnmatch import translate
+from hashlib import new as new_hash, sha1
 from optparse import OptionParser
-from os import chdir, environ, makedirs, remove, stat, walk
+from os import chdir, environ, getcwd, getpid, link, makedirs
+from os import read as read_fd, remove, rename, stat, strerror, utime, walk
 from os.path import basename, dirname, expanduser, isfile, isdir, join
-from os.path import realpath, split, splitext
+from os.path import getsize, normpath, realpath, relpath, split, splitext
 from posixpath import split as split_posix
 from pprint import pformat
-from re import compile as compile_regex
-from shutil import copy, rmtree
-from stat import ST_MTIME
+from re import compile as compile_regex, escape as escape_regex, MULTILINE
+from select import select
+from shlex import split as split_args
+from shutil import copy, copyfileobj, rmtree
+from sqlite3 import DatabaseError, OperationalError, connect as connect_db
+from errno import ENOENT
+from stat import S_ISREG, ST_MTIME
+from struct import calcsize, unpack_from
 from tempfile import gettempdir, mkdtemp
-from time import sleep
+from threading import Condition, Event, Lock, Thread, current_thread
+from time import sleep, time
+from Queue import Queue
 
 try:
-    from cPickle import dump, load
+    from cStringIO import StringIO
 except ImportError:
-    from pickle import dump, load
+    from StringIO import StringIO
 
-from mako.exceptions import RichTraceback
-from mako.template import Template
-from requests import get as get_url
-from simplejson import dump as encode_json, dumps as enc_json, loads as dec_json
+try:
+    from cPickle import dumps, load, loads
+except ImportError:
+    from pickle import dumps, load, loads
+
+from simplejson import dumps as enc_json, loads as dec_json
 from simplejson import JSONEncoderForHTML
-from tavutil.env import run_command
-from tavutil.optcomplete import autocomplete
-from tavutil.scm import is_git, SCMConfig
-from yaml import safe_load as decode_yaml
+
+from assetgen.css import flip_css, minify_css
+from assetgen.manifest import build_index
+from assetgen.worker import read_message, write_message
 
 # ------------------------------------------------------------------------------
 # Some Globals
 # ------------------------------------------------------------------------------
 
 DEBUG = False
+GLOBS = {}
 HANDLERS = {}
+DOWNLOADERS = {}
 LOCKS = {}
+TOOLS = {}
+WORKERS = {}
 
 logging.basicConfig(
     format='%(asctime)-15s [%(levelname)s] %(message)s', level=logging.INFO
@@ -58,6 +74,10 @@ log = logging.getLogger(__name__)
 # ------------------------------------------------------------------------------
 
 DEFAULTS = {
+    'binary.link': None,
+    'cache': True,
+    'cache.directory': None,
+    'cache.maxsize': 128 * 1024 * 1024,
     'css.bidi.extension': '.rtl',
     'css.compress': True,
     'css.embed': True,
@@ -67,6 +87,7 @@ DEFAULTS = {
     'css.embed.path.root': '',
     'css.embed.url.base': '',
     'css.embed.url.template': "%(url_base)s%(prefix)s/%(hash)s%(filename)s",
+    'css.minify': False,
     'js.compress': True,
     'js.bare': True,
     'js.sourcemaps': False,
@@ -74,17 +95,27 @@ DEFAULTS = {
     'js.sourcemaps.root': '',
     'js.sourcemaps.sourcepath': 'src',
     'js.uglify.bin': 'uglifyjs2',
+    'js.uglify.modules': False,
     'output.directory': None,
+    'output.fingerprint': False,
+    'output.hash': 'sha1',
+    'output.hash.length': None,
     'output.hashed': False,
     'output.manifest': None,
+    'output.manifest.details': False,
     'output.manifest.force': False,
-    'output.template': '%(hash)s-%(filename)s'
+    'output.manifest.index': None,
+    'output.precompress': False,
+    'output.template': '%(hash)s-%(filename)s',
+    'state.directory': None
     }
 
 DOWNLOADS_PATH = environ.get(
     'ASSETGEN_DOWNLOADS', join(expanduser('~'), '.assetgen')
     )
 
+STATE_PATH = join(expanduser('~'), '.assetgen-state')
+
 # ------------------------------------------------------------------------------
 # Lock Support
 # ------------------------------------------------------------------------------
@@ -122,38 +153,262 @@ def read(filename):
     file.close()
     return content
 
-def newer(input, output, cache):
-    if input in cache:
-        input_mtime = cache[input]
-    else:
-        input_mtime = stat(input)[ST_MTIME]
-    if output in cache:
-        output_mtime = cache[output]
-    else:
-        try:
-            output_mtime = stat(output)[ST_MTIME]
-        except Exception:
-            return 1
-    if input_mtime >= output_mtime:
+def newer(input, output, cache, built=0):
+    input_mtime = cache.stat(input)[ST_MTIME]
+    try:
+        output_mtime = cache.stat(output)[ST_MTIME]
+    except Exception:
+        return 1
+    # Outputs which were regenerated with identical content are left
+    # untouched, so the time of the last build is used if it's later.
+    if input_mtime >= max(output_mtime, built):
         return 1
 
-def do(args, **kwargs):
+def ensure_dir(path):
+    if isdir(path):
+        return
+    try:
+        makedirs(path)
+    except OSError:
+        # Another worker thread may have created it in the meantime.
+        if not isdir(path):
+            raise
+
+def iter_strings(value):
+    if isinstance(value, basestring):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.itervalues():
+            for text in iter_strings(item):
+                yield text
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            for text in iter_strings(item):
+                yield text
+
+def get_hasher(name):
+    """Return a constructor for the named hash algorithm."""
+    if name in ('blake2b', 'blake2s'):
+        try:
+            module = __import__('pyblake2')
+        except ImportError:
+            exit("The pyblake2 package needs to be installed for "
+                 "output.hash: %s" % name)
+        return getattr(module, name)
+    if name == 'sha1':
+        return sha1
+    try:
+        new_hash(name)
+    except ValueError:
+        exit("Unsupported output.hash algorithm: %s" % name)
+    return lambda data='': new_hash(name, data)
+
+def hash_file(path, size=65536, hasher=sha1):
+    hasher = hasher()
+    file = open(path, 'rb')
+    try:
+        chunk = file.read(size)
+        while chunk:
+            hasher.update(chunk)
+            chunk = file.read(size)
+    finally:
+        file.close()
+    return hasher.hexdigest()
+
+def get_libc():
+    if 'libc' not in TOOLS:
+        from ctypes import CDLL
+        from ctypes.util import find_library
+        TOOLS['libc'] = CDLL(find_library('c') or 'libc.so.6', use_errno=True)
+    return TOOLS['libc']
+
+def copy_fd(source, dest):
+    """Copy between file descriptors within the kernel, using
+    copy_file_range or sendfile if available, or return False."""
+    try:
+        libc = get_libc()
+    except OSError:
+        return False
+    from ctypes import c_int, c_size_t, c_ssize_t, c_uint, c_void_p
+    from ctypes import get_errno
+    for name in ('copy_file_range', 'sendfile'):
+        func = getattr(libc, name, None)
+        if func is None:
+            continue
+        func.restype = c_ssize_t
+        if name == 'sendfile':
+            func.argtypes = [c_int, c_int, c_void_p, c_size_t]
+            call = lambda: func(dest, source, None, 1 << 30)
+        else:
+            func.argtypes = [
+                c_int, c_void_p, c_int, c_void_p, c_size_t, c_uint
+                ]
+            call = lambda: func(source, None, dest, None, 1 << 30, 0)
+        copied = 0
+        while 1:
+            ret = call()
+            if ret <= 0:
+                break
+            copied += ret
+        if ret == 0:
+            return True
+        # Unsupported for these files, e.g. across filesystems on older
+        # kernels, so try the next method if nothing was copied yet.
+        if copied:
+            raise OSError(get_errno(), strerror(get_errno()))
+    return False
+
+FICLONE = 0x40049409
+
+def link_file(source, dest, mode=None):
+    """Create ``dest`` with the content of ``source``, as a hard link if the
+    mode is ``hard``, a copy-on-write clone if it's ``reflink``, or else via
+    a kernel-side copy -- falling back to a regular copy where needed."""
+    if mode == 'hard':
+        try:
+            link(source, dest)
+            return
+        except OSError:
+            pass
+    input = open(source, 'rb')
+    try:
+        output = open(dest, 'wb')
+        try:
+            if mode == 'reflink':
+                try:
+                    from fcntl import ioctl
+                    ioctl(output.fileno(), FICLONE, input.fileno())
+                    return
+                except (ImportError, IOError):
+                    pass
+            if not copy_fd(input.fileno(), output.fileno()):
+                copyfileobj(input, output, 1048576)
+        finally:
+            output.close()
+    finally:
+        input.close()
+
+def stat_key(path, stat=stat):
+    info = stat(path)
+    return (info.st_size, int(info.st_mtime * 1000000000), info.st_ino)
+
+def get_tool_version(bin):
+    """Return an identifier for the installed version of a command."""
+    if bin not in TOOLS:
+        from distutils.spawn import find_executable
+        path = find_executable(bin)
+        if path:
+            path = realpath(path)
+            TOOLS[bin] = '%s:%s:%s:%s' % ((path,) + stat_key(path))
+        else:
+            TOOLS[bin] = bin
+    return TOOLS[bin]
+
+def write_atomic(path, content):
+    # The temp file is unique to the thread, so that concurrent writers of
+    # the same path don't clobber each other's temp file.
+    tmp_path = '%s.%s.%s.tmp' % (path, getpid(), current_thread().ident)
+    try:
+        file = open(tmp_path, 'wb')
+        try:
+            file.write(content)
+        finally:
+            file.close()
+        rename(tmp_path, path)
+    except:
+        if isfile(tmp_path):
+            remove(tmp_path)
+        raise
+
+def decode_yaml(data):
+    """Parse the YAML data, using the libyaml based loader if available."""
+    from yaml import load
+    try:
+        from yaml import CSafeLoader as SafeLoader
+    except ImportError:
+        from yaml import SafeLoader
+    return load(data, SafeLoader)
+
+def load_config(data, digest, cache_path):
+    """Return the parsed config data, reusing the result from the previous
+    run if the data hasn't changed, so that yaml doesn't even get imported.
+    """
+    try:
+        file = open(cache_path, 'rb')
+        try:
+            cached_digest, config = load(file)
+        finally:
+            file.close()
+        if cached_digest == digest:
+            return config
+    except Exception:
+        pass
+    config = decode_yaml(data)
+    write_atomic(cache_path, dumps((digest, config), 2))
+    return config
+
+def execute(args, **kwargs):
+    with trace(basename(args[0]), 'command', argv=args) as info:
+        ret, err, retcode = dispatch(args, **kwargs)
+        if TRACER.enabled:
+            info['bytes_in'] = len(kwargs.get('input') or '') + sum(
+                getsize(arg) for arg in args[1:] if isfile(arg)
+                )
+            info['bytes_out'] = len(ret or '')
+            info['exit'] = retcode
+        return ret, err, retcode
+
+def dispatch(args, input=None, **kwargs):
+    worker = WORKERS.get(args[0])
+    if worker and not worker.disabled:
+        try:
+            ret, err, retcode = worker.run(args, kwargs.get('cwd'), input or '')
+        except WorkerError, error:
+            log.error("!! Disabling worker for %s: %s" % (args[0], error))
+            worker.disabled = True
+        else:
+            if not kwargs['redirect_stderr'] and err:
+                sys.stderr.write(err)
+            return ret, err, retcode
+    if input is not None:
+        return pipe_command(args, input, **kwargs)
     kwargs["exit_on_error"] = 0
     kwargs["retcode"] = 1
+    kwargs["reterror"] = 1
     kwargs['redirect_stdout'] = 1
+    from tavutil.env import run_command
+    return run_command(args, **kwargs)
+
+def pipe_command(args, input, redirect_stderr=1, cwd=None):
+    """Run the command with the input fed to its stdin, and return its
+    stdout, stderr and return code."""
+    from subprocess import PIPE, Popen
+    try:
+        process = Popen(
+            args, stdin=PIPE, stdout=PIPE,
+            stderr=redirect_stderr and PIPE or None, cwd=cwd,
+            universal_newlines=True
+            )
+    except OSError, error:
+        if error.errno == ENOENT:
+            from tavutil.env import CommandNotFound
+            raise CommandNotFound(args[0])
+        raise
+    # The input is written and the output read concurrently, so that large
+    # bundles don't deadlock on full pipe buffers.
+    ret, err = process.communicate(input)
+    return ret, err, process.returncode
+
+def do(args, **kwargs):
     kwargs['redirect_stderr'] = 0
-    ret, retcode = run_command(args, **kwargs)
+    ret, _, retcode = execute(args, **kwargs)
     if retcode:
         raise AppExit()
     return ret
 
 def do_with_stderr(args, **kwargs):
-    kwargs["exit_on_error"] = 0
-    kwargs["retcode"] = 1
-    kwargs["reterror"] = 1
-    kwargs['redirect_stdout'] = 1
     kwargs['redirect_stderr'] = 1
-    ret, err, retcode = run_command(args, **kwargs)
+    ret, err, retcode = execute(args, **kwargs)
     if retcode:
         if err.strip():
             print err.strip()
@@ -164,33 +419,6 @@ def exit(msg):
     log.error(msg)
     raise AppExit(msg)
 
-def get_downloaded_source(url, https=None, root=DOWNLOADS_PATH):
-    if not isdir(root):
-        makedirs(root)
-    if https:
-        path = url[8:]
-    else:
-        path = url[7:]
-    s = split_posix(path)
-    if len(s) > 1:
-        p = join(root, *s[:-1])
-        if not isdir(p):
-            makedirs(p)
-        p = join(p, s[-1])
-    else:
-        p = join(root, s[0])
-    if isfile(p):
-        return [p]
-    log.info("Downloading: %s" % url)
-    r = get_url(url)
-    if r.status_code != 200:
-        exit("Couldn't download %s (Got %d)" % (url, r.status_code))
-    log.info("Saving to: %s" % p)
-    f = open(p, 'wb')
-    f.write(r.content)
-    f.close()
-    return [p]
-
 @contextmanager
 def tempdir():
     """Return a temporary directory and remove it upon exiting the context."""
@@ -201,6 +429,1053 @@ def tempdir():
     finally:
         rmtree(path)
 
+# ------------------------------------------------------------------------------
+# Tracing
+# ------------------------------------------------------------------------------
+
+class Span(object):
+    """Context manager which records a trace event for the enclosed block.
+
+    It returns a dict, which can be updated with details to include in the
+    event's ``args``.
+    """
+
+    __slots__ = ('args', 'cat', 'name', 'start', 'tracer')
+
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time()
+        return self.args
+
+    def __exit__(self, type, value, traceback):
+        end = time()
+        if type is not None:
+            self.args['error'] = type.__name__
+        self.tracer.add(self.name, self.cat, self.start, end, self.args)
+
+class NullSpan(object):
+
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+class Tracer(object):
+    """Collector of timing spans in the Chrome trace event format."""
+
+    enabled = False
+
+    def __init__(self):
+        self.events = []
+        self.lock = Lock()
+        self.null = NullSpan()
+        self.origin = time()
+        self.threads = {}
+
+    def add(self, name, cat, start, end, args):
+        thread = current_thread()
+        with self.lock:
+            if thread.ident not in self.threads:
+                self.threads[thread.ident] = thread.name
+            self.events.append((name, cat, start, end, thread.ident, args))
+
+    def span(self, name, cat, **args):
+        if not self.enabled:
+            return self.null
+        return Span(self, name, cat, args)
+
+    def save(self, path):
+        pid = getpid()
+        origin = self.origin
+        events = []
+        for ident, name in sorted(self.threads.iteritems()):
+            events.append({
+                'args': {'name': name}, 'name': 'thread_name', 'ph': 'M',
+                'pid': pid, 'tid': ident
+                })
+        for name, cat, start, end, ident, args in self.events:
+            events.append({
+                'args': args,
+                'cat': cat,
+                'dur': int((end - start) * 1000000),
+                'name': name,
+                'ph': 'X',
+                'pid': pid,
+                'tid': ident,
+                'ts': int((start - origin) * 1000000),
+                })
+        write_atomic(path, enc_json({
+            'displayTimeUnit': 'ms', 'traceEvents': events
+            }, default=repr))
+        log.info("Saved trace: %s" % path)
+
+    def summary(self, limit=10):
+        """Print tables of the slowest assets and commands."""
+        assets = {}
+        commands = []
+        for name, cat, start, end, _, args in self.events:
+            if cat in ('fresh', 'generate'):
+                assets[name] = assets.get(name, 0) + end - start
+            elif cat == 'command':
+                commands.append((end - start, ' '.join(args['argv'])))
+        assets = sorted(
+            ((duration, name) for name, duration in assets.iteritems()),
+            reverse=True
+            )
+        commands.sort(reverse=True)
+        for title, rows in (('Assets', assets), ('Commands', commands)):
+            if not rows:
+                continue
+            print
+            print "Slowest %s:" % title
+            print
+            for duration, name in rows[:limit]:
+                if len(name) > 68:
+                    name = name[:65] + '...'
+                print "  %8.3fs  %s" % (duration, name)
+        print
+
+TRACER = Tracer()
+trace = TRACER.span
+
+# ------------------------------------------------------------------------------
+# Compiler Workers
+# ------------------------------------------------------------------------------
+
+class WorkerError(Exception):
+    """Exception to signal that a compiler worker is unusable."""
+
+class Worker(object):
+    """Pool of long-lived processes which run compiler jobs.
+
+    Jobs are sent using the framing protocol described in assetgen.worker.
+    Processes are started on demand, health checked when started and after
+    being idle, and restarted if they crash.
+    """
+
+    disabled = False
+    idle_check = 30
+
+    def __init__(self, cmd, size=1):
+        self.cmd = cmd
+        self.size = size
+        self.cond = Condition()
+        self.count = 0
+        self.idle = []
+
+    def acquire(self):
+        with self.cond:
+            while not self.idle and self.count >= self.size:
+                self.cond.wait(86400)
+            if self.idle:
+                process, last_used = self.idle.pop()
+            else:
+                self.count += 1
+                process = last_used = None
+        try:
+            if process and process.poll() is None:
+                if time() - last_used < self.idle_check:
+                    return process
+                try:
+                    self.ping(process)
+                    return process
+                except (EnvironmentError, EOFError, ValueError):
+                    self.kill(process)
+            elif process:
+                log.error("!! Worker exited: %s" % ' '.join(self.cmd))
+            return self.start()
+        except BaseException:
+            self.release(None)
+            raise
+
+    def kill(self, process):
+        try:
+            process.kill()
+            process.wait()
+        except EnvironmentError:
+            pass
+
+    def ping(self, process):
+        header, _ = self.request(process, {'ping': 1})
+        if header.get('status') != 0:
+            raise ValueError("Unexpected response to ping")
+
+    def release(self, process):
+        with self.cond:
+            if process is None:
+                self.count -= 1
+            else:
+                self.idle.append((process, time()))
+            self.cond.notify()
+
+    def request(self, process, header, body=''):
+        write_message(process.stdin, header, body)
+        return read_message(process.stdout)
+
+    def run(self, args, cwd=None, input=''):
+        request = {'args': args[1:], 'cwd': cwd or getcwd()}
+        for attempt in (0, 1):
+            process = self.acquire()
+            done = False
+            try:
+                header, body = self.request(process, request, input)
+                done = True
+            except (EnvironmentError, EOFError, ValueError), error:
+                if attempt:
+                    raise WorkerError(error)
+                log.error("!! Restarting worker: %s" % ' '.join(self.cmd))
+                continue
+            finally:
+                # The slot is always given back, even on KeyboardInterrupt
+                # and the like. A worker interrupted mid-request is in an
+                # unknown state, so it gets killed.
+                if done:
+                    self.release(process)
+                else:
+                    self.kill(process)
+                    self.release(None)
+            return body, header.get('stderr') or '', header.get('status', 1)
+
+    def start(self):
+        from subprocess import PIPE, Popen
+        try:
+            process = Popen(self.cmd, stdin=PIPE, stdout=PIPE, close_fds=True)
+        except OSError, error:
+            raise WorkerError(error)
+        try:
+            self.ping(process)
+        except (EnvironmentError, EOFError, ValueError), error:
+            self.kill(process)
+            raise WorkerError("Failed health check (%s)" % error)
+        return process
+
+    def stop(self):
+        with self.cond:
+            idle, self.idle = self.idle, []
+            self.count -= len(idle)
+        for process, _ in idle:
+            try:
+                process.stdin.close()
+                process.wait()
+            except EnvironmentError:
+                pass
+
+def register_worker(bin, worker):
+    existing = WORKERS.get(bin)
+    if existing:
+        existing.stop()
+    WORKERS[bin] = worker
+
+@atexit
+def stop_workers():
+    for worker in WORKERS.values():
+        worker.stop()
+
+# ------------------------------------------------------------------------------
+# Compilation Cache
+# ------------------------------------------------------------------------------
+
+class CompileCache(object):
+    """Size-bounded on-disk cache of compiler output.
+
+    Entries are evicted in least recently used order, using the file mtimes
+    which get bumped on every cache hit.
+    """
+
+    def __init__(self, directory, maxsize):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.added = 0
+
+    def get(self, key):
+        path = join(self.directory, key[:2], key)
+        try:
+            file = open(path, 'rb')
+        except IOError:
+            return
+        try:
+            content = file.read()
+        finally:
+            file.close()
+        try:
+            utime(path, None)
+        except OSError:
+            pass
+        return content
+
+    def set(self, key, content):
+        directory = join(self.directory, key[:2])
+        ensure_dir(directory)
+        path = join(directory, key)
+        try:
+            write_atomic(path, content)
+        except OSError:
+            # Entries are keyed by content, so if another thread has already
+            # written the entry, it holds the same output.
+            if not isfile(path):
+                raise
+            return
+        self.added += len(content)
+
+    def prune(self):
+        if not self.added:
+            return
+        self.added = 0
+        entries = []
+        total = 0
+        for directory, _, files in walk(self.directory):
+            for file in files:
+                path = join(directory, file)
+                try:
+                    info = stat(path)
+                except OSError:
+                    continue
+                entries.append((info.st_mtime, info.st_size, path))
+                total += info.st_size
+        if total <= self.maxsize:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            try:
+                remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.maxsize:
+                break
+
+# ------------------------------------------------------------------------------
+# Build State
+# ------------------------------------------------------------------------------
+
+STATE_KINDS = (
+    'built', 'fingerprints', 'hashes', 'manifest', 'meta', 'output_data',
+    'prereq_data'
+    )
+
+class StateDict(dict):
+    """Dict which keeps track of the keys that have been changed."""
+
+    def __init__(self, *args):
+        dict.__init__(self, *args)
+        self.dirty = set()
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self.dirty.add(key)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.dirty.add(key)
+
+    def pop(self, key, *default):
+        self.dirty.add(key)
+        return dict.pop(self, key, *default)
+
+    def setdefault(self, key, default=None):
+        # The value is usually mutated in place by the caller.
+        self.dirty.add(key)
+        return dict.setdefault(self, key, default)
+
+class StateStore(object):
+    """Persistent build state, stored as individual records in sqlite.
+
+    The state is made up of a StateDict for each of the STATE_KINDS, and
+    only the records which have changed get written on save -- within a
+    single transaction.
+    """
+
+    def __init__(self, path, legacy_path=None):
+        self.path = path
+        self.data = dict((kind, StateDict()) for kind in STATE_KINDS)
+        self.db = None
+        exists = isfile(path)
+        try:
+            try:
+                self.open()
+                if exists:
+                    self.load()
+            except OperationalError:
+                # Errors like "database is locked" don't mean that the state
+                # is corrupt, so it is left alone.
+                raise
+            except DatabaseError, error:
+                log.error(
+                    "!! Discarding unreadable build state at %s: %s"
+                    % (path, error)
+                    )
+                self.data = dict((kind, StateDict()) for kind in STATE_KINDS)
+                self.close()
+                self.discard()
+                self.open()
+                exists = False
+        except (EnvironmentError, OperationalError), error:
+            self.close()
+            exit("Couldn't open the build state at %s (%s)" % (path, error))
+        if not exists and legacy_path and isfile(legacy_path):
+            self.migrate(legacy_path)
+
+    def open(self):
+        ensure_dir(dirname(self.path))
+        self.db = db = connect_db(self.path)
+        db.text_factory = str
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            "kind TEXT NOT NULL, key BLOB NOT NULL, value BLOB NOT NULL, "
+            "PRIMARY KEY (kind, key))"
+            )
+        db.commit()
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def discard(self):
+        """Move the database aside, along with its WAL and shared memory
+        files, so that a fresh one can be created in its place."""
+        path = self.path
+        for suffix in ('', '-wal', '-shm'):
+            if isfile(path + suffix):
+                rename(path + suffix, path + '.corrupt' + suffix)
+
+    def load(self):
+        data = self.data
+        bad = []
+        for kind, key, value in self.db.execute(
+            "SELECT kind, key, value FROM state"
+            ):
+            if kind not in data:
+                continue
+            try:
+                dict.__setitem__(
+                    data[kind], loads(str(key)), loads(str(value))
+                    )
+            except Exception, error:
+                # A row which can't be unpickled only loses that record, so
+                # it is dropped rather than discarding the whole state.
+                log.error(
+                    "!! Skipping unreadable %s record in %s: %s"
+                    % (kind, self.path, error)
+                    )
+                bad.append((kind, key))
+        if bad:
+            with self.db:
+                self.db.executemany(
+                    "DELETE FROM state WHERE kind = ? AND key = ?", bad
+                    )
+
+    def migrate(self, legacy_path):
+        """Import the state from the pickle file used by earlier versions."""
+        file = open(legacy_path, 'rb')
+        try:
+            legacy = load(file)
+        except Exception:
+            legacy = {}
+        file.close()
+        data = self.data
+        for kind, records in legacy.iteritems():
+            if kind == 'snapshot':
+                data['meta']['snapshot'] = records
+            elif kind in data:
+                for key, value in records.iteritems():
+                    data[kind][key] = value
+        self.save()
+        remove(legacy_path)
+        log.info("Migrated build state from %s" % legacy_path)
+
+    def save(self):
+        updates = []
+        deletes = []
+        for kind, records in self.data.iteritems():
+            dirty = records.dirty
+            if not dirty:
+                continue
+            records.dirty = set()
+            for key in dirty:
+                if key in records:
+                    updates.append((
+                        kind, buffer(dumps(key, 2)),
+                        buffer(dumps(records[key], 2))
+                        ))
+                else:
+                    deletes.append((kind, buffer(dumps(key, 2))))
+        if not (updates or deletes):
+            return
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO state (kind, key, value) "
+                "VALUES (?, ?, ?)", updates
+                )
+            self.db.executemany(
+                "DELETE FROM state WHERE kind = ? AND key = ?", deletes
+                )
+
+    def remove(self):
+        self.close()
+        for path in (self.path, self.path + '-wal', self.path + '-shm'):
+            if isfile(path):
+                remove(path)
+
+# ------------------------------------------------------------------------------
+# File Watchers
+# ------------------------------------------------------------------------------
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0x00080000
+
+IN_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+    IN_CREATE | IN_DELETE
+    )
+
+class InotifyWatcher(object):
+    """File watcher using the Linux inotify API via ctypes.
+
+    Directories are watched rather than individual files, so that editors
+    which save by renaming a new file into place are handled too.
+    """
+
+    event_format = 'iIII'
+    event_size = calcsize(event_format)
+
+    def __init__(self, debounce=0.1):
+        from ctypes import get_errno
+        libc = get_libc()
+        self.add_watch = libc.inotify_add_watch
+        self.fd = fd = libc.inotify_init1(IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(get_errno(), strerror(get_errno()))
+        self.debounce = debounce
+        self.directories = {}
+        self.trees = set()
+        self.watched = set()
+
+    def add(self, path):
+        self.add_directory(dirname(path))
+
+    def add_directory(self, directory):
+        if directory in self.watched:
+            return
+        wd = self.add_watch(self.fd, directory, IN_MASK)
+        if wd >= 0:
+            # The same inode may already be watched via another path.
+            self.watched.discard(self.directories.get(wd))
+            self.directories[wd] = directory
+            self.watched.add(directory)
+
+    def add_tree(self, root):
+        self.trees.add(root)
+        for directory, _, _ in walk(root):
+            self.add_directory(directory)
+
+    def read(self, changed):
+        data = read_fd(self.fd, 65536)
+        size = self.event_size
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = unpack_from(self.event_format, data, offset)
+            offset += size
+            name = data[offset:offset+length].rstrip('\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return True
+            if mask & IN_IGNORED:
+                self.watched.discard(self.directories.pop(wd, None))
+                continue
+            directory = self.directories.get(wd)
+            if directory is None or not name:
+                continue
+            path = join(directory, name)
+            changed.add(path)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                for root in self.trees:
+                    if path.startswith(root):
+                        self.add_tree(path)
+                        break
+
+    def wait(self):
+        """Block until files change, and return the set of changed paths,
+        or None if the changes could not be tracked."""
+        changed = set()
+        overflow = False
+        timeout = None
+        while 1:
+            if not select([self.fd], [], [], timeout)[0]:
+                break
+            if self.read(changed):
+                overflow = True
+            # Keep collecting until no events arrive within the debounce
+            # window, as saves often generate a burst of events.
+            timeout = self.debounce
+        if overflow:
+            return
+        return changed
+
+class PollingWatcher(object):
+    """File watcher which polls for changes."""
+
+    def __init__(self, interval=1):
+        self.interval = interval
+        self.files = {}
+        self.trees = set()
+
+    def add(self, path):
+        if path not in self.files:
+            self.files[path] = self.get_info(path)
+
+    def add_tree(self, root):
+        self.trees.add(root)
+        for directory, _, files in walk(root):
+            for file in files:
+                self.add(join(directory, file))
+
+    def get_info(self, path):
+        try:
+            return stat_key(path)
+        except OSError:
+            return
+
+    def wait(self):
+        files = self.files
+        while 1:
+            sleep(self.interval)
+            changed = set()
+            for path, info in files.items():
+                new = self.get_info(path)
+                if new != info:
+                    files[path] = new
+                    changed.add(path)
+            for root in self.trees:
+                for directory, _, filenames in walk(root):
+                    for file in filenames:
+                        path = join(directory, file)
+                        if path not in files:
+                            files[path] = self.get_info(path)
+                            changed.add(path)
+            if changed:
+                return changed
+
+def get_watcher():
+    try:
+        return InotifyWatcher()
+    except (AttributeError, EnvironmentError):
+        log.info("Falling back to polling for file changes")
+        return PollingWatcher()
+
+# ------------------------------------------------------------------------------
+# Parallel Scheduler
+# ------------------------------------------------------------------------------
+
+def schedule(items, graph, func, jobs):
+    """Call ``func`` on each item using a pool of ``jobs`` worker threads.
+
+    The ``graph`` maps each item to the items it depends on, and an item is
+    only started once all of its dependencies have finished. Dependencies
+    which are not themselves in ``items`` are ignored. Items that are
+    ready at the same time are started in the order given. The results are
+    returned in the same order as ``items``.
+
+    If a call fails, no further items are started, and the first error is
+    re-raised once the calls which are already running have finished.
+    """
+
+    pending = dict.fromkeys(items, 0)
+    waiting = {}
+    for item in items:
+        for need in graph.get(item, ()):
+            if need in pending:
+                pending[item] += 1
+                waiting.setdefault(need, []).append(item)
+
+    ready = Queue()
+    done = Queue()
+    results = {}
+    # Set on the first failure, so that queued items don't get started.
+    failed = Event()
+
+    def worker():
+        while 1:
+            item = ready.get()
+            if item is None:
+                return
+            if failed.is_set():
+                done.put((item, None, None))
+                continue
+            try:
+                done.put((item, func(item), None))
+            except BaseException:
+                failed.set()
+                done.put((item, None, sys.exc_info()))
+
+    workers = []
+    for i in range(min(jobs, len(items)) or 1):
+        thread = Thread(target=worker, name='assetgen-worker-%d' % i)
+        thread.daemon = True
+        thread.start()
+        workers.append(thread)
+
+    running = 0
+    error = None
+    for item in items:
+        if not pending[item]:
+            ready.put(item)
+            running += 1
+
+    try:
+        while running:
+            # Use a timeout so that the wait can be interrupted by Ctrl-C.
+            item, result, exc_info = done.get(True, 86400)
+            running -= 1
+            if exc_info:
+                if not error:
+                    error = exc_info
+                continue
+            results[item] = result
+            if error:
+                continue
+            for dependent in waiting.get(item, ()):
+                pending[dependent] -= 1
+                if not pending[dependent]:
+                    ready.put(dependent)
+                    running += 1
+    finally:
+        for thread in workers:
+            ready.put(None)
+
+    if error:
+        raise error[0], error[1], error[2]
+
+    if len(results) != len(items):
+        exit("Found a dependency cycle between: %s" % ', '.join(
+            str(item) for item in items if item not in results
+            ))
+
+    return [results[key] for key in items]
+
+# ------------------------------------------------------------------------------
+# Precompression
+# ------------------------------------------------------------------------------
+
+TEXT_EXTENSIONS = frozenset([
+    '.css', '.htm', '.html', '.js', '.json', '.map', '.svg', '.txt', '.xml'
+    ])
+
+def gzip_compress(content):
+    from gzip import GzipFile
+    buffer = StringIO()
+    # Leave out the filename and timestamp so that the output is
+    # reproducible.
+    file = GzipFile('', 'wb', 9, buffer, 0)
+    try:
+        file.write(content)
+    finally:
+        file.close()
+    return buffer.getvalue()
+
+def zopfli_compress(content):
+    from zopfli.gzip import compress
+    return compress(content)
+
+COMPRESSORS = {
+    'gzip': gzip_compress,
+    'zopfli': zopfli_compress,
+    }
+
+# ------------------------------------------------------------------------------
+# Stat Cache
+# ------------------------------------------------------------------------------
+
+class StatCache(object):
+    """Snapshot of file stat info which can be shared between runners."""
+
+    def __init__(self):
+        self.cache = {}
+
+    def clear(self):
+        self.cache.clear()
+
+    def discard(self, path):
+        self.cache.pop(path, None)
+
+    def get(self, path):
+        """Return the stat info for the path, or None if it doesn't exist."""
+        try:
+            return self.cache[path]
+        except KeyError:
+            pass
+        try:
+            info = stat(path)
+        except OSError:
+            info = None
+        self.cache[path] = info
+        return info
+
+    def isfile(self, path):
+        info = self.get(path)
+        return info is not None and S_ISREG(info.st_mode)
+
+    def stat(self, path):
+        info = self.get(path)
+        if info is None:
+            raise OSError(ENOENT, strerror(ENOENT), path)
+        return info
+
+# ------------------------------------------------------------------------------
+# Glob Support
+# ------------------------------------------------------------------------------
+
+def compile_glob(pattern):
+    """Return a match function for the glob pattern.
+
+    For backwards compatibility, patterns without ``**`` use fnmatch
+    semantics, where ``*`` also matches path separators. Otherwise, ``*``
+    and ``?`` only match within a path segment, and ``**`` matches any
+    number of directories.
+    """
+    if pattern in GLOBS:
+        return GLOBS[pattern]
+    if '**' not in pattern:
+        match = GLOBS[pattern] = compile_regex(translate(pattern)).match
+        return match
+    regex = ['(?ms)']; add = regex.append
+    i, n = 0, len(pattern)
+    while i < n:
+        char = pattern[i]
+        i += 1
+        if char == '*':
+            if pattern[i:i+1] == '*':
+                i += 1
+                if pattern[i:i+1] == '/':
+                    i += 1
+                    add('(?:.*/)?')
+                else:
+                    add('.*')
+            else:
+                add('[^/]*')
+        elif char == '?':
+            add('[^/]')
+        elif char == '[':
+            j = pattern.find(']', i + 1)
+            if j == -1:
+                add('\\[')
+            else:
+                chars = pattern[i:j].replace('\\', '\\\\')
+                if chars[0] == '!':
+                    chars = '^' + chars[1:]
+                add('[%s]' % chars)
+                i = j + 1
+        else:
+            add(escape_regex(char))
+    add('\\Z')
+    match = GLOBS[pattern] = compile_regex(''.join(regex)).match
+    return match
+
+class DirectoryIndex(object):
+    """Index of the files within directory trees, for expanding globs.
+
+    Each tree is only walked once, and can be kept up to date from the
+    changes seen by a file watcher.
+    """
+
+    def __init__(self):
+        self.trees = {}
+
+    def clear(self):
+        self.trees.clear()
+
+    def files(self, root):
+        """Return a sorted list of all the files within the root."""
+        root = normpath(root)
+        trees = self.trees
+        if root in trees:
+            return trees[root]
+        prefix = root + '/'
+        for tree, files in trees.iteritems():
+            if prefix.startswith(tree + '/'):
+                return [path for path in files if path.startswith(prefix)]
+        files = trees[root] = []
+        for directory, _, filenames in walk(root):
+            for file in filenames:
+                files.append(join(directory, file))
+        files.sort()
+        return files
+
+    def glob(self, pattern, excludes=()):
+        root = split(pattern.partition('*')[0])[0]
+        match = compile_glob(pattern)
+        excludes = [compile_glob(exclude) for exclude in excludes]
+        return [
+            path for path in self.files(root)
+            if match(path) and not any(exclude(path) for exclude in excludes)
+            ]
+
+    def update(self, changed):
+        for tree, files in self.trees.iteritems():
+            prefix = tree + '/'
+            for path in changed:
+                if not path.startswith(prefix):
+                    continue
+                if isfile(path):
+                    idx = bisect_left(files, path)
+                    if idx == len(files) or files[idx] != path:
+                        files.insert(idx, path)
+                elif isdir(path):
+                    known = set(files)
+                    for directory, _, filenames in walk(path):
+                        for file in filenames:
+                            file = join(directory, file)
+                            if file not in known:
+                                known.add(file)
+                                insort(files, file)
+                else:
+                    subprefix = path + '/'
+                    files[:] = [
+                        file for file in files
+                        if file != path and not file.startswith(subprefix)
+                        ]
+
+# ------------------------------------------------------------------------------
+# Downloads
+# ------------------------------------------------------------------------------
+
+class Downloader(object):
+    """Fetcher for HTTP/HTTPS sources which reuses pooled connections.
+
+    Downloads are streamed to disk and atomically renamed into place. The
+    ETag and Last-Modified headers are kept alongside each file, so that
+    when ``refresh`` is set, cached files get revalidated with conditional
+    requests.
+    """
+
+    concurrency = 8
+    refresh = False
+
+    def __init__(self, root=DOWNLOADS_PATH):
+        self.root = root
+        self.lock = Lock()
+        self.locks = {}
+        self.seen = set()
+        self.session = None
+
+    def fetch(self, url):
+        path = self.get_path(url)
+        with self.get_lock(url):
+            if isfile(path) and (not self.refresh or url in self.seen):
+                return path
+            with trace(url, 'download') as info:
+                info['status'] = self.download(url, path)
+            self.seen.add(url)
+        return path
+
+    def download(self, url, path):
+        headers = {}
+        meta_path = path + '.meta'
+        if isfile(path) and isfile(meta_path):
+            try:
+                meta = dec_json(read(meta_path))
+            except ValueError:
+                meta = {}
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last-modified'):
+                headers['If-Modified-Since'] = meta['last-modified']
+            log.info("Revalidating: %s" % url)
+        else:
+            log.info("Downloading: %s" % url)
+        r = self.get_session().get(url, headers=headers, stream=True)
+        try:
+            if r.status_code == 304:
+                return 304
+            if r.status_code != 200:
+                exit("Couldn't download %s (Got %d)" % (url, r.status_code))
+            log.info("Saving to: %s" % path)
+            ensure_dir(dirname(path))
+            tmp_path = '%s.%s.tmp' % (path, getpid())
+            try:
+                file = open(tmp_path, 'wb')
+                try:
+                    for chunk in r.iter_content(65536):
+                        file.write(chunk)
+                finally:
+                    file.close()
+                # Connections which get closed early would otherwise leave a
+                # truncated file which looks like a complete download.
+                length = r.headers.get('content-length')
+                if length and length.isdigit() and r.raw.tell() != int(length):
+                    exit("Couldn't download %s (Incomplete response)" % url)
+                rename(tmp_path, path)
+            except:
+                if isfile(tmp_path):
+                    remove(tmp_path)
+                raise
+            meta = {}
+            for header in ('etag', 'last-modified'):
+                if header in r.headers:
+                    meta[header] = r.headers[header]
+            write_atomic(meta_path, enc_json(meta))
+            return 200
+        finally:
+            r.close()
+
+    def get_lock(self, url):
+        with self.lock:
+            if url not in self.locks:
+                self.locks[url] = Lock()
+            return self.locks[url]
+
+    def get_path(self, url):
+        if url.startswith('https://'):
+            path = url[8:]
+        else:
+            path = url[7:]
+        return join(self.root, *split_posix(path))
+
+    def get_session(self):
+        with self.lock:
+            if self.session is None:
+                from requests import Session
+                from requests.adapters import HTTPAdapter
+                size = self.concurrency
+                adapter = HTTPAdapter(pool_connections=size, pool_maxsize=size)
+                self.session = session = Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+            return self.session
+
+    def prefetch(self, urls):
+        urls = sorted(set(urls))
+        if urls:
+            schedule(urls, {}, self.fetch, self.concurrency)
+
+def get_downloader(root=DOWNLOADS_PATH):
+    if root not in DOWNLOADERS:
+        DOWNLOADERS[root] = Downloader(root)
+    return DOWNLOADERS[root]
+
+def get_downloaded_source(url, https=None, root=DOWNLOADS_PATH):
+    return [get_downloader(root).fetch(url)]
+
+def is_url(path):
+    return path.startswith('http://') or path.startswith('https://')
+
 # ------------------------------------------------------------------------------
 # Raw Text Class
 # ------------------------------------------------------------------------------
@@ -211,6 +1486,103 @@ class Raw(object):
     def __init__(self, text):
         self.text = text
 
+def group_sources(sources, extensions):
+    """Yield (extension, sources) pairs for the given sources, grouping
+    consecutive files with the same extension from ``extensions``. All other
+    sources are yielded on their own with an extension of None."""
+
+    group = []; current = None
+    for source in sources:
+        ext = None
+        if not isinstance(source, Raw):
+            ext = splitext(source)[1]
+            if ext not in extensions:
+                ext = None
+        if group and ext != current:
+            yield current, group
+            group = []
+        if ext:
+            current = ext
+            group.append(source)
+        else:
+            yield None, [source]
+    if group:
+        yield current, group
+
+# ------------------------------------------------------------------------------
+# Stylesheet Imports
+# ------------------------------------------------------------------------------
+
+# The extensions which are tried when resolving an import from a stylesheet,
+# keyed by the extension of the importing file.
+IMPORT_EXTENSIONS = {
+    '.less': ('.less', '.css'),
+    '.sass': ('.sass', '.scss', '.css'),
+    '.scss': ('.scss', '.sass', '.css'),
+    '.styl': ('.styl', '.css')
+    }
+
+import_regex = compile_regex(
+    r'@(?:import|use|forward|require)\s+(?:\([^)]*\)\s*)?([^;\n]+)'
+    )
+import_name_regex = compile_regex(
+    r'url\(\s*["\']?([^"\')]+)["\']?\s*\)|["\']([^"\']+)["\']'
+    )
+
+def get_import_candidates(path, exts):
+    """Yield the files that an import of the given path may refer to."""
+    ext = splitext(path)[1]
+    if ext in exts:
+        yield path
+    directory, name = split(path)
+    for ext in exts:
+        yield path + ext
+        yield join(directory, '_' + name + ext)
+    for ext in exts:
+        yield join(path, 'index' + ext)
+        yield join(path, '_index' + ext)
+
+def find_imports(path, text, load_path, isfile=isfile):
+    """Return the files which the stylesheet at ``path`` imports directly,
+    resolved relative to it and then against the ``load_path``.
+
+    None is returned if an import can't be resolved to a file, e.g. if it
+    uses interpolation, so that callers can assume the worst.
+    """
+    exts = IMPORT_EXTENSIONS[splitext(path)[1]]
+    directories = [dirname(path)] + list(load_path)
+    imports = []
+    for match in import_regex.finditer(text):
+        spec = match.group(1)
+        names = [
+            url or name for url, name in import_name_regex.findall(spec)
+            ]
+        if not names:
+            # Sass, in its indented syntax, and Stylus allow bare imports.
+            names = [
+                part.split()[0] for part in spec.split(',') if part.strip()
+                ]
+        for name in names:
+            if is_url(name) or name.startswith('//') or \
+                    name.startswith('sass:'):
+                continue
+            if '#{' in name or '{' in name or '*' in name:
+                return
+            for directory in directories:
+                found = None
+                for candidate in get_import_candidates(
+                    join(directory, name), exts
+                    ):
+                    if isfile(candidate):
+                        found = normpath(candidate)
+                        break
+                if found:
+                    imports.append(found)
+                    break
+            else:
+                return
+    return imports
+
 # ------------------------------------------------------------------------------
 # Base Asset Class
 # ------------------------------------------------------------------------------
@@ -218,6 +1590,8 @@ class Raw(object):
 class Asset(object):
     """Base generator class for Assets."""
 
+    prereq = False
+
     def __init__(self, runner, path, sources, depends, spec):
         self.runner = runner
         self.path = path
@@ -230,11 +1604,132 @@ class Asset(object):
 
     __repr__ = __str__
 
+    def compile(self, source, cmd, build=None, imports=False):
+        """Return the output of compiling a single source file with the
+        given command, reusing earlier output from the compilation cache.
+
+        The ``cmd`` should be the logical command line for the source. Set
+        ``imports`` for compilers where a source may include other files, so
+        that changes to the files it imports, or to the asset's configured
+        depends, invalidate the output.
+        """
+        if build is None:
+            build = lambda: do(cmd)
+        return self.runner.compile(
+            source, cmd, build, imports and self.get_source_depends(source)
+            or ()
+            )
+
+    def compile_batch(
+        self, sources, cmd, ext, build=None, imports=False, reader=None,
+        group=False
+        ):
+        """Return the outputs of compiling each of the sources with the
+        given command, reusing earlier output from the compilation cache.
+
+        The sources which need compiling are copied into a temp workspace and
+        compiled with a single invocation of ``cmd``, which must write the
+        output for each file next to it with the given extension. If a
+        ``reader`` is given, it is called with the path of each copied source
+        to get its output instead. If only one source needs compiling and a
+        ``build`` function is given, it is called with the source instead.
+
+        Set ``group`` for compilers which need to see all of the sources at
+        once, so that a change to any of them recompiles all of them.
+        """
+        if reader is None:
+            reader = lambda path: read(splitext(path)[0] + ext)
+        def build_batch(todo):
+            if len(todo) == 1 and build:
+                return [build(todo[0])]
+            with tempdir() as td:
+                paths = []
+                for idx, source in enumerate(todo):
+                    # Each source gets its own directory, so that files with
+                    # the same name don't clash.
+                    directory = join(td, str(idx))
+                    makedirs(directory)
+                    path = join(directory, basename(source))
+                    copy(source, path)
+                    paths.append(path)
+                do(cmd + paths)
+                return map(reader, paths)
+        if group:
+            get_depends = lambda source: sources
+        elif imports:
+            get_depends = self.get_source_depends
+        else:
+            get_depends = None
+        return self.runner.compile_batch(
+            sources, cmd, build_batch, get_depends
+            )
+
+    def get_source_depends(self, source):
+        """Return the files which may affect the compiled output of the
+        source, i.e. the files it imports, directly or indirectly, along with
+        the asset's configured depends.
+
+        If any import can't be resolved, all of the asset's depends,
+        including its other sources, are returned instead.
+        """
+        get_source_imports = self.runner.get_source_imports
+        source = normpath(source)
+        seen = set([source])
+        todo = [source]
+        while todo:
+            imports = get_source_imports(todo.pop())
+            if imports is None:
+                return self.depends
+            for path in imports:
+                if path not in seen:
+                    seen.add(path)
+                    todo.append(path)
+        seen.remove(source)
+        seen.update(normpath(path) for path in self.get_imports())
+        return sorted(seen)
+
+    def get_imports(self):
+        """Return the explicitly configured depends of the asset, i.e. its
+        depends without its own source files."""
+        sources = set(
+            source for source in self.sources if not isinstance(source, Raw)
+            )
+        return sorted(set(self.depends).difference(sources))
+
+    def get_option_depends(self, cmd):
+        """Return the configured depends which are referred to by path or
+        module name in the given command, e.g. ``--define-from-module``."""
+        base_dir = self.runner.base_dir
+        args = set(cmd)
+        depends = []
+        for dep in self.get_imports():
+            filename = basename(dep)
+            names = (
+                dep, relpath(dep, base_dir), filename, splitext(filename)[0]
+                )
+            if args.intersection(names):
+                depends.append(dep)
+        return depends
+
     def emit(self, path, content, extension=''):
-        return self.runner.emit(self.path, path, content, extension)
+        return self.runner.emit(
+            self.path, path, content, extension, self.prereq
+            )
+
+    def emit_stream(self, path, chunks, extension=''):
+        return self.runner.emit_stream(
+            self.path, path, chunks, extension, self.prereq
+            )
+
+    def emit_file(self, path, source, extension='', mode=None):
+        return self.runner.emit_file(
+            self.path, path, source, extension, self.prereq, mode
+            )
 
     def is_fresh(self):
-        return self.runner.is_fresh(self.path, self.depends)
+        return self.runner.is_fresh(
+            self.path, self.depends, self.prereq, self.spec
+            )
 
     def generate(self):
         exit("No %s.generate() method implemented." % self.__class__.__name__)
@@ -243,13 +1738,44 @@ class Asset(object):
 # Binary Assets
 # ------------------------------------------------------------------------------
 
+LINK_MODES = frozenset(['hard', 'reflink'])
+
 class BinaryAsset(Asset):
     """Generator for Binary Assets."""
 
+    def __init__(self, *args):
+        super(BinaryAsset, self).__init__(*args)
+        link = self.spec.get('link')
+        if link and link not in LINK_MODES:
+            exit("Unknown link value for %s: %r" % (self.path, link))
+
     def generate(self):
-        self.emit(
-            self.path, ''.join(read(source) for source in self.sources)
-            )
+        sources = self.sources
+        if len(sources) == 1 and not isinstance(sources[0], Raw):
+            runner = self.runner
+            link = self.spec.get('link')
+            # Hashed outputs are meant to be immutable, which a hard link to
+            # a source that gets edited in place would break.
+            if link == 'hard' and not self.prereq and runner.hashed and \
+                    '%(hash)' in runner.output_template:
+                link = 'reflink'
+            self.emit_file(self.path, sources[0], mode=link)
+        else:
+            self.emit_stream(self.path, self.iter_chunks())
+
+    def iter_chunks(self, size=1048576):
+        for source in self.sources:
+            if isinstance(source, Raw):
+                yield source.text
+                continue
+            file = open(source, 'rb')
+            try:
+                chunk = file.read(size)
+                while chunk:
+                    yield chunk
+                    chunk = file.read(size)
+            finally:
+                file.close()
 
 register_handler('binary', BinaryAsset)
 
@@ -257,9 +1783,57 @@ register_handler('binary', BinaryAsset)
 # CSS Assets
 # ------------------------------------------------------------------------------
 
+class EmbedCache(object):
+    """Process-wide cache of base64 encoded resources for embedding.
+
+    Entries are keyed by path and stat info, and the least recently used
+    ones are evicted once the total size of the payloads exceeds
+    ``maxsize``.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.keys = {}
+        self.lock = Lock()
+        self.size = 0
+        self.types = {}
+
+    def get(self, path, info):
+        key = (path, info)
+        entries = self.entries
+        with self.lock:
+            if key in entries:
+                content = entries[key] = entries.pop(key)
+                return content
+        content = b64encode(read(path))
+        with self.lock:
+            if key in entries:
+                return content
+            old = self.keys.get(path)
+            if old in entries:
+                self.size -= len(entries.pop(old))
+            entries[key] = content
+            self.keys[path] = key
+            self.size += len(content)
+            while self.size > self.maxsize and entries:
+                old, stale = entries.popitem(last=False)
+                self.size -= len(stale)
+                if self.keys.get(old[0]) == old:
+                    del self.keys[old[0]]
+        return content
+
+    def get_type(self, path):
+        if path not in self.types:
+            from mimetypes import guess_type
+            self.types[path] = guess_type(path)[0]
+        return self.types[path]
+
+EMBEDS = EmbedCache(64 * 1024 * 1024)
+
 embed_regex = compile_regex(r'embed\("([^\)]*)"\)')
 find_embeds = embed_regex.findall
-substitute_embeds = embed_regex.sub
+split_embeds = embed_regex.split
 
 class CSSAsset(Asset):
     """Generator for CSS Assets."""
@@ -276,59 +1850,54 @@ class CSSAsset(Asset):
             get_spec('bidi') and ('', get_spec('bidi.extension'))  or ('',)
             )
 
-    def convert_to_data_uri(self, match):
-        path = match.group(1)
-        ctype = guess_type(path)[0]
+    def convert_to_data_uri(self, path):
+        ctype = EMBEDS.get_type(path)
         if not ctype:
             exit(
               "Could not detect the content type of embedded resource %r to "
               "generate %s"
               % (path, self.path)
               )
-        data, ok = self.get_embed_file(path)
-        if not ok:
-            return data
-        content = b64encode(data)
+        filepath = self.get_embed_file(path)
+        if not filepath:
+            return 'url("%s")' % self.get_embed_url(path)
+        info = stat_key(filepath, self.runner.stats.stat)
         limit = self.spec.get('embed.maxsize')
-        if limit and len(content) > limit:
-            return 'url("%s")' % self.get_embed_url(path, data)
-        return 'url("data:%s;base64,%s")' % (ctype, content)
+        # Check the size of the base64 encoded content before reading it.
+        if limit and 4 * ((info[0] + 2) // 3) > limit:
+            return 'url("%s")' % self.get_embed_url(path, filepath)
+        return 'url("data:%s;base64,%s")' % (
+            ctype, EMBEDS.get(filepath, info)
+            )
 
-    def convert_to_url(self, match):
-        path = match.group(1)
-        data, ok = self.get_embed_file(path)
-        if not ok:
-            return data
-        return 'url("%s")' % self.get_embed_url(path, data)
+    def convert_to_url(self, path):
+        filepath = self.get_embed_file(path)
+        if not filepath:
+            return 'url("%s")' % self.get_embed_url(path)
+        return 'url("%s")' % self.get_embed_url(path, filepath)
 
     def get_embed_file(self, path):
-        if not self.first:
+        if path in self.cache:
             return self.cache[path]
-        if path.startswith("http://"):
+        if is_url(path):
             filepath = get_downloaded_source(path)[0]
-        elif path.startswith("https://"):
-            filepath = get_downloaded_source(path, 1)[0]
         else:
-            filepath = join(self.embed_path_root, path)
-        try:
-            data = open(filepath, 'rb').read()
-        except IOError:
+            filepath = join(self.runner.base_dir, self.embed_path_root, path)
+        if not self.runner.stats.isfile(filepath):
             log.error("!! Couldn't find %s for %s" % (
                 filepath, self.path
                 ))
-            return self.cache.setdefault(
-                path,
-                ('url("%s")' % self.get_embed_url(path), 0)
-                )
-        return self.cache.setdefault(path, (data, 1))
+            filepath = None
+        return self.cache.setdefault(path, filepath)
 
-    def get_embed_url(self, path, data=None):
-        if path.startswith("http://") or path.startswith("https://"):
+    def get_embed_url(self, path, filepath=None):
+        if is_url(path):
             return path
-        if data is None or not self.runner.hashed:
+        runner = self.runner
+        if filepath is None or not runner.hashed:
             digest = ''
         else:
-            digest = sha1(data).hexdigest() + '-'
+            digest = runner.get_digest(filepath)[:runner.hash_length] + '-'
         prefix, filename = split(path)
         return self.embed_url_template % {
             'url_base': self.embed_url_base,
@@ -337,67 +1906,90 @@ class CSSAsset(Asset):
             'filename': filename,
             }
 
-    def embed(self, replacer, content):
-        output = substitute_embeds(replacer, content)
-        self.first = 0
-        return output
+    def embed(self, converter, parts):
+        """Assemble the stylesheet from the ``parts`` produced by
+        split_embeds, converting each embed reference with the converter."""
+        with trace(self.path, 'embed', converter=converter.__name__):
+            output = parts[:]
+            converted = {}
+            for idx in xrange(1, len(parts), 2):
+                path = parts[idx]
+                if path not in converted:
+                    converted[path] = converter(path)
+                output[idx] = converted[path]
+            return ''.join(output)
 
     def generate(self):
         get_spec = self.spec.get
-        self.first = 1
         self.cache.clear()
+        output = []; out = output.append
+        for ext, sources in group_sources(self.sources, ('.styl',)):
+            if ext:
+                # Stylus only writes to stdout if it gets input from stdin,
+                # so the files are always compiled within a temp workspace.
+                cmd = ['stylus']
+                if get_spec('compress'):
+                    cmd.append('--compress')
+                output.extend(self.compile_batch(
+                    sources, cmd, '.css', imports=True
+                    ))
+                continue
+            source = sources[0]
+            if isinstance(source, Raw):
+                out(source.text)
+            elif source.endswith('.sass') or source.endswith('.scss'):
+                cmd = ['sass']
+                if source.endswith('.scss'):
+                    cmd.append('--scss')
+                if get_spec('compress'):
+                    cmd.extend(['--style', 'compressed'])
+                cmd.append(source)
+                out(self.compile(source, cmd, imports=True))
+            elif source.endswith('.less'):
+                cmd = ['lessc']
+                if get_spec('compress'):
+                    cmd.append('-x')
+                cmd.append(source)
+                out(self.compile(source, cmd, imports=True))
+            else:
+                out(read(source))
+        output = ''.join(output)
+        # Embed references are opaque to the minifier and are replaced
+        # verbatim, so minifying before embedding gives the same output as
+        # minifying each of the embedded variants.
+        if get_spec('compress') and get_spec('minify'):
+            minify = minify_css
+        else:
+            minify = lambda css: css
+        # Split the stylesheet once into alternating literal segments and
+        # embed references, so that the embedded and linked variants can be
+        # assembled from the same parse.
+        parts = split_embeds(minify(output))
+        get_downloader().prefetch(
+            path for path in parts[1::2] if is_url(path)
+            )
         for bidi in self.todo:
-            output = []; out = output.append
-            for source in self.sources:
-                if isinstance(source, Raw):
-                    out(source.text)
-                elif source.endswith('.sass') or source.endswith('.scss'):
-                    cmd = ['sass']
-                    if source.endswith('.scss'):
-                        cmd.append('--scss')
-                    if bidi:
-                        cmd.append('--flip')
-                    if get_spec('compress'):
-                        cmd.extend(['--style', 'compressed'])
-                    cmd.append(source)
-                    out(do(cmd))
-                elif source.endswith('.less'):
-                    cmd = ['lessc']
-                    if get_spec('compress'):
-                        cmd.append('-x')
-                    cmd.append(source)
-                    out(do(cmd))
-                elif source.endswith('.styl'):
-                    # Need to use a tempdir, as stylus only writes to stdout if
-                    # it gets input from stdin.
-                    with tempdir() as td:
-                        tempstyl = join(td, basename(source))
-                        tempcss = tempstyl[:-5] + '.css'
-                        copy(source, tempstyl)
-                        cmd = ['stylus']
-                        if get_spec('compress'):
-                            cmd.append('--compress')
-                        cmd.append(tempstyl)
-                        do(cmd)
-                        out(read(tempcss))
-                else:
-                    out(read(source))
-            output = ''.join(output)
+            if bidi:
+                # The RTL variant needs a parse of its own, as declarations
+                # can span embed references, so the parts can't be flipped
+                # individually. It's flipped from the compiled output, before
+                # any @noflip comments get stripped by the minifier.
+                parts = split_embeds(minify(flip_css(output)))
             if get_spec('embed') or self.embed_only:
                 if self.embed_only:
                     self.emit(
                         self.path,
-                        self.embed(self.convert_to_data_uri, output),
+                        self.embed(self.convert_to_data_uri, parts),
                         bidi
                     )
                     return
                 self.emit(
                     self.path,
-                    self.embed(self.convert_to_data_uri, output),
+                    self.embed(self.convert_to_data_uri, parts),
                     get_spec('embed.extension') + bidi
                     )
             self.emit(
-                self.path, self.embed(self.convert_to_url, output), bidi
+                self.path, self.embed(self.convert_to_url, parts), bidi
                 )
 
 register_handler('css', CSSAsset)
@@ -412,9 +2004,92 @@ def extend_opts(xs, opt):
     else:
         xs.extend(opt)
 
+TSC_OUTPUT_OPTIONS = frozenset(['--out', '--outFile'])
+
+def extend_tsc_opts(xs, opt):
+    """Extend the tsc command with the options, minus any which set the
+    output file, as assetgen decides where the output is written."""
+    if isinstance(opt, basestring):
+        opt = [opt]
+    skip = False
+    for arg in opt:
+        if skip:
+            skip = False
+            continue
+        # The value may be given in the same arg, e.g. "--out=file.js".
+        parts = arg.replace('=', ' ', 1).split(None, 1)
+        if parts and parts[0] in TSC_OUTPUT_OPTIONS:
+            log.error("!! Ignoring the %s option for tsc" % parts[0])
+            skip = len(parts) == 1
+            continue
+        xs.append(arg)
+
 def jsliteral(v, enc=JSONEncoderForHTML().encode):
     return enc(v)
 
+sourcemap_url_regex = compile_regex(r'^//[#@] sourceMappingURL=.*$', MULTILINE)
+
+MODULE_OPTIONS = frozenset(['--isolatedModules', '--module', '-m'])
+
+EMPTY_SOURCEMAP = {'version': 3, 'sources': [], 'names': [], 'mappings': ''}
+
+class TemplateCache(object):
+    """Process-wide cache of compiled Mako templates.
+
+    Templates are keyed by a digest of their text and output encoding, so
+    that assets with the same template share it, even across config reloads.
+    If a ``directory`` is given, the compiled modules are also kept on disk,
+    so that new processes don't have to recompile them either. As each
+    runner has its own directory, templates are cached per directory.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.templates = {}
+
+    def get(self, text, output_encoding, directory=None):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        key = sha1('%s\0%s' % (output_encoding, text)).hexdigest()
+        with self.lock:
+            template = self.templates.get((directory, key))
+            if template is None:
+                template = self.templates[directory, key] = self.compile(
+                    key, text, output_encoding, directory
+                    )
+        return template
+
+    def compile(self, key, text, output_encoding, directory):
+        from mako.template import Template
+        if not directory:
+            return Template(
+                text, input_encoding='utf-8', output_encoding=output_encoding
+                )
+        # Mako only caches the modules of file based templates, so the text
+        # is written out to a file named after its digest.
+        path = join(directory, key + '.mako')
+        if not isfile(path):
+            ensure_dir(directory)
+            write_atomic(path, text)
+        return Template(
+            filename=path, uri=key + '.mako', input_encoding='utf-8',
+            module_directory=join(directory, 'modules'),
+            output_encoding=output_encoding
+            )
+
+TEMPLATES = TemplateCache()
+
+def read_mapped(path):
+    """Return the JSON-encoded pair of the compiled JavaScript and source map
+    which a compiler has written next to the given source path."""
+    base = splitext(path)[0]
+    # Newer versions of CoffeeScript name the map foo.js.map instead of
+    # foo.map.
+    for map_path in (base + '.js.map', base + '.map'):
+        if isfile(map_path):
+            return enc_json([read(base + '.js'), read(map_path)])
+    exit("Couldn't find the source map generated for %s" % basename(path))
+
 def mismatch(s1, s2, source, existing):
     log.error(
         "Mixed %s/%s source files are not compatible with source maps (%s + %s)"
@@ -429,17 +2104,23 @@ class JSAsset(Asset):
         super(JSAsset, self).__init__(*args)
         sources = self.sources
         get_spec = self.spec.get
+        self.modular = get_spec('uglify.modules') and bool(
+            get_spec('uglify') or get_spec('compress')
+            )
         tmpl = get_spec('template')
         if tmpl:
             self.template_encoding = get_spec('template.source.encoding', 'utf-8')
-            self.template = Template(
-                tmpl, output_encoding=get_spec('template.output.encoding', 'utf-8')
+            self.template = TEMPLATES.get(
+                tmpl, get_spec('template.output.encoding', 'utf-8'),
+                self.runner.templates_dir
                 )
         else:
             self.template = None
         if get_spec('sourcemaps'):
             ts = cs = js = None
-            for source in sources:
+            # Each module gets its own section of an index map when they're
+            # minified separately, so any mix of sources can be used.
+            for source in (not self.modular and sources or ()):
                 if isinstance(source, Raw):
                     exit("Raw source strings are not compatible with source maps")
                 if source.endswith('.ts'):
@@ -467,6 +2148,8 @@ class JSAsset(Asset):
             self.mapping = mapping = {}
             seen = set()
             for source in sources:
+                if isinstance(source, Raw):
+                    continue
                 path = base = basename(source)
                 if path in seen:
                     i = 0
@@ -493,6 +2176,7 @@ class JSAsset(Asset):
         try:
             return self.template.render(jsliteral=jsliteral, source=source)
         except Exception, err:
+            from mako.exceptions import RichTraceback
             traceback = RichTraceback()
             for (filename, lineno, function, line) in traceback.traceback:
                 print "File %s, line %s, in %s" % (filename, lineno, function)
@@ -521,12 +2205,15 @@ class JSAsset(Asset):
 
     def generate(self):
         get_spec = self.spec.get
+        if self.modular:
+            self.generate_modules(get_spec)
+            return
         if get_spec('sourcemaps'):
             src_map = {}
             mapping = self.mapping
             sources = self.sources
             for source in sources:
-                src_map[source] = self.emit(mapping[source], read(source))
+                src_map[source] = self.emit_file(mapping[source], source)
             with tempdir() as td:
                 filename = basename(self.path)
                 if self.js:
@@ -536,7 +2223,7 @@ class JSAsset(Asset):
                     cmd = ['tsc', '-sourcemap', '--out', ts_js_path]
                     tsc = get_spec('tsc')
                     if tsc:
-                        extend_opts(cmd, tsc)
+                        extend_tsc_opts(cmd, tsc)
                     else:
                         cmd.append('--comments')
                     cmd.extend(sources)
@@ -568,56 +2255,206 @@ class JSAsset(Asset):
                 cmd = ['tsc', '--out', ts_js_path]
                 tsc = get_spec('tsc')
                 if tsc:
-                    extend_opts(cmd, tsc)
+                    extend_tsc_opts(cmd, tsc)
                 else:
                     cmd.append('--comments')
                 cmd.extend(self.sources)
                 do(cmd)
-                self.uglify(read(ts_js_path), get_spec)
+                self.uglify(None, get_spec, ts_js_path)
             return
+        self.uglify(''.join(self.compile_sources(get_spec)), get_spec)
+
+    def compile_sources(self, get_spec):
+        """Return the compiled JavaScript for each of the sources."""
         output = []; out = output.append
-        for source in self.sources:
-            if isinstance(source, Raw):
-                out(source.text)
-            elif source.endswith('.coffee'):
-                cmd = ['coffee', '-p']
+        for ext, sources in group_sources(self.sources, ('.coffee', '.ts')):
+            if ext == '.coffee':
+                cmd = ['coffee', '-c']
                 if get_spec('bare'):
                     cmd.append('-b')
-                cmd.append(source)
-                out(do(cmd))
-            elif source.endswith('.ts'):
-                with tempdir() as td:
-                    tempts = join(td, basename(source))
-                    tempjs = tempts[:-3] + '.js'
-                    copy(source, tempts)
-                    do(['tsc', tempts])
-                    out(read(tempjs))
+                # A lone file is printed straight to stdout instead.
+                build = lambda source: do(
+                    ['coffee', '-p'] + cmd[2:] + [source]
+                    )
+                output.extend(self.compile_batch(sources, cmd, '.js', build))
+                continue
+            if ext == '.ts':
+                # Unless the files are compiled as separate modules, tsc
+                # treats them as one program with a shared global scope, so
+                # they can only be compiled as a whole.
+                cmd = ['tsc']
+                tsc = get_spec('tsc')
+                if tsc:
+                    extend_tsc_opts(cmd, tsc)
+                output.extend(self.compile_batch(
+                    sources, cmd, '.js',
+                    group=not MODULE_OPTIONS.intersection(cmd)
+                    ))
+                continue
+            source = sources[0]
+            if isinstance(source, Raw):
+                out(source.text)
             else:
                 if self.template:
                     out(self.apply_template(read(source)))
                 else:
                     out(read(source))
-        self.uglify(''.join(output), get_spec)
+        return output
 
-    def uglify(self, output, get_spec):
-        uglify = get_spec('uglify')
-        if uglify or get_spec('compress'):
-            bin = get_spec('uglify.bin')
-            cmd = [bin]
-            if uglify:
-                extend_opts(cmd, uglify)
-            elif bin == 'uglifyjs2':
-                cmd.extend(['-c', '-m'])
-            with tempdir() as td:
-                path = join(td, basename(self.path))
-                f = open(path, 'wb')
-                f.write(output)
-                f.close()
-                if bin == 'uglifyjs2':
-                    cmd.insert(1, path)
+    def compile_mapped(self, get_spec):
+        """Return the compiled JavaScript for each of the sources, along with
+        the source map from the compiler, if any."""
+        output = []; out = output.append
+        for ext, sources in group_sources(self.sources, ('.coffee', '.ts')):
+            if ext is None:
+                source = sources[0]
+                if isinstance(source, Raw):
+                    out((source.text, None))
+                else:
+                    out((read(source), None))
+                continue
+            if ext == '.coffee':
+                cmd = ['coffee', '-c', '-m']
+                if get_spec('bare'):
+                    cmd.append('-b')
+                group = False
+            else:
+                cmd = ['tsc', '-sourcemap']
+                tsc = get_spec('tsc')
+                if tsc:
+                    extend_tsc_opts(cmd, tsc)
+                # As in compile_sources, the files are compiled as a whole
+                # unless they are separate modules.
+                group = not MODULE_OPTIONS.intersection(cmd)
+            output.extend(
+                dec_json(data) for data in self.compile_batch(
+                    sources, cmd, '.js', reader=read_mapped, group=group
+                    )
+                )
+        return output
+
+    def generate_modules(self, get_spec):
+        """Minify each of the sources separately and emit the concatenated
+        output, along with an index source map if sourcemaps are enabled.
+
+        The minified modules are cached by the digest of their content, so
+        rebuilds only need to minify the modules which have changed.
+        """
+        runner = self.runner
+        sources = self.sources
+        sourcemaps = get_spec('sourcemaps')
+        cmd = self.get_uglify_cmd(get_spec)
+        # Changes to the options, e.g. --define-from-module, may depend on
+        # files other than the sources themselves.
+        extra = self.get_option_depends(cmd)
+        if sourcemaps:
+            src_map = {}
+            mapping = self.mapping
+            for source in sources:
+                if not isinstance(source, Raw):
+                    src_map[source] = self.emit_file(mapping[source], source)
+            # Source maps need real paths, so they are always generated by
+            # uglifyjs2 as in the regular sourcemaps mode.
+            cmd = ['uglifyjs2'] + cmd[1:]
+            modules = []
+            compiled = self.compile_mapped(get_spec)
+            for source, (js, in_map) in zip(sources, compiled):
+                code, map = dec_json(runner.transform(
+                    '%s\0%s' % (js, in_map or ''), cmd + ['--source-map'],
+                    lambda: self.minify_mapped(js, in_map, cmd), extra
+                    ))
+                if isinstance(source, Raw):
+                    map = EMPTY_SOURCEMAP
                 else:
-                    cmd.append(path)
-                output = do_with_stderr(cmd)
+                    map = dec_json(map)
+                    map['sources'] = [src_map[source]]
+                    map.pop('file', None)
+                    if self.sm_root:
+                        map['sourceRoot'] = self.sm_root
+                modules.append((code, map))
+        else:
+            modules = [(runner.transform(
+                js, cmd, lambda: self.minify(js, cmd), extra
+                ), None) for js in self.compile_sources(get_spec)]
+        output = []; sections = []
+        line = 0
+        for code, map in modules:
+            code = sourcemap_url_regex.sub('', code).strip()
+            if not code:
+                continue
+            # Guard against modules running into each other.
+            if not code.endswith(';'):
+                code += ';'
+            if sourcemaps:
+                sections.append({
+                    'offset': {'line': line, 'column': 0}, 'map': map
+                    })
+            output.append(code)
+            line += code.count('\n') + 1
+        output = '\n'.join(output)
+        if sourcemaps:
+            map_path = self.emit(self.path + self.sm_ext, ')]}\n' + enc_json({
+                'version': 3, 'file': basename(self.path),
+                'sections': sections
+                }))
+            output += '\n//@ sourceMappingURL=%s' % map_path
+        self.emit(self.path, output)
+
+    def minify_mapped(self, js, in_map, cmd):
+        with tempdir() as td:
+            path = join(td, 'module.js')
+            map_path = path + '.map'
+            write_atomic(path, js)
+            cmd = [cmd[0], path] + cmd[1:] + ['--source-map', map_path]
+            if in_map:
+                in_map_path = join(td, 'module.in.map')
+                write_atomic(in_map_path, in_map)
+                cmd.extend(['--in-source-map', in_map_path])
+            return enc_json([do_with_stderr(cmd), read(map_path)])
+
+    def get_uglify_cmd(self, get_spec):
+        bin = get_spec('uglify.bin')
+        cmd = [bin]
+        uglify = get_spec('uglify')
+        if uglify:
+            extend_opts(cmd, uglify)
+        elif bin == 'uglifyjs2':
+            cmd.extend(['-c', '-m'])
+        return cmd
+
+    def minify(self, output, cmd):
+        """Return the output of running the compressor on the JavaScript.
+
+        The output is piped straight into uglifyjs2. Other compressors are
+        given the path of a temporary file instead, as they may not read
+        from stdin.
+        """
+        if cmd[0] == 'uglifyjs2':
+            return do_with_stderr(cmd, input=output)
+        with tempdir() as td:
+            path = join(td, basename(self.path))
+            f = open(path, 'wb')
+            f.write(output)
+            f.close()
+            return do_with_stderr(cmd + [path])
+
+    def uglify(self, output, get_spec, path=None):
+        """Compress and emit the output, or the content of the file at the
+        given path if it was generated by another tool."""
+        if not (get_spec('uglify') or get_spec('compress')):
+            if path:
+                output = read(path)
+            self.emit(self.path, output)
+            return
+        cmd = self.get_uglify_cmd(get_spec)
+        if path:
+            if cmd[0] == 'uglifyjs2':
+                cmd.insert(1, path)
+            else:
+                cmd.append(path)
+            output = do_with_stderr(cmd)
+        else:
+            output = self.minify(output, cmd)
         self.emit(self.path, output)
 
 register_handler('js', JSAsset)
@@ -629,14 +2466,17 @@ register_handler('js', JSAsset)
 class AssetGenRunner(object):
     """Encapsulated asset generator runner."""
 
+    manifest_index = None
     manifest_path = None
     virgin = True
 
-    def __init__(self, path, profile='default', force=None, nuke=None):
+    def __init__(
+        self, path, profile='default', force=None, nuke=None, jobs=1,
+        stats=None, tree=None
+        ):
 
-        data_dir = join(
-            gettempdir(), 'assetgen-%s' % sha1(path).hexdigest()[:12]
-            )
+        project_id = 'assetgen-%s' % sha1(path).hexdigest()[:12]
+        data_dir = join(gettempdir(), project_id)
 
         if not isdir(data_dir):
             makedirs(data_dir)
@@ -644,24 +2484,27 @@ class AssetGenRunner(object):
         lock_path = join(data_dir, 'lock')
         lock(lock_path, path)
 
-        self.config_path = path
-        self.data_path = data_path = join(data_dir, 'data')
-        self.force = force
+        self.profile = profile
 
-        if isfile(data_path):
-            data_file = open(data_path, 'rb')
-            try:
-                self.data = load(data_file)
-            except Exception:
-                self.data = {}
-            data_file.close()
-        else:
-            self.data = {}
+        self.templates_dir = join(data_dir, 'templates')
 
-        config_file = open(path, 'rb')
-        config_data = config_file.read() % os.environ
-        self.config = config = decode_yaml(config_data)
-        config_file.close()
+        self.config_path = path
+        self.digested = set()
+        self.scanned = {}
+        self.force = force
+        self.jobs = jobs
+        self.lock = Lock()
+        self.stats = stats or StatCache()
+        self.tree = tree = tree or DirectoryIndex()
+
+        with trace(path, 'config'):
+            config_file = open(path, 'rb')
+            config_data = config_file.read() % os.environ
+            config_file.close()
+            self.config_digest = sha1(config_data).hexdigest()
+            self.config = config = load_config(
+                config_data, self.config_digest, join(data_dir, 'config')
+                )
 
         if not config:
             exit("No config found at %s" % path)
@@ -698,6 +2541,34 @@ class AssetGenRunner(object):
                 environ[key] = val
 
         self.base_dir = base_dir = dirname(path)
+        self.globs = globs = []
+
+        # When the state lives alongside the project, key it by the config's
+        # path relative to the state directory, so that it's still found if
+        # the checkout is moved or restored elsewhere, e.g. on CI.
+        state_dir = config['state.directory']
+        if state_dir:
+            state_dir = join(base_dir, state_dir)
+            state_id = 'assetgen-%s' % sha1(
+                relpath(path, state_dir)
+                ).hexdigest()[:12]
+        else:
+            state_dir = STATE_PATH
+            state_id = project_id
+        self.state = StateStore(
+            join(state_dir, state_id + '.db'), join(data_dir, 'data')
+            )
+        self.data = self.state.data
+        self.index = None
+
+        workers = config.get('workers') or {}
+        for bin, cmd in workers.iteritems():
+            if isinstance(cmd, basestring):
+                cmd = split_args(cmd)
+            existing = WORKERS.get(bin)
+            if existing and existing.cmd == cmd and existing.size == jobs:
+                continue
+            register_worker(bin, Worker(cmd, jobs))
         output_dir = config['output.directory']
         if not output_dir:
             exit("No value found for output.directory in %s." % path)
@@ -705,41 +2576,99 @@ class AssetGenRunner(object):
         self.output_dir = output_dir = join(base_dir, output_dir)
         self.output_template = config['output.template']
         self.hashed = config['output.hashed']
+        self.hash_name = config['output.hash']
+        self.hasher = get_hasher(self.hash_name)
+        self.hash_length = hash_length = config['output.hash.length']
+        if hash_length is not None and (
+            not isinstance(hash_length, (int, long)) or
+            isinstance(hash_length, bool) or hash_length < 8
+            ):
+            exit("The output.hash.length must be an integer of at least 8.")
+
+        if config['cache']:
+            cache_dir = config['cache.directory']
+            if cache_dir:
+                cache_dir = join(dirname(path), cache_dir)
+            else:
+                cache_dir = join(data_dir, 'cache')
+            self.cache = CompileCache(cache_dir, config['cache.maxsize'])
+        else:
+            self.cache = None
+        self.fingerprint = config['output.fingerprint']
+
+        precompress = config['output.precompress']
+        if precompress is True:
+            precompress = 'gzip'
+        if precompress and precompress not in COMPRESSORS:
+            exit("Unknown output.precompress value: %r" % precompress)
+        if precompress == 'zopfli':
+            try:
+                __import__('zopfli.gzip')
+            except ImportError:
+                exit("The zopfli package needs to be installed for "
+                     "output.precompress: zopfli")
+        self.precompress = precompress
 
         manifest_path = config['output.manifest']
         if manifest_path:
             self.manifest_path = join(base_dir, manifest_path)
 
+        manifest_index = config['output.manifest.index']
+        if manifest_index:
+            self.manifest_index = join(base_dir, manifest_index)
+
+        self.manifest_details = config['output.manifest.details']
+
         self.manifest_force = config['output.manifest.force']
         if force:
             self.manifest_force = True
 
-        def expand_src(source):
-            if source.startswith('http://'):
+        def expand_src(source, excludes=()):
+            if is_url(source):
                 if nuke:
                     return []
                 return get_downloaded_source(source)
-            if source.startswith('https://'):
-                if nuke:
-                    return []
-                return get_downloaded_source(source, 1)
             source = join(base_dir, source)
             if '*' not in source:
                 return [source]
+            source = normpath(source)
             root = split(source.partition('*')[0])[0]
-            sources = []; new_source = sources.append
-            for directory, _, files in walk(root):
-                for file in files:
-                    path = join(directory, file)
-                    if fnmatch(path, source):
-                        new_source(path)
-            return sources
+            globs.append((root, source, excludes))
+            with trace(source, 'glob') as info:
+                files = tree.glob(source, excludes)
+                info['files'] = len(files)
+            return files
+
+        # Fetch any remote sources concurrently before expanding them.
+        if not nuke:
+            urls = []
+            for key in ('prereqs', 'generate'):
+                for info in config.get(key) or ():
+                    for spec in info.itervalues():
+                        if not isinstance(spec, dict):
+                            continue
+                        # Apply any profile overrides, as in the asset setup
+                        # below.
+                        profile_conf = spec.get('profile.%s' % profile)
+                        if isinstance(profile_conf, dict):
+                            spec = dict(spec)
+                            spec.update(profile_conf)
+                        for name in ('source', 'depends'):
+                            sources = spec.get(name)
+                            if isinstance(sources, basestring):
+                                sources = [sources]
+                            for source in sources or ():
+                                if isinstance(source, basestring) and \
+                                        is_url(source):
+                                    urls.append(source)
+            get_downloader().prefetch(urls)
 
         for key in ('prereqs', 'generate'):
 
+            prereq = key == 'prereqs'
             listing = config.pop(key, None)
             if not listing:
-                if key == 'prereqs':
+                if prereq:
                     self.prereqs = []
                     continue
                 exit("No value found for %s in %s." % (key, path))
@@ -787,9 +2716,16 @@ class AssetGenRunner(object):
                 if isinstance(_depends, basestring):
                     _depends = [_depends]
 
+                excludes = spec.pop('exclude', [])
+                if isinstance(excludes, basestring):
+                    excludes = [excludes]
+                excludes = [
+                    normpath(join(base_dir, exclude)) for exclude in excludes
+                    ]
+
                 depends = []
                 for source in _depends:
-                    depends.extend(expand_src(source))
+                    depends.extend(expand_src(source, excludes))
 
                 if output.endswith('/*'):
                     io = []; add_io = io.append
@@ -799,19 +2735,19 @@ class AssetGenRunner(object):
                             exit("Source for %r cannot be raw text." % output)
                         if not source.endswith('/*'):
                             exit("Glob source %r must end in /* too." % source)
-                        source = join(base_dir, source[:-1])
-                        src_len = len(source)
-                        for directory, _, files in walk(source):
-                            for file in files:
-                                path = join(directory, file)
-                                _src = [path]
-                                _dep = depends + _src
-                                add_io((_src, _dep, oprefix + path[src_len:]))
+                        source = normpath(join(base_dir, source[:-1]))
+                        src_len = len(source) + 1
+                        pattern = source + '/**'
+                        globs.append((source, pattern, excludes))
+                        for path in tree.glob(pattern, excludes):
+                            _src = [path]
+                            _dep = depends + _src
+                            add_io((_src, _dep, oprefix + path[src_len:]))
                 else:
                     sources = []
                     for source in _sources:
                         if isinstance(source, basestring):
-                            sources.extend(expand_src(source))
+                            sources.extend(expand_src(source, excludes))
                         else:
                             sources.append(Raw(source['raw']))
                     depends = depends + [
@@ -833,19 +2769,18 @@ class AssetGenRunner(object):
                                 )
                         else:
                             log.info("%s -> %s" % (depends, output))
-                    add_asset(
-                        HANDLERS[type](self, output, sources, depends, spec)
-                        )
+                    asset = HANDLERS[type](self, output, sources, depends, spec)
+                    if prereq:
+                        asset.prereq = True
+                    add_asset(asset)
 
     def clean(self):
-        if 'prereq_data' in self.data:
-            base_dir = self.base_dir
-            prereq_data = self.data['prereq_data']
-            for key, paths in prereq_data.iteritems():
-                for path in paths:
-                    full_path = join(base_dir, path)
-                    log.info("Removing: %s" % path)
-                    remove(full_path)
+        base_dir = self.base_dir
+        for key, paths in self.data['prereq_data'].iteritems():
+            for path in paths:
+                full_path = join(base_dir, path)
+                log.info("Removing: %s" % path)
+                remove(full_path)
         output_dir = self.output_dir
         if isdir(output_dir):
             if output_dir.endswith("/"):
@@ -853,38 +2788,189 @@ class AssetGenRunner(object):
             else:
                 log.info("Removing: %s/" % output_dir)
             rmtree(output_dir)
-        data_path = self.data_path
-        if isfile(data_path):
-            log.info("Removing: %s" % data_path)
-            remove(data_path)
+        log.info("Removing: %s" % self.state.path)
+        self.state.remove()
+
+    def emit(self, key, path, content, extension='', prereq=False):
+        path = self.get_output_name(path, extension)
+        digest = self.hasher(content).hexdigest()
+        output_path, real_output_path = self.get_output_path(
+            path, digest, prereq
+            )
+        ensure_dir(dirname(real_output_path))
+        with trace(output_path, 'emit', bytes=len(content)) as info:
+            changed = info['changed'] = bool(
+                self.write(real_output_path, content, digest)
+                )
+        return self.finish_emit(
+            key, path, output_path, digest, prereq, changed
+            )
+
+    def emit_stream(self, key, path, chunks, extension='', prereq=False):
+        """Emit the content from an iterable of chunks.
+
+        The chunks are hashed as they are written to a temp file next to the
+        output, so that large outputs never have to be held in memory.
+        """
+        path = self.get_output_name(path, extension)
+        # The temp file is created before the digest is known, so it goes in
+        # the unhashed output's directory rather than one derived from the
+        # output template.
+        if prereq:
+            directory = join(self.base_dir, dirname(path))
+        else:
+            directory = join(self.output_dir, dirname(path))
+        ensure_dir(directory)
+        tmp_path = join(directory, '.%s.%s.%s.tmp' % (
+            basename(path), getpid(), current_thread().ident
+            ))
+        hasher = self.hasher()
+        size = 0
+        with trace(path, 'emit') as info:
+            file = open(tmp_path, 'wb')
+            try:
+                for chunk in chunks:
+                    hasher.update(chunk)
+                    file.write(chunk)
+                    size += len(chunk)
+            except:
+                file.close()
+                remove(tmp_path)
+                raise
+            file.close()
+            digest = hasher.hexdigest()
+            output_path, real_output_path = self.get_output_path(
+                path, digest, prereq
+                )
+            info['bytes'] = size
+            if self.is_identical(real_output_path, size, digest):
+                remove(tmp_path)
+                changed = None
+            else:
+                ensure_dir(dirname(real_output_path))
+                rename(tmp_path, real_output_path)
+                self.stats.discard(real_output_path)
+                self.hashes[real_output_path] = (
+                    self.get_stat_key(real_output_path), digest
+                    )
+                changed = 1
+            info['changed'] = bool(changed)
+        return self.finish_emit(
+            key, path, output_path, digest, prereq, changed
+            )
 
-    def emit(self, key, path, content, extension=''):
+    def emit_file(self, key, path, source, extension='', prereq=False,
+                  mode=None):
+        """Emit a copy of the source file, without reading it into memory.
+
+        Its digest is taken from the digest cache, so unchanged sources are
+        not even read. The output is then created via link_file using the
+        given mode.
+        """
+        path = self.get_output_name(path, extension)
+        digest = self.get_digest(source)
+        output_path, real_output_path = self.get_output_path(
+            path, digest, prereq
+            )
+        size = self.stats.stat(source).st_size
+        with trace(output_path, 'emit', bytes=size, source=source) as info:
+            if self.is_identical(real_output_path, size, digest):
+                changed = None
+            else:
+                directory = dirname(real_output_path)
+                ensure_dir(directory)
+                tmp_path = join(directory, '.%s.%s.%s.tmp' % (
+                    basename(path), getpid(), current_thread().ident
+                    ))
+                try:
+                    link_file(source, tmp_path, mode)
+                    rename(tmp_path, real_output_path)
+                except:
+                    if isfile(tmp_path):
+                        remove(tmp_path)
+                    raise
+                self.stats.discard(real_output_path)
+                self.hashes[real_output_path] = (
+                    self.get_stat_key(real_output_path), digest
+                    )
+                changed = 1
+            info['changed'] = bool(changed)
+        return self.finish_emit(
+            key, path, output_path, digest, prereq, changed
+            )
+
+    def get_output_name(self, path, extension):
+        if not extension:
+            return path
         directory, filename = split(path)
-        if extension:
-            root, ext = splitext(filename)
-            filename = root + extension + ext
-            path = join(directory, filename)
-        if (not self.prereq) and self.hashed:
-            digest = sha1(content).hexdigest()
-            output_path = join(directory, self.output_template % {
-                'hash': digest,
+        root, ext = splitext(filename)
+        return join(directory, root + extension + ext)
+
+    def get_output_path(self, path, digest, prereq):
+        """Return the output path, and its path on disk, for the content
+        with the given digest."""
+        if prereq:
+            return path, join(self.base_dir, path)
+        if self.hashed:
+            directory, filename = split(path)
+            path = join(directory, self.output_template % {
+                'hash': digest[:self.hash_length],
                 'filename': filename
                 })
-        else:
+        return path, join(self.output_dir, path)
+
+    def finish_emit(self, key, path, output_path, digest, prereq, changed):
+        if prereq or not self.hashed:
             digest = None
-            output_path = path
-        if self.prereq:
-            directory = join(self.base_dir, directory)
-            real_output_path = join(self.base_dir, output_path)
-        else:
-            directory = join(self.output_dir, directory)
-            real_output_path = join(self.output_dir, output_path)
-        if not isdir(directory):
-            makedirs(directory)
-        file = open(real_output_path, 'wb')
-        file.write(content)
-        file.close()
-        if self.prereq:
+        with self.lock:
+            # The sizes and digests in the manifest need updating even if the
+            # output path stays the same.
+            if changed and not prereq and self.has_details():
+                self.manifest_changed = 1
+            output_path = self.record(key, path, output_path, digest, prereq)
+            if self.precompress and not prereq and \
+                    splitext(path)[1] in TEXT_EXTENSIONS:
+                self.compress_queue.append((key, path, output_path, changed))
+            elif path + '.gz' in self.manifest:
+                # Precompression has since been disabled.
+                self.remove_stale(self.manifest.pop(path + '.gz'))
+                self.manifest_changed = 1
+            return output_path
+
+    def write(self, path, content, digest=None):
+        """Atomically write the content to the path, unless the file already
+        has identical content, in which case it is left untouched so that
+        anything depending on its mtime isn't invalidated."""
+        if digest is None:
+            digest = self.hasher(content).hexdigest()
+        if self.is_identical(path, len(content), digest):
+            return
+        write_atomic(path, content)
+        self.stats.discard(path)
+        self.hashes[path] = (self.get_stat_key(path), digest)
+        return 1
+
+    def is_identical(self, path, size, digest):
+        info = self.stats.get(path)
+        return info and info.st_size == size and \
+            self.get_digest(path) == digest
+
+    def compress(self, item):
+        """Write and record a gzipped sibling for an emitted output."""
+        key, path, output_path, changed = item
+        real_output_path = join(self.output_dir, output_path)
+        if changed or not self.stats.isfile(real_output_path + '.gz'):
+            changed = self.write(
+                real_output_path + '.gz',
+                COMPRESSORS[self.precompress](read(real_output_path))
+                )
+        with self.lock:
+            if changed and self.has_details():
+                self.manifest_changed = 1
+            self.record(key, path + '.gz', output_path + '.gz', None, False)
+
+    def record(self, key, path, output_path, digest, prereq):
+        if prereq:
             self.prereq_data.setdefault(key, set()).add(path)
             log.info("Generated prereq: %s" % output_path)
             return output_path
@@ -898,28 +2984,228 @@ class AssetGenRunner(object):
             ex_output_path = manifest[path]
             if output_path == ex_output_path:
                 return output_path
-            ex_path = join(self.output_dir, ex_output_path)
-            if isfile(ex_path):
-                remove(ex_path)
-                log.info(".. Removed stale: %s" % ex_output_path)
+            self.remove_stale(ex_output_path)
         manifest[path] = output_path
         self.manifest_changed = 1
         return output_path
 
-    def is_fresh(self, key, depends):
+    def has_details(self):
+        return self.manifest_index or (
+            self.manifest_path and self.manifest_details
+            )
+
+    def get_manifest_entries(self):
+        """Return the detailed manifest entries, with any precompressed
+        variants folded into the entries for the original files."""
+        from mimetypes import guess_type
+        manifest = self.manifest
+        output_dir = self.output_dir
+        get_info = self.stats.get
+        entries = {}
+        for path, output_path in manifest.iteritems():
+            if path.endswith('.gz') and path[:-3] in manifest:
+                continue
+            real_output_path = join(output_dir, output_path)
+            info = get_info(real_output_path)
+            if info is None:
+                continue
+            entry = entries[path] = {
+                'digest': self.get_digest(real_output_path),
+                'path': output_path,
+                'size': info.st_size,
+                'type': guess_type(path)[0] or 'application/octet-stream',
+                }
+            gzip_path = manifest.get(path + '.gz')
+            if gzip_path:
+                info = get_info(join(output_dir, gzip_path))
+                if info is not None:
+                    entry['gzip'] = {'path': gzip_path, 'size': info.st_size}
+        return entries
+
+    def write_manifest(self):
+        manifest_path = self.manifest_path
+        manifest_index = self.manifest_index
+        entries = None
+        if self.has_details():
+            entries = self.get_manifest_entries()
+        if manifest_path:
+            log.info("Updated manifest: %s" % manifest_path)
+            write_atomic(manifest_path, enc_json(
+                self.manifest_details and entries or self.manifest,
+                sort_keys=True
+                ))
+            self.stats.discard(manifest_path)
+        if manifest_index:
+            log.info("Updated manifest index: %s" % manifest_index)
+            write_atomic(manifest_index, build_index(entries))
+            self.stats.discard(manifest_index)
+
+    def remove_stale(self, output_path):
+        path = join(self.output_dir, output_path)
+        if isfile(path):
+            remove(path)
+            self.stats.discard(path)
+            self.hashes.pop(path, None)
+            log.info(".. Removed stale: %s" % output_path)
+
+    def compile(self, source, cmd, build, depends=()):
+        cache = self.cache
+        if not cache:
+            return build()
+        key = self.get_compile_key(source, cmd, depends)
+        output = cache.get(key)
+        if output is None:
+            output = build()
+            cache.set(key, output)
+        return output
+
+    def compile_batch(self, sources, cmd, build, get_depends=None):
+        """Return the outputs for the sources, calling ``build`` once with
+        the list of sources which aren't in the compilation cache. The
+        ``get_depends`` function, if any, is called with each source to get
+        the other files which its output depends on."""
+        cache = self.cache
+        outputs = [None] * len(sources)
+        keys = []
+        if cache:
+            for idx, source in enumerate(sources):
+                depends = get_depends and get_depends(source) or ()
+                key = self.get_compile_key(source, cmd + [source], depends)
+                keys.append(key)
+                outputs[idx] = cache.get(key)
+        todo = [idx for idx, output in enumerate(outputs) if output is None]
+        if not todo:
+            return outputs
+        built = build([sources[idx] for idx in todo])
+        for idx, output in zip(todo, built):
+            outputs[idx] = output
+            if cache:
+                cache.set(keys[idx], output)
+        return outputs
+
+    def transform(self, content, cmd, build, depends=()):
+        """Return the output of ``build`` for the content, reusing earlier
+        output from the compilation cache, keyed by the content digest."""
+        cache = self.cache
+        if not cache:
+            return build()
+        base_dir = self.base_dir
+        hasher = sha1(get_tool_version(cmd[0]))
+        for arg in cmd:
+            hasher.update('\0' + arg)
+        hasher.update('\0\0' + sha1(content).hexdigest())
+        for dep in sorted(depends):
+            hasher.update('\0%s\0%s' % (
+                relpath(dep, base_dir), self.get_digest(dep)
+                ))
+        key = hasher.hexdigest()
+        output = cache.get(key)
+        if output is None:
+            output = build()
+            cache.set(key, output)
+        return output
+
+    def get_compile_key(self, source, cmd, depends):
+        base_dir = self.base_dir
+        hasher = sha1(get_tool_version(cmd[0]))
+        for arg in cmd:
+            if arg == source:
+                arg = relpath(source, base_dir)
+            hasher.update('\0' + arg)
+        hasher.update('\0' + self.get_digest(source))
+        # The source itself is already covered above, so it is left out of
+        # the depends, which may include the asset's other sources.
+        for dep in sorted(depends):
+            if dep == source:
+                continue
+            hasher.update('\0%s\0%s' % (
+                relpath(dep, base_dir), self.get_digest(dep)
+                ))
+        return hasher.hexdigest()
+
+    def get_digest(self, path):
+        """Return the content digest of a file, only rehashing it if its
+        (size, mtime, inode) stat info has changed since it was last seen."""
+        self.digested.add(path)
+        info = self.get_stat_key(path)
+        cached = self.hashes.get(path)
+        if cached and cached[0] == info:
+            return cached[1]
+        digest = hash_file(path, hasher=self.hasher)
+        self.hashes[path] = (info, digest)
+        return digest
+
+    def prune_hashes(self):
+        """Drop the cached digests for files which are no longer among the
+        inputs or outputs, or haven't been looked up in this run, e.g. as
+        embedded images."""
+        live = set(self.get_inputs())
+        live.update(self.get_outputs())
+        live.update(self.digested)
+        live = set(normpath(path) for path in live)
+        hashes = self.hashes
+        for path in hashes.keys():
+            if normpath(path) not in live:
+                del hashes[path]
+
+    def get_source_imports(self, path):
+        """Return the files imported directly by the stylesheet, only
+        rescanning it if its stat info has changed since it was last seen."""
+        try:
+            info = self.get_stat_key(path)
+        except OSError:
+            # An imported file has been removed since it was last scanned.
+            return
+        cached = self.scanned.get(path)
+        if cached and cached[0] == info:
+            return cached[1]
+        imports = find_imports(
+            path, read(path), (self.base_dir,), self.stats.isfile
+            )
+        self.scanned[path] = (info, imports)
+        return imports
+
+    def get_stat_key(self, path):
+        # Include the hash algorithm, so that digests get recomputed if it's
+        # changed.
+        return stat_key(path, self.stats.stat) + (self.hash_name,)
+
+    def get_fingerprint(self, key, depends, spec):
+        """Return a digest of an asset's config, spec and source contents."""
+        base_dir = self.base_dir
+        hasher = sha1(self.config_digest)
+        hasher.update(key)
+        hasher.update(enc_json(spec, sort_keys=True, default=repr))
+        for dep in sorted(depends):
+            hasher.update('\0%s\0%s' % (
+                relpath(dep, base_dir), self.get_digest(dep)
+                ))
+        return hasher.hexdigest()
+
+    def is_fresh(self, key, depends, prereq=False, spec=None):
+        if self.fingerprint:
+            fingerprint = self.get_fingerprint(key, depends, spec or {})
+            self.pending[key] = fingerprint
         if self.force:
             return
-        mtime_cache = self.mtime_cache
-        if self.prereq:
+        mtime_cache = self.stats
+        isfile = mtime_cache.isfile
+        built = self.built.get(key, 0)
+        if prereq:
             output = join(self.base_dir, key)
             if not isfile(output):
                 self.prereq_data.pop(key, None)
                 return
+            if self.fingerprint:
+                if self.check_fingerprint(key, fingerprint, depends, output):
+                    return 1
+                self.prereq_data.pop(key, None)
+                return
             for dep in depends:
-                if newer(dep, output, mtime_cache):
+                if newer(dep, output, mtime_cache, built):
                     self.prereq_data.pop(key, None)
                     return
-            if newer(self.config_path, output, mtime_cache):
+            if newer(self.config_path, output, mtime_cache, built):
                 self.prereq_data.pop(key, None)
                 return
             return 1
@@ -933,49 +3219,248 @@ class AssetGenRunner(object):
                 self.output_data.pop(key)
                 return
         output = join(output_dir, list(paths).pop())
+        if self.fingerprint:
+            if self.check_fingerprint(key, fingerprint, depends, output):
+                return 1
+            self.output_data.pop(key)
+            return
         for dep in depends:
-            if newer(dep, output, mtime_cache):
+            if newer(dep, output, mtime_cache, built):
                 self.output_data.pop(key)
                 return
-        if newer(self.config_path, output, mtime_cache):
+        if newer(self.config_path, output, mtime_cache, built):
             self.output_data.pop(key)
             return
         return 1
 
-    def run(self):
+    def check_fingerprint(self, key, fingerprint, depends, output):
+        existing = self.fingerprints.get(key)
+        if existing:
+            return existing == fingerprint
+        # Fall back to comparing mtimes for assets that were built before
+        # fingerprinting was enabled, and adopt the fingerprint if fresh.
+        mtime_cache = self.stats
+        for dep in depends:
+            if newer(dep, output, mtime_cache):
+                return
+        if newer(self.config_path, output, mtime_cache):
+            return
+        self.fingerprints[key] = fingerprint
+        return 1
+
+    def build(self, asset):
+        key = asset.path
+        with trace(key, 'fresh') as info:
+            fresh = info['fresh'] = bool(asset.is_fresh())
+        if fresh:
+            return
+        started = int(time())
+        with trace(key, 'generate', type=asset.__class__.__name__):
+            asset.generate()
+        if self.fingerprint:
+            if key in self.pending:
+                self.fingerprints[key] = self.pending.pop(key)
+        else:
+            self.built[key] = started
+        return 1
+
+    def get_graph(self):
+        """Return a mapping of assets to the prereqs that they consume.
+
+        An asset consumes a prereq if the prereq's output is one of its
+        sources or depends, or if one of its spec values refers to the
+        prereq's path or module name, e.g. ``--define-from-module consts``.
+        """
+        base_dir = self.base_dir
+        outputs = {}
+        names = {}
+        for asset in self.prereqs:
+            path = asset.path
+            filename = basename(path)
+            outputs[normpath(join(base_dir, path))] = asset
+            for name in (path, filename, splitext(filename)[0]):
+                names.setdefault(name, []).append(asset)
+        graph = {}
+        if not outputs:
+            return graph
+        for asset in self.prereqs + self.generate:
+            needs = set()
+            for dep in asset.depends:
+                dep = normpath(dep)
+                if dep in outputs:
+                    needs.add(outputs[dep])
+            for value in iter_strings(asset.spec):
+                if value in names:
+                    needs.update(names[value])
+            needs.discard(asset)
+            if needs:
+                graph[asset] = needs
+        return graph
+
+    def get_snapshot(self, paths):
+        """Return a digest of the stat info for all of the given paths."""
+        get = self.stats.get
+        hasher = sha1()
+        for path in paths:
+            info = get(path)
+            if info is None:
+                hasher.update('%s\0-\0' % path)
+            else:
+                hasher.update('%s\0%s\0%s\0%s\0' % (
+                    path, info.st_size, int(info.st_mtime * 1000000000),
+                    info.st_ino
+                    ))
+        return hasher.hexdigest()
+
+    def get_inputs(self):
+        # Generated prereq files are left out, as they're covered by the
+        # snapshot of the outputs.
+        base_dir = self.base_dir
+        generated = set()
+        for paths in self.prereq_data.itervalues():
+            generated.update(normpath(join(base_dir, path)) for path in paths)
+        return [self.config_path] + sorted(
+            path for path in self.get_index() if path not in generated
+            )
+
+    def get_run_key(self, snapshot):
+        """Return the key for skipping the run, which also covers the config
+        data after env substitution, the profile and the fingerprint mode."""
+        return (
+            self.config_digest, self.profile, self.fingerprint, snapshot,
+            self.get_snapshot(self.get_outputs())
+            )
+
+    def get_outputs(self):
+        outputs = []
+        base_dir = self.base_dir
+        for paths in self.prereq_data.itervalues():
+            outputs.extend(join(base_dir, path) for path in paths)
+        output_dir = self.output_dir
+        for paths in self.output_data.itervalues():
+            outputs.extend(join(output_dir, path) for path in paths)
+        if self.manifest_path:
+            outputs.append(self.manifest_path)
+        if self.manifest_index:
+            outputs.append(self.manifest_index)
+        outputs.sort()
+        return outputs
+
+    def get_index(self):
+        """Return a reverse index of dependency paths to assets."""
+        if self.index is None:
+            self.index = index = {}
+            for asset in self.prereqs + self.generate:
+                for dep in asset.depends:
+                    index.setdefault(normpath(dep), set()).add(asset)
+        return self.index
+
+    def add_watches(self, watcher):
+        watcher.add(self.config_path)
+        for path in self.get_index():
+            watcher.add(path)
+        for root, _, _ in self.globs:
+            if isdir(root):
+                watcher.add_tree(root)
+
+    def needs_reload(self, changed):
+        """Return whether any changed files were added to or removed from
+        the set of files matched by the config's glob patterns."""
+        index = self.get_index()
+        for path in changed:
+            if (path in index) == isfile(path):
+                continue
+            for _, pattern, excludes in self.globs:
+                if compile_glob(pattern)(path) and not any(
+                    compile_glob(exclude)(path) for exclude in excludes
+                    ):
+                    return True
+
+    def select(self, changed):
+        """Return the assets affected by the changed paths, including any
+        assets consuming the output of affected prereqs."""
+        index = self.get_index()
+        selected = set()
+        for path in changed:
+            selected.update(index.get(path, ()))
+        if not selected:
+            return selected
+        consumers = {}
+        for asset, needs in self.get_graph().iteritems():
+            for need in needs:
+                consumers.setdefault(need, set()).add(asset)
+        todo = list(selected)
+        while todo:
+            for asset in consumers.get(todo.pop(), ()):
+                if asset not in selected:
+                    selected.add(asset)
+                    todo.append(asset)
+        return selected
+
+    def run(self, changed=None):
         chdir(self.base_dir)
         if self.virgin:
             change = True
             if not isdir(self.output_dir):
                 makedirs(self.output_dir)
-            self.manifest = self.data.setdefault('manifest', {})
-            self.output_data = self.data.setdefault('output_data', {})
-            self.prereq_data = self.data.setdefault('prereq_data', {})
+            data = self.data
+            self.manifest = data['manifest']
+            self.output_data = data['output_data']
+            self.prereq_data = data['prereq_data']
+            self.fingerprints = data['fingerprints']
+            self.hashes = data['hashes']
+            self.built = data['built']
+            self.meta = data['meta']
             self.virgin = False
         else:
             change = False
         self.manifest_changed = False
-        self.mtime_cache = {}
-        self.prereq = True
-        for asset in self.prereqs:
-            if not asset.is_fresh():
-                change = True
-                asset.generate()
-        self.prereq = None
-        for asset in self.generate:
-            if not asset.is_fresh():
+        self.pending = {}
+        self.compress_queue = []
+        self.digested = set()
+        # If none of the files in the dependency closure or the generated
+        # files have changed since the last complete run, there's no need to
+        # check each asset individually.
+        snapshot = None
+        if changed is None and not (self.force or self.manifest_force):
+            snapshot = self.get_snapshot(self.get_inputs())
+            if self.meta.get('snapshot') == self.get_run_key(snapshot):
+                return
+        build = self.build
+        prereqs = self.prereqs
+        generate = self.generate
+        if changed is not None:
+            selected = self.select(changed)
+            if not selected and not change:
+                return
+            prereqs = [asset for asset in prereqs if asset in selected]
+            generate = [asset for asset in generate if asset in selected]
+        if self.jobs > 1:
+            assets = prereqs + generate
+            if any(schedule(assets, self.get_graph(), build, self.jobs)):
                 change = True
-                asset.generate()
-        manifest_path = self.manifest_path
-        if manifest_path and (self.manifest_changed or self.manifest_force):
-            log.info("Updated manifest: %s" % manifest_path)
-            manifest_file = open(manifest_path, 'wb')
-            encode_json(self.manifest, manifest_file)
-            manifest_file.close()
-        if change:
-            data_file = open(self.data_path, 'wb')
-            dump(self.data, data_file, 2)
-            data_file.close()
+        else:
+            for asset in prereqs:
+                if build(asset):
+                    change = True
+            for asset in generate:
+                if build(asset):
+                    change = True
+        if self.compress_queue:
+            # Compression happens off the build threads, and as zlib releases
+            # the GIL, it can make use of all the available cores.
+            with trace('precompress', 'compress'):
+                from multiprocessing import cpu_count
+                schedule(self.compress_queue, {}, self.compress, cpu_count())
+        if self.cache:
+            self.cache.prune()
+        if self.manifest_changed or self.manifest_force:
+            with trace('manifest', 'manifest'):
+                self.write_manifest()
+        if snapshot:
+            self.meta['snapshot'] = self.get_run_key(snapshot)
+        self.prune_hashes()
+        self.state.save()
 
 # ------------------------------------------------------------------------------
 # Main Runner
@@ -1018,6 +3503,11 @@ def main(argv=None):
         '--force', action='store_true', help="force rebuild of all files"
         )
 
+    op.add_option(
+        '-j', '--jobs', type='int', default=1, metavar='N',
+        help="build up to N assets in parallel"
+        )
+
     op.add_option(
         '--nuke', action='store_true',
         help="remove all generated and downloaded files"
@@ -1028,12 +3518,25 @@ def main(argv=None):
         help="specify a profile to use"
         )
 
+    op.add_option(
+        '--refresh', action='store_true',
+        help="revalidate downloaded sources with the remote servers"
+        )
+
+    op.add_option(
+        '--trace', dest='trace', metavar='FILE',
+        help="save a trace of the build in the Chrome trace event format"
+        )
+
     op.add_option(
         '--watch', action='store_true',
-        help="keep running assetgen on a loop"
+        help="keep running assetgen and rebuild on file changes"
         )
 
-    autocomplete(op)
+    if 'OPTPARSE_AUTO_COMPLETE' in environ:
+        from tavutil.optcomplete import autocomplete
+        autocomplete(op)
+
     options, files = op.parse_args(argv)
 
     if options.version:
@@ -1047,10 +3550,20 @@ def main(argv=None):
     clean = options.clean
     extensions = options.path
     force = options.force
+    jobs = options.jobs
     nuke = options.nuke
     profile = options.name
+    get_downloader().refresh = options.refresh
     watch = options.watch
 
+    if options.trace:
+        trace_path = realpath(options.trace)
+        TRACER.enabled = True
+        def save_trace():
+            TRACER.save(trace_path)
+            TRACER.summary()
+        atexit(save_trace)
+
     if extensions:
         scope = globals()
         for ext in extensions:
@@ -1062,6 +3575,8 @@ def main(argv=None):
                 exit("Could not find %s" % file)
 
     if not files:
+        from tavutil.env import run_command
+        from tavutil.scm import is_git, SCMConfig
         if not is_git():
             op.print_help()
             sys.exit()
@@ -1076,12 +3591,15 @@ def main(argv=None):
 
     files = [realpath(file) for file in files]
 
-    if watch:
-        mtime_cache = {}
-        for file in files:
-            mtime_cache[file] = stat(file)[ST_MTIME]
+    if jobs < 1:
+        exit("The number of --jobs must be at least 1.")
 
-    generators = [AssetGenRunner(file, profile, force, nuke) for file in files]
+    stats = StatCache()
+    tree = DirectoryIndex()
+    generators = [
+        AssetGenRunner(file, profile, force, nuke, jobs, stats, tree)
+        for file in files
+        ]
 
     if nuke:
         if isdir(DOWNLOADS_PATH):
@@ -1095,20 +3613,42 @@ def main(argv=None):
         sys.exit()
 
     if watch:
-        while 1:
-            try:
-                for assetgen in generators:
-                    assetgen.run()
+        watcher = get_watcher()
+        for assetgen in generators:
+            assetgen.add_watches(watcher)
+        todo = [None] * len(generators)
+        try:
+            while 1:
+                for idx, assetgen in enumerate(generators):
+                    try:
+                        assetgen.run(todo[idx])
+                    except AppExit:
+                        pass
+                changed = watcher.wait()
+                stats.clear()
+                if changed is None:
+                    tree.clear()
+                else:
+                    tree.update(changed)
                 for idx, file in enumerate(files):
-                    mtime = stat(file)[ST_MTIME]
-                    if mtime > mtime_cache[file]:
-                        mtime_cache[file] = mtime
-                        generators[idx] = AssetGenRunner(file, profile, force)
-                sleep(1)
-            except AppExit:
-                sleep(3)
-            except KeyboardInterrupt:
-                break
+                    todo[idx] = changed
+                    if changed is None:
+                        continue
+                    if not (file in changed or
+                            generators[idx].needs_reload(changed)):
+                        continue
+                    try:
+                        assetgen = AssetGenRunner(
+                            file, profile, force, jobs=jobs, stats=stats,
+                            tree=tree
+                            )
+                    except AppExit:
+                        continue
+                    assetgen.add_watches(watcher)
+                    generators[idx] = assetgen
+                    todo[idx] = None
+        except KeyboardInterrupt:
+            pass
     else:
         try:
             for assetgen in generators:
@@ -0,0 +1,137 @@
+# Public Domain (-) 2010-2012 The Assetgen Authors.
+# See the Assetgen UNLICENSE file for details.
+
+"""Compact binary index format for asset manifests.
+
+The index is written alongside the JSON manifest, and lets static file
+handlers look up entries via an mmap, without having to parse the whole of a
+large JSON document on startup.
+
+All integers are little-endian. The file starts with a 12 byte header::
+
+    magic "AGMI" | version (uint32) | entry count (uint32)
+
+This is followed by a table of fixed size records, one per entry and sorted
+by key::
+
+    key offset (uint32) | key length (uint32) |
+    value offset (uint32) | value length (uint32)
+
+The offsets are relative to the start of the file and point into the string
+data which follows the table. Each value holds the fields of the entry,
+separated by NUL bytes::
+
+    path, size, digest, type, gzip path, gzip size
+
+The gzip fields are empty if there is no precompressed variant.
+"""
+
+from mmap import mmap, ACCESS_READ
+from struct import calcsize, pack, unpack_from
+
+MAGIC = 'AGMI'
+VERSION = 1
+
+FIELDS = ('path', 'size', 'digest', 'type', 'gzip_path', 'gzip_size')
+HEADER = '<4sII'
+RECORD = '<IIII'
+
+HEADER_SIZE = calcsize(HEADER)
+RECORD_SIZE = calcsize(RECORD)
+
+def build_index(entries):
+    """Return the binary index for the given mapping of keys to entries.
+
+    Each entry is a dict with the same fields as in the JSON manifest, i.e.
+    ``path``, ``size``, ``digest``, ``type`` and an optional ``gzip`` dict
+    with its own ``path`` and ``size``.
+    """
+
+    # Sort on the encoded keys, as lookups compare them bytewise.
+    keys = []
+    for key in entries:
+        if isinstance(key, unicode):
+            keys.append((key.encode('utf-8'), key))
+        else:
+            keys.append((key, key))
+    keys.sort()
+    records = []
+    data = []
+    offset = HEADER_SIZE + RECORD_SIZE * len(keys)
+    for key, orig in keys:
+        entry = entries[orig]
+        gzip = entry.get('gzip') or {}
+        value = '\0'.join([
+            entry['path'], str(entry['size']), entry['digest'], entry['type'],
+            gzip.get('path', ''), str(gzip.get('size', ''))
+            ])
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        records.append(pack(
+            RECORD, offset, len(key), offset + len(key), len(value)
+            ))
+        data.append(key)
+        data.append(value)
+        offset += len(key) + len(value)
+    return ''.join(
+        [pack(HEADER, MAGIC, VERSION, len(keys))] + records + data
+        )
+
+class ManifestIndex(object):
+    """Read-only view of a binary manifest index.
+
+    Lookups do a binary search over the mmapped file, so opening an index is
+    cheap regardless of its size.
+    """
+
+    def __init__(self, path):
+        file = open(path, 'rb')
+        try:
+            self.data = data = mmap(file.fileno(), 0, access=ACCESS_READ)
+        finally:
+            file.close()
+        magic, version, self.count = unpack_from(HEADER, data)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("Unsupported manifest index: %s" % path)
+
+    def __contains__(self, key):
+        return self.find(key) is not None
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.data.close()
+
+    def find(self, key):
+        """Return the raw value bytes for the key, or None."""
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        data = self.data
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            key_offset, key_len, value_offset, value_len = unpack_from(
+                RECORD, data, HEADER_SIZE + mid * RECORD_SIZE
+                )
+            current = data[key_offset:key_offset+key_len]
+            if current < key:
+                low = mid + 1
+            elif current > key:
+                high = mid
+            else:
+                return data[value_offset:value_offset+value_len]
+
+    def get(self, key, default=None):
+        """Return the entry for the key as a dict, or the default."""
+        value = self.find(key)
+        if value is None:
+            return default
+        entry = dict(zip(FIELDS, value.split('\0')))
+        entry['size'] = int(entry['size'])
+        if entry['gzip_size']:
+            entry['gzip_size'] = int(entry['gzip_size'])
+        else:
+            entry['gzip_path'] = entry['gzip_size'] = None
+        return entry
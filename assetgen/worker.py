@@ -0,0 +1,100 @@
+# Public Domain (-) 2010-2012 The Assetgen Authors.
+# See the Assetgen UNLICENSE file for details.
+
+"""Framing protocol and stub implementation for compiler workers.
+
+Assetgen talks to long-lived worker processes over their stdin/stdout. Every
+message consists of two netstrings -- a JSON header followed by a raw body.
+
+A job request has a header of the form ``{"args": [...], "cwd": "..."}``,
+where the ``args`` are the command line arguments that would have been
+passed to the compiler, and the body holds any stdin data. The response has
+a header of the form ``{"status": 0, "stderr": "..."}`` and a body with the
+compiler's stdout.
+
+A health check request has a header of ``{"ping": 1}`` and must be answered
+with a ``{"status": 0}`` header and an empty body.
+
+Running this module with a command, e.g. ``python -m assetgen.worker coffee``,
+starts a stub worker which runs each job as a one-shot invocation of that
+command. It is mainly useful for testing, or as a starting point for writing
+workers which keep compilers loaded between jobs.
+"""
+
+import sys
+
+from simplejson import dumps as enc_json, loads as dec_json
+
+# ------------------------------------------------------------------------------
+# Framing
+# ------------------------------------------------------------------------------
+
+def read_netstring(stream):
+    length = []
+    while 1:
+        char = stream.read(1)
+        if not char:
+            raise EOFError("Unexpected end of stream")
+        if char == ':':
+            break
+        if not char.isdigit() or len(length) > 12:
+            raise ValueError("Invalid netstring length")
+        length.append(char)
+    length = int(''.join(length))
+    data = stream.read(length)
+    if len(data) != length:
+        raise EOFError("Unexpected end of stream")
+    if stream.read(1) != ',':
+        raise ValueError("Invalid netstring terminator")
+    return data
+
+def write_netstring(stream, data):
+    stream.write('%d:%s,' % (len(data), data))
+
+def read_message(stream):
+    header = dec_json(read_netstring(stream))
+    return header, read_netstring(stream)
+
+def write_message(stream, header, body=''):
+    write_netstring(stream, enc_json(header))
+    write_netstring(stream, body)
+    stream.flush()
+
+# ------------------------------------------------------------------------------
+# Stub Worker
+# ------------------------------------------------------------------------------
+
+def serve(handler, input=sys.stdin, output=sys.stdout):
+    """Answer job requests with the ``handler`` until stdin is closed."""
+
+    while 1:
+        try:
+            header, body = read_message(input)
+        except EOFError:
+            return
+        if header.get('ping'):
+            write_message(output, {'status': 0})
+            continue
+        status, out, err = handler(header['args'], header.get('cwd'), body)
+        write_message(output, {'status': status, 'stderr': err}, out)
+
+def main(argv=None):
+    argv = argv or sys.argv[1:]
+    if not argv:
+        print >> sys.stderr, "Usage: python -m assetgen.worker <command> ..."
+        sys.exit(1)
+
+    from subprocess import PIPE, Popen
+
+    def handler(args, cwd, stdin):
+        process = Popen(
+            argv + args, stdin=PIPE, stdout=PIPE, stderr=PIPE, cwd=cwd,
+            universal_newlines=True
+            )
+        out, err = process.communicate(stdin)
+        return process.returncode, out, err
+
+    serve(handler)
+
+if __name__ == '__main__':
+    main()
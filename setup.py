@@ -31,7 +31,7 @@ setup(
     install_requires=[
         "Mako >= 0.7.2",
         "PyYAML >= 3.09",
-        "requests >= 0.14.1",
+        "requests >= 2.3.0",
         "simplejson >= 2.1.6",
         "tavutil >= 1.0"
         ],
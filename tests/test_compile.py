@@ -0,0 +1,173 @@
+# Public Domain (-) 2010-2012 The Assetgen Authors.
+# See the Assetgen UNLICENSE file for details.
+
+"""Tests for the per-source compilation cache."""
+
+import os
+import unittest
+
+from hashlib import sha1
+from os.path import join
+from shutil import rmtree
+from tempfile import gettempdir, mkdtemp
+
+from assetgen.bench import write, write_stubs
+from assetgen.main import AssetGenRunner, find_imports, unlock
+
+CONFIG = """
+generate:
+- site.css:
+    source: src/s*.scss
+    depends: src/settings.txt
+cache.directory: .cache
+output.directory: out
+state.directory: .state
+"""
+
+class TestFindImports(unittest.TestCase):
+
+    def setUp(self):
+        self.root = root = mkdtemp()
+        for path in (
+            'a.scss', '_partial.scss', 'lib/_index.scss', 'b.less',
+            'theme.css', 'c.styl', 'mixins/index.styl', 'vendor/d.scss'
+            ):
+            write(join(root, path), '')
+
+    def tearDown(self):
+        rmtree(self.root)
+
+    def find(self, filename, text):
+        imports = find_imports(
+            join(self.root, filename), text, [join(self.root, 'vendor')]
+            )
+        if imports is None:
+            return
+        return [path[len(self.root)+1:] for path in imports]
+
+    def test_scss(self):
+        self.assertEqual(
+            self.find('x.scss', '@import "a", \'partial\';\n@use "lib";'),
+            ['a.scss', '_partial.scss', 'lib/_index.scss']
+            )
+        self.assertEqual(
+            self.find('x.scss', '@use "sass:math";\n@forward "d" show x;'),
+            ['vendor/d.scss']
+            )
+        self.assertEqual(
+            self.find('x.scss', '@import url("theme.css") screen;'),
+            ['theme.css']
+            )
+        self.assertEqual(
+            self.find('x.scss', '@import "http://example.com/a.css";'), []
+            )
+
+    def test_sass(self):
+        self.assertEqual(self.find('x.sass', '@import a, partial\n'), [
+            'a.scss', '_partial.scss'
+            ])
+
+    def test_less(self):
+        self.assertEqual(
+            self.find('x.less', '@import (reference) "b";\n'), ['b.less']
+            )
+
+    def test_stylus(self):
+        self.assertEqual(
+            self.find('x.styl', "@import 'c'\n@require 'mixins'\n"),
+            ['c.styl', 'mixins/index.styl']
+            )
+
+    def test_unresolved(self):
+        self.assertEqual(self.find('x.scss', '@import "missing";'), None)
+        self.assertEqual(self.find('x.scss', '@import "#{$theme}";'), None)
+        self.assertEqual(self.find('x.less', '@import "@{dir}/b";'), None)
+
+class TestCompileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.path = os.environ['PATH']
+        self.root = root = mkdtemp()
+        write_stubs(join(root, 'bin'))
+        os.environ['PATH'] = join(root, 'bin') + os.pathsep + self.path
+        self.log = os.environ['ASSETGEN_BENCH_LOG'] = join(root, 'calls.log')
+        self.config = join(root, 'assetgen.yaml')
+        write(self.config, CONFIG)
+        self.data_dir = join(
+            gettempdir(), 'assetgen-%s' % sha1(self.config).hexdigest()[:12]
+            )
+        self.write('src/partials/_vars.scss', '$color: red;\n')
+        self.write('src/settings.txt', 'a\n')
+        self.write('src/s0.scss', '.s0 { color: red }\n')
+        self.write('src/s1.scss', '@import "partials/vars";\n.s1 { x: y }\n')
+        self.write('src/s2.scss', '.s2 { color: blue }\n')
+        self.write('src/s3.scss', '@import "s0";\n.s3 { x: y }\n')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        os.environ['PATH'] = self.path
+        del os.environ['ASSETGEN_BENCH_LOG']
+        unlock(join(self.data_dir, 'lock'))
+        rmtree(self.data_dir, ignore_errors=True)
+        rmtree(self.root)
+
+    def write(self, path, content, append=False):
+        path = join(self.root, path)
+        if append:
+            content = open(path, 'rb').read() + content
+        write(path, content)
+
+    def build(self, force=None):
+        """Run a build and return the sources that sass was called with."""
+        if os.path.isfile(self.log):
+            os.remove(self.log)
+        unlock(join(self.data_dir, 'lock'))
+        runner = AssetGenRunner(self.config, force=force)
+        runner.run()
+        runner.state.close()
+        if not os.path.isfile(self.log):
+            return []
+        calls = []
+        for line in open(self.log):
+            args = line.split()
+            if args[0] == 'sass':
+                calls.append(os.path.basename(args[-1]))
+        return sorted(calls)
+
+    def test_only_changed_source_recompiled(self):
+        self.assertEqual(
+            self.build(), ['s0.scss', 's1.scss', 's2.scss', 's3.scss']
+            )
+        self.write('src/s2.scss', '.edit { color: red }\n', True)
+        self.assertEqual(self.build(), ['s2.scss'])
+
+    def test_importers_recompiled(self):
+        self.build()
+        # A source imported by a sibling invalidates both of them.
+        self.write('src/s0.scss', '.edit { color: red }\n', True)
+        self.assertEqual(self.build(), ['s0.scss', 's3.scss'])
+        # As does a change to an imported partial which isn't a source. As
+        # the partial isn't one of the asset's depends, the rebuild of the
+        # asset itself has to be forced.
+        self.write('src/partials/_vars.scss', '$size: 1px;\n', True)
+        self.assertEqual(self.build(True), ['s1.scss'])
+
+    def test_depends_recompiled(self):
+        self.build()
+        self.write('src/settings.txt', 'b\n')
+        self.assertEqual(
+            self.build(), ['s0.scss', 's1.scss', 's2.scss', 's3.scss']
+            )
+
+    def test_unresolved_imports(self):
+        self.build()
+        self.write('src/s2.scss', '@import "#{$x}";\n', True)
+        self.assertEqual(self.build(), ['s2.scss'])
+        # The output of a source with an unresolvable import depends on all
+        # of the asset's files.
+        self.write('src/s0.scss', '.edit { color: red }\n', True)
+        self.assertEqual(self.build(), ['s0.scss', 's2.scss', 's3.scss'])
+
+if __name__ == '__main__':
+    unittest.main()
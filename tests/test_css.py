@@ -0,0 +1,316 @@
+# Public Domain (-) 2010-2012 The Assetgen Authors.
+# See the Assetgen UNLICENSE file for details.
+
+"""Tests for the CSS transforms."""
+
+import unittest
+
+from time import time
+
+from assetgen.css import flip_css, minify_css
+
+def make_css(rules):
+    return ''.join(
+        '.r%d { color: #ffffff; margin: 0px }\n'
+        '.r%d:hover { color: #ffffff; margin: 0px }\n'
+        '/* plain comment */\n' % (idx, idx)
+        for idx in range(rules)
+        )
+
+def timed(func, *args):
+    start = time()
+    func(*args)
+    return time() - start
+
+class TestMinifyCSS(unittest.TestCase):
+
+    def test_basic(self):
+        self.assertEqual(
+            minify_css('a  >  b { color : #FFFFFF ; margin: 0px 0em }'),
+            'a>b{color:#fff;margin:0 0}'
+            )
+
+    def test_flex_units_kept(self):
+        self.assertEqual(
+            minify_css(
+                'a { flex: 1 1 0px; -webkit-flex: 1 1 0px; flex-basis: 0%;'
+                ' -ms-flex-basis: 0em; margin: 0px }'
+                ),
+            'a{flex:1 1 0px;-webkit-flex:1 1 0px;flex-basis:0%;'
+            '-ms-flex-basis:0em;margin:0}'
+            )
+
+    def test_merge_same_selector(self):
+        self.assertEqual(
+            minify_css('a{color:red} a{margin:0}'), 'a{color:red;margin:0}'
+            )
+
+    def test_merge_identical_declarations(self):
+        self.assertEqual(
+            minify_css('a{color:red} b:hover{color:red} c>d{color:red}'),
+            'a,b:hover,c>d{color:red}'
+            )
+
+    def test_no_merge_for_unsupported_selectors(self):
+        for selector in (
+            'b:focus-visible', 'b:-moz-focusring', 'b::-webkit-scrollbar',
+            'b:not(.x)', 'b:is(.x)', 'input[type="text"]'
+            ):
+            css = 'a{color:red} %s{color:red}' % selector
+            self.assertEqual(
+                minify_css(css), 'a{color:red}%s{color:red}' % selector
+                )
+            css = '%s{color:red} a{color:red}' % selector
+            self.assertEqual(
+                minify_css(css), '%s{color:red}a{color:red}' % selector
+                )
+
+    def test_preserved_comments(self):
+        self.assertEqual(
+            minify_css('a{margin:0}/*! keep */b{margin:0}'),
+            'a{margin:0}/*! keep */b{margin:0}'
+            )
+        self.assertEqual(
+            minify_css('/*! top */\n@media screen { /*! m */ a { x: 1 } }'),
+            '/*! top */@media screen{/*! m */a{x:1}}'
+            )
+        self.assertEqual(
+            minify_css('a /*! mid */ b { x: 1 }'), '/*! mid */a b{x:1}'
+            )
+        self.assertEqual(
+            minify_css('a { /* drop */ x: 1 }'), 'a{x:1}'
+            )
+
+    def test_keyframes_not_merged(self):
+        self.assertEqual(
+            minify_css('@keyframes k { from { x: 1 } to { x: 1 } }'),
+            '@keyframes k{from{x:1}to{x:1}}'
+            )
+
+    def test_nested_blocks(self):
+        self.assertEqual(
+            minify_css('a { color : red; b { x: 1px } } a { color: red }'),
+            'a{color:red;b{x:1px}}a{color:red}'
+            )
+        self.assertEqual(
+            minify_css(
+                'c{color:red} a { color: red; &:hover { color: blue }'
+                ' margin: 0px } d{color:red}'
+                ),
+            'c{color:red}a{color:red;&:hover{color:blue}margin:0}'
+            'd{color:red}'
+            )
+        self.assertEqual(
+            minify_css('a { @media print { color: red; b { margin: 0px } } }'),
+            'a{@media print{color:red;b{margin:0}}}'
+            )
+        # Rules within a nested rule are never merged.
+        self.assertEqual(
+            minify_css('a { b { x: 1 } b { y: 2 } c { x: 1 } }'),
+            'a{b{x:1}b{y:2}c{x:1}}'
+            )
+
+    def test_unclosed_blocks(self):
+        self.assertEqual(minify_css('a { color: red'), 'a{color:red}')
+        self.assertEqual(
+            minify_css('a { margin: 0 } b { color : red; margin: 0px'),
+            'a{margin:0}b{color:red;margin:0}'
+            )
+        self.assertEqual(
+            minify_css('@media print { a { color: red } b { margin: 0px'),
+            '@media print{a{color:red}b{margin:0}}'
+            )
+        self.assertEqual(
+            minify_css('a { color: red; b { x: 1px'), 'a{color:red;b{x:1px}}'
+            )
+
+    def test_large_input(self):
+        # Roughly 3MB of CSS.
+        css = make_css(30000)
+        output = minify_css(css)
+        self.assertTrue(output.startswith(
+            '.r0,.r0:hover,.r1,.r1:hover,.r2'
+            ))
+        self.assertEqual(output.count('{'), 1)
+        self.assertEqual(output.count(','), 59999)
+        self.assertTrue(output.endswith('.r29999:hover{color:#fff;margin:0}'))
+
+    def test_large_input_scales_linearly(self):
+        small = make_css(5000)
+        large = make_css(20000)
+        minify_css(small)
+        small_time = min(timed(minify_css, small) for _ in range(3))
+        large_time = min(timed(minify_css, large) for _ in range(3))
+        # The input is four times the size, so allow plenty of slack for
+        # noise whilst still catching quadratic behaviour.
+        self.assertTrue(
+            large_time < small_time * 10,
+            "%.3fs vs %.3fs" % (large_time, small_time)
+            )
+
+class TestFlipCSS(unittest.TestCase):
+
+    def assertFlips(self, css, expected):
+        self.assertEqual(flip_css(css), expected)
+        self.assertEqual(flip_css(expected), css)
+
+    def test_property_names(self):
+        self.assertFlips(
+            'a { margin-left: 1px; padding-right: 2px; border-left: 1px solid;'
+            ' left: 0; right: auto }',
+            'a { margin-right: 1px; padding-left: 2px; border-right: 1px solid;'
+            ' right: 0; left: auto }'
+            )
+        self.assertFlips(
+            'a { -webkit-margin-left: 2px; -moz-padding-start: 1px }',
+            'a { -webkit-margin-right: 2px; -moz-padding-start: 1px }'
+            )
+
+    def test_custom_properties(self):
+        self.assertFlips(
+            'a { --left-pad: 1px; margin-left: var(--left-pad) }',
+            'a { --left-pad: 1px; margin-right: var(--left-pad) }'
+            )
+
+    def test_four_value_shorthands(self):
+        self.assertFlips(
+            'a { margin: 1px 2px 3px 4px; padding: 1px 2px 3px 4px }',
+            'a { margin: 1px 4px 3px 2px; padding: 1px 4px 3px 2px }'
+            )
+        self.assertFlips(
+            'a { border-width: 0 1px 2px 3px !important }',
+            'a { border-width: 0 3px 2px 1px !important }'
+            )
+        self.assertFlips(
+            'a { border-color: red rgb(0, 0, 0) blue #fff }',
+            'a { border-color: red #fff blue rgb(0, 0, 0) }'
+            )
+        # Shorthands with fewer values are already symmetric.
+        self.assertEqual(
+            flip_css('a { margin: 1px 2px 3px; padding: 1px 2px }'),
+            'a { margin: 1px 2px 3px; padding: 1px 2px }'
+            )
+
+    def test_border_radius(self):
+        self.assertEqual(
+            flip_css(
+                'a { border-radius: 1px 2px; border-radius: 1px 2px 3px;'
+                ' border-radius: 1px 2px 3px 4px / 5px 6px }'
+                ),
+            'a { border-radius: 2px 1px; border-radius: 2px 1px 2px 3px;'
+            ' border-radius: 2px 1px 4px 3px / 6px 5px }'
+            )
+        self.assertFlips(
+            'a { border-top-left-radius: 2px; -webkit-border-bottom-right-radius:'
+            ' 3px }',
+            'a { border-top-right-radius: 2px; -webkit-border-bottom-left-radius:'
+            ' 3px }'
+            )
+
+    def test_keywords(self):
+        self.assertFlips(
+            'a { float: left; clear: right; text-align: LEFT }',
+            'a { float: right; clear: left; text-align: RIGHT }'
+            )
+        self.assertEqual(
+            flip_css('a { display: inline-block; text-align: center }'),
+            'a { display: inline-block; text-align: center }'
+            )
+
+    def test_direction(self):
+        self.assertFlips('a { direction: ltr }', 'a { direction: rtl }')
+
+    def test_cursor(self):
+        self.assertFlips(
+            'a { cursor: e-resize; cursor: ne-resize; cursor: sw-resize }',
+            'a { cursor: w-resize; cursor: nw-resize; cursor: se-resize }'
+            )
+        self.assertEqual(
+            flip_css('a { cursor: n-resize; cursor: pointer }'),
+            'a { cursor: n-resize; cursor: pointer }'
+            )
+
+    def test_cursor_whitespace(self):
+        self.assertEqual(
+            flip_css('a { cursor: e-resize , pointer; cursor:  NW-resize }'),
+            'a { cursor: w-resize , pointer; cursor:  ne-resize }'
+            )
+
+    def test_background_position(self):
+        self.assertFlips(
+            'a { background-position: left top; background-position-x: 20% }',
+            'a { background-position: right top; background-position-x: 80% }'
+            )
+        self.assertFlips(
+            'a { background-position: 20% 0, 30%  10% }',
+            'a { background-position: 80% 0, 70%  10% }'
+            )
+        self.assertEqual(
+            flip_css('a { background-position: 10px 20%; background: 0 25% }'),
+            'a { background-position: 10px 20%; background: 0 25% }'
+            )
+        self.assertEqual(
+            flip_css('a { background: url(a.png) no-repeat 12.5% top }'),
+            'a { background: url(a.png) no-repeat 87.5% top }'
+            )
+
+    def test_background_functions(self):
+        for css in (
+            'a { background: linear-gradient(90deg, red 10%, blue 90%) }',
+            'a { background: hsl(120, 20%, 30%) url(x) }',
+            'a { background: rgba(0, 0, 0, 50%) }',
+            'a { background-position: calc(10% + 5px) 0 }',
+            ):
+            self.assertEqual(flip_css(css), css)
+        self.assertFlips(
+            'a { background: url(a.png) 25% 0, rgba(0, 0, 0, 0.5) 10% 0 }',
+            'a { background: url(a.png) 75% 0, rgba(0, 0, 0, 0.5) 90% 0 }'
+            )
+        self.assertFlips(
+            'a { background: linear-gradient(red 10%, blue) 30% 0 }',
+            'a { background: linear-gradient(red 10%, blue) 70% 0 }'
+            )
+
+    def test_opaque_tokens(self):
+        self.assertFlips(
+            'a { background: url(left.png) right 10px }',
+            'a { background: url(left.png) left 10px }'
+            )
+        css = (
+            'a { background: embed("icons/left.png") 0 0;'
+            ' background: url( "right.png" ) 0 0; content: "left" }'
+            )
+        self.assertEqual(flip_css(css), css)
+        self.assertEqual(
+            flip_css('a { /* float: left */ float: left }'),
+            'a { /* float: left */ float: right }'
+            )
+
+    def test_noflip_declaration(self):
+        self.assertEqual(
+            flip_css('a { /* @noflip */ float: left; margin-left: 1px }'),
+            'a { /* @noflip */ float: left; margin-right: 1px }'
+            )
+
+    def test_noflip_rule(self):
+        self.assertEqual(
+            flip_css('/* @noflip */ a { float: left } b { float: left }'),
+            '/* @noflip */ a { float: left } b { float: right }'
+            )
+        self.assertEqual(
+            flip_css(
+                '/* @noflip */ @media screen { a { float: left } }'
+                ' b { float: right }'
+                ),
+            '/* @noflip */ @media screen { a { float: left } }'
+            ' b { float: left }'
+            )
+
+    def test_selectors_untouched(self):
+        self.assertEqual(
+            flip_css('.left > .right { float: left }'),
+            '.left > .right { float: right }'
+            )
+
+if __name__ == '__main__':
+    unittest.main()
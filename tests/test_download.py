@@ -0,0 +1,181 @@
+# Public Domain (-) 2010-2012 The Assetgen Authors.
+# See the Assetgen UNLICENSE file for details.
+
+"""Tests for downloading remote sources against a local HTTP server."""
+
+import os
+import unittest
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from os.path import isfile
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Lock, Thread
+from time import sleep, time
+
+from simplejson import loads as dec_json
+
+from assetgen.main import AppExit, Downloader
+
+class Server(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.active = 0
+        self.delay = 0
+        self.files = {}
+        self.lock = Lock()
+        self.peak = 0
+        self.requests = []
+
+class Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, dict(self.headers)))
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+        try:
+            if server.delay:
+                sleep(server.delay)
+            self.respond()
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def respond(self):
+        if self.path == '/broken':
+            # Promise more data than is sent, so that the download fails
+            # part way through.
+            self.send_response(200)
+            self.send_header('Content-Length', '1000000')
+            self.end_headers()
+            self.wfile.write('x' * 1000)
+            return
+        if self.path not in self.server.files:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body, etag = self.server.files[self.path]
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', 'Sat, 01 Jan 2011 00:00:00 GMT')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class TestDownloader(unittest.TestCase):
+
+    def setUp(self):
+        self.server = server = Server()
+        self.thread = Thread(target=server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.base = 'http://127.0.0.1:%d' % server.server_address[1]
+        self.root = mkdtemp()
+        self.downloader = Downloader(self.root)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        rmtree(self.root)
+
+    def get_files(self):
+        files = []
+        for directory, _, filenames in os.walk(self.root):
+            files.extend(filenames)
+        return sorted(files)
+
+    def test_download(self):
+        body = 'var a = 1;\n' * 20000
+        self.server.files['/lib/a.js'] = (body, '"v1"')
+        path = self.downloader.fetch(self.base + '/lib/a.js')
+        self.assertTrue(path.startswith(self.root))
+        self.assertTrue(path.endswith('/lib/a.js'))
+        self.assertEqual(open(path, 'rb').read(), body)
+        # No temp files are left behind.
+        self.assertEqual(self.get_files(), ['a.js', 'a.js.meta'])
+
+    def test_meta(self):
+        self.server.files['/a.js'] = ('a', '"v1"')
+        path = self.downloader.fetch(self.base + '/a.js')
+        self.assertEqual(dec_json(open(path + '.meta').read()), {
+            'etag': '"v1"', 'last-modified': 'Sat, 01 Jan 2011 00:00:00 GMT'
+            })
+
+    def test_cached(self):
+        self.server.files['/a.js'] = ('a', '"v1"')
+        url = self.base + '/a.js'
+        self.downloader.fetch(url)
+        Downloader(self.root).fetch(url)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_refresh(self):
+        files = self.server.files
+        files['/a.js'] = ('a', '"v1"')
+        url = self.base + '/a.js'
+        path = self.downloader.fetch(url)
+        downloader = Downloader(self.root)
+        downloader.refresh = True
+        self.assertEqual(downloader.fetch(url), path)
+        _, headers = self.server.requests[-1]
+        self.assertEqual(headers['if-none-match'], '"v1"')
+        self.assertEqual(
+            headers['if-modified-since'], 'Sat, 01 Jan 2011 00:00:00 GMT'
+            )
+        self.assertEqual(open(path, 'rb').read(), 'a')
+        # Each URL is only revalidated once per downloader.
+        downloader.fetch(url)
+        self.assertEqual(len(self.server.requests), 2)
+        # Changed files are downloaded again.
+        files['/a.js'] = ('b', '"v2"')
+        downloader = Downloader(self.root)
+        downloader.refresh = True
+        downloader.fetch(url)
+        self.assertEqual(open(path, 'rb').read(), 'b')
+        self.assertEqual(dec_json(open(path + '.meta').read())['etag'], '"v2"')
+
+    def test_failed_download(self):
+        self.assertRaises(
+            AppExit, self.downloader.fetch, self.base + '/broken'
+            )
+        self.assertEqual(self.get_files(), [])
+
+    def test_missing(self):
+        self.assertRaises(
+            AppExit, self.downloader.fetch, self.base + '/missing.js'
+            )
+        self.assertEqual(self.get_files(), [])
+
+    def test_prefetch(self):
+        server = self.server
+        server.delay = 0.2
+        urls = []
+        for idx in range(8):
+            server.files['/%d.js' % idx] = (str(idx), '"%d"' % idx)
+            urls.append('%s/%d.js' % (self.base, idx))
+        start = time()
+        self.downloader.prefetch(urls + urls)
+        duration = time() - start
+        self.assertEqual(len(server.requests), 8)
+        self.assertTrue(server.peak > 1)
+        self.assertTrue(duration < 8 * 0.2, duration)
+        for idx, url in enumerate(urls):
+            path = self.downloader.get_path(url)
+            self.assertTrue(isfile(path))
+            self.assertEqual(open(path).read(), str(idx))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+# Public Domain (-) 2010-2012 The Assetgen Authors.
+# See the Assetgen UNLICENSE file for details.
+
+"""Tests for emitting outputs."""
+
+import os
+import unittest
+
+from hashlib import sha1
+from os.path import getmtime, join
+from shutil import rmtree
+from tempfile import gettempdir, mkdtemp
+from time import time
+
+from assetgen.bench import write
+from assetgen.main import AssetGenRunner, unlock
+
+CONFIG = """
+prereqs:
+- gen/consts.css:
+    source: src/consts.css
+generate:
+- site.css:
+    source:
+      - gen/consts.css
+      - src/main.css
+output.directory: out
+state.directory: .state
+"""
+
+class TestIdenticalOutputs(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.root = root = mkdtemp()
+        self.config = join(root, 'assetgen.yaml')
+        write(self.config, CONFIG)
+        write(join(root, 'src', 'consts.css'), '.a { color: red }\n')
+        write(join(root, 'src', 'main.css'), '.b { color: blue }\n')
+        self.data_dir = join(
+            gettempdir(), 'assetgen-%s' % sha1(self.config).hexdigest()[:12]
+            )
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        unlock(join(self.data_dir, 'lock'))
+        rmtree(self.data_dir, ignore_errors=True)
+        rmtree(self.root)
+
+    def build(self):
+        """Run a build and return the paths of the assets generated."""
+        unlock(join(self.data_dir, 'lock'))
+        runner = AssetGenRunner(self.config)
+        generated = []
+        for asset in runner.prereqs + runner.generate:
+            def generate(asset=asset, generate=asset.generate):
+                generated.append(asset.path)
+                return generate()
+            asset.generate = generate
+        runner.run()
+        runner.state.close()
+        return generated
+
+    def set_mtime(self, path, mtime):
+        os.utime(join(self.root, path), (mtime, mtime))
+
+    def test_identical_prereq_does_not_cascade(self):
+        self.assertEqual(self.build(), ['gen/consts.css', 'site.css'])
+        # Move everything into the past, as mtimes are compared in whole
+        # seconds.
+        past = int(time()) - 100
+        for path in (
+            'assetgen.yaml', 'src/consts.css', 'src/main.css',
+            'gen/consts.css', 'out/site.css'
+            ):
+            self.set_mtime(path, past)
+        # The prereq's source is touched without changing its content, so
+        # the prereq gets regenerated with identical output.
+        self.set_mtime('src/consts.css', time() + 10)
+        self.assertEqual(self.build(), ['gen/consts.css'])
+        self.assertEqual(getmtime(join(self.root, 'gen/consts.css')), past)
+        self.assertEqual(getmtime(join(self.root, 'out/site.css')), past)
+        # A real change still cascades.
+        write(join(self.root, 'src', 'consts.css'), '.a { color: green }\n')
+        self.set_mtime('src/consts.css', time() + 20)
+        self.assertEqual(self.build(), ['gen/consts.css', 'site.css'])
+        self.assertTrue(
+            'green' in open(join(self.root, 'out/site.css')).read()
+            )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+# Public Domain (-) 2010-2012 The Assetgen Authors.
+# See the Assetgen UNLICENSE file for details.
+
+"""Tests for glob matching and the directory index."""
+
+import os
+import unittest
+
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from assetgen.main import DirectoryIndex, compile_glob
+
+def touch(path):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    open(path, 'wb').close()
+
+class TestCompileGlob(unittest.TestCase):
+
+    def assertMatches(self, pattern, paths, matches=True):
+        match = compile_glob(pattern)
+        for path in paths:
+            self.assertEqual(bool(match(path)), matches, (pattern, path))
+
+    def test_fnmatch_compatible(self):
+        # Without **, * also matches across path separators.
+        self.assertMatches('src/*.js', ['src/a.js', 'src/lib/a.js'])
+        self.assertMatches('src/*.js', ['src/a.coffee', 'lib/a.js'], False)
+
+    def test_double_star(self):
+        self.assertMatches(
+            'src/**/*.js', ['src/a.js', 'src/lib/a.js', 'src/lib/x/a.js']
+            )
+        self.assertMatches(
+            'src/**/*.js', ['src/a.css', 'other/src/a.js', 'src.js'], False
+            )
+        self.assertMatches('src/**', ['src/a.js', 'src/lib/a.js'])
+
+    def test_single_star_within_segment(self):
+        self.assertMatches(
+            'src/**/lib/*.js', ['src/lib/a.js', 'src/x/lib/a.js']
+            )
+        self.assertMatches('src/**/lib/*.js', ['src/lib/x/a.js'], False)
+        self.assertMatches('src/**/?.js', ['src/a.js', 'src/x/b.js'])
+        self.assertMatches('src/**/?.js', ['src/ab.js', 'src/x/.js'], False)
+
+    def test_character_classes(self):
+        self.assertMatches('src/**/[ab].js', ['src/a.js', 'src/x/b.js'])
+        self.assertMatches('src/**/[ab].js', ['src/c.js'], False)
+        self.assertMatches('src/**/[!ab].js', ['src/c.js', 'src/x/d.js'])
+        self.assertMatches(
+            'src/**/[!ab].js', ['src/a.js', 'src/x/b.js'], False
+            )
+        # An unclosed bracket is matched literally.
+        self.assertMatches('src/**/[a.js', ['src/[a.js'])
+
+    def test_escaping(self):
+        self.assertMatches('src/**/a+b.js', ['src/a+b.js'])
+        self.assertMatches('src/**/a+b.js', ['src/aab.js'], False)
+
+class TestDirectoryIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.root = root = mkdtemp()
+        for path in ('a.js', 'b.css', 'lib/c.js', 'lib/x/d.js', 'vendor/e.js'):
+            touch(join(root, path))
+        self.index = DirectoryIndex()
+
+    def tearDown(self):
+        rmtree(self.root)
+
+    def glob(self, pattern, excludes=()):
+        root = self.root
+        prefix = root + '/'
+        return [
+            path[len(prefix):] for path in self.index.glob(
+                join(root, pattern), [join(root, ex) for ex in excludes]
+                )
+            ]
+
+    def test_glob(self):
+        self.assertEqual(
+            self.glob('**/*.js'),
+            ['a.js', 'lib/c.js', 'lib/x/d.js', 'vendor/e.js']
+            )
+        self.assertEqual(self.glob('lib/**/*.js'), ['lib/c.js', 'lib/x/d.js'])
+        self.assertEqual(self.glob('*.css'), ['b.css'])
+
+    def test_excludes(self):
+        self.assertEqual(
+            self.glob('**/*.js', ['vendor/**', 'lib/x/*.js']),
+            ['a.js', 'lib/c.js']
+            )
+
+    def test_subtree_reuses_walk(self):
+        files = self.index.files(self.root)
+        touch(join(self.root, 'lib/new.js'))
+        # The lib tree is served from the already indexed root.
+        self.assertEqual(
+            self.index.files(join(self.root, 'lib')),
+            [path for path in files if path.startswith(self.root + '/lib/')]
+            )
+
+    def test_update_added(self):
+        root = self.root
+        self.glob('**/*.js')
+        touch(join(root, 'lib/f.js'))
+        touch(join(root, 'new/g.js'))
+        touch(join(root, 'new/y/h.js'))
+        self.index.update([join(root, 'lib/f.js'), join(root, 'new')])
+        self.assertEqual(self.glob('**/*.js'), [
+            'a.js', 'lib/c.js', 'lib/f.js', 'lib/x/d.js', 'new/g.js',
+            'new/y/h.js', 'vendor/e.js'
+            ])
+        # Repeated updates don't add duplicates.
+        self.index.update([join(root, 'lib/f.js'), join(root, 'new')])
+        self.assertEqual(len(self.glob('**/*.js')), 7)
+        files = self.index.files(root)
+        self.assertEqual(files, sorted(files))
+
+    def test_update_removed(self):
+        root = self.root
+        self.glob('**/*.js')
+        os.remove(join(root, 'a.js'))
+        rmtree(join(root, 'lib'))
+        self.index.update([join(root, 'a.js'), join(root, 'lib')])
+        self.assertEqual(self.glob('**/*.js'), ['vendor/e.js'])
+        self.assertEqual(self.glob('*.css'), ['b.css'])
+
+    def test_update_outside_tree(self):
+        other = mkdtemp()
+        try:
+            self.glob('**/*.js')
+            touch(join(other, 'z.js'))
+            self.index.update([join(other, 'z.js')])
+            self.assertEqual(len(self.glob('**/*.js')), 4)
+        finally:
+            rmtree(other)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+# Public Domain (-) 2010-2012 The Assetgen Authors.
+# See the Assetgen UNLICENSE file for details.
+
+"""Tests for the binary manifest index."""
+
+import unittest
+
+from os import close, remove
+from tempfile import mkstemp
+
+from assetgen.manifest import ManifestIndex, build_index
+
+ENTRIES = {
+    'site.js': {
+        'path': 'site-1234.js', 'size': 2048, 'digest': '1234abcd',
+        'type': 'application/javascript',
+        'gzip': {'path': 'site-1234.js.gz', 'size': 512}
+        },
+    'logo.png': {
+        'path': 'logo-5678.png', 'size': 100, 'digest': '5678abcd',
+        'type': 'image/png'
+        },
+    u'caf\xe9.css': {
+        'path': u'caf\xe9-9abc.css', 'size': 0, 'digest': '9abcabcd',
+        'type': 'text/css', 'gzip': None
+        },
+    u'\U0001f600.svg': {
+        'path': u'\U0001f600-def0.svg', 'size': 7, 'digest': 'def0abcd',
+        'type': 'image/svg+xml'
+        },
+    u'ａ.txt': {
+        'path': u'ａ-0000.txt', 'size': 1, 'digest': '0000abcd',
+        'type': 'text/plain'
+        }
+    }
+
+class TestManifestIndex(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = mkstemp()
+        close(fd)
+
+    def tearDown(self):
+        remove(self.path)
+
+    def open(self, data):
+        file = open(self.path, 'wb')
+        file.write(data)
+        file.close()
+        return ManifestIndex(self.path)
+
+    def test_round_trip(self):
+        index = self.open(build_index(ENTRIES))
+        try:
+            self.assertEqual(len(index), 5)
+            self.assertEqual(index.get('site.js'), {
+                'path': 'site-1234.js', 'size': 2048, 'digest': '1234abcd',
+                'type': 'application/javascript',
+                'gzip_path': 'site-1234.js.gz', 'gzip_size': 512
+                })
+            self.assertEqual(index.get('logo.png'), {
+                'path': 'logo-5678.png', 'size': 100, 'digest': '5678abcd',
+                'type': 'image/png', 'gzip_path': None, 'gzip_size': None
+                })
+        finally:
+            index.close()
+
+    def test_unicode_keys(self):
+        index = self.open(build_index(ENTRIES))
+        try:
+            for key in ENTRIES:
+                self.assertTrue(key in index, key)
+                entry = index.get(key)
+                self.assertEqual(
+                    entry['path'].decode('utf-8'), ENTRIES[key]['path']
+                    )
+            # Keys can also be looked up by their encoded form.
+            entry = index.get(u'caf\xe9.css'.encode('utf-8'))
+            self.assertEqual(entry['size'], 0)
+            self.assertEqual(entry['gzip_path'], None)
+        finally:
+            index.close()
+
+    def test_missing(self):
+        index = self.open(build_index(ENTRIES))
+        try:
+            for key in ('missing.js', '', 'site.j', 'site.jsx', u'caf\xe9'):
+                self.assertFalse(key in index, key)
+                self.assertEqual(index.get(key), None)
+            self.assertEqual(index.get('missing.js', 'default'), 'default')
+        finally:
+            index.close()
+
+    def test_empty(self):
+        index = self.open(build_index({}))
+        try:
+            self.assertEqual(len(index), 0)
+            self.assertFalse('site.js' in index)
+        finally:
+            index.close()
+
+    def test_bad_magic(self):
+        data = 'XXXX' + build_index(ENTRIES)[4:]
+        self.assertRaises(ValueError, self.open, data)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+# Public Domain (-) 2010-2012 The Assetgen Authors.
+# See the Assetgen UNLICENSE file for details.
+
+"""Tests for per-module minification of JS assets."""
+
+import os
+import unittest
+
+from hashlib import sha1
+from os.path import join
+from shutil import rmtree
+from tempfile import gettempdir, mkdtemp
+
+from simplejson import loads as dec_json
+
+from assetgen.bench import write, write_stubs
+from assetgen.main import EMPTY_SOURCEMAP, AssetGenRunner, unlock
+
+CONFIG = """
+generate:
+- site.js:
+    source:
+      - src/a.js
+      - src/b.coffee
+      - raw: "var raw = 1;"
+      - src/c.js
+    sourcemaps: true
+    uglify.modules: true
+- typed.js:
+    source: src/t*.ts
+    uglify.modules: true
+cache.directory: .cache
+output.directory: out
+state.directory: .state
+"""
+
+SOURCES = {
+    'src/a.js': 'var a = 1;\nvar a2 = 2;\n//# sourceMappingURL=a.js.map\n',
+    'src/b.coffee': 'b = 1\nb2 = 2\nb3 = 3\n',
+    'src/c.js': 'var c = 1;\n',
+    'src/t1.ts': 'var t1 = 1;\n',
+    'src/t2.ts': 'var t2 = t1;\n'
+    }
+
+class TestModules(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.path = os.environ['PATH']
+        self.root = root = mkdtemp()
+        write_stubs(join(root, 'bin'))
+        os.environ['PATH'] = join(root, 'bin') + os.pathsep + self.path
+        self.log = os.environ['ASSETGEN_BENCH_LOG'] = join(root, 'calls.log')
+        self.config = join(root, 'assetgen.yaml')
+        write(self.config, CONFIG)
+        self.data_dir = join(
+            gettempdir(), 'assetgen-%s' % sha1(self.config).hexdigest()[:12]
+            )
+        for path, content in SOURCES.iteritems():
+            write(join(root, path), content)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        os.environ['PATH'] = self.path
+        del os.environ['ASSETGEN_BENCH_LOG']
+        unlock(join(self.data_dir, 'lock'))
+        rmtree(self.data_dir, ignore_errors=True)
+        rmtree(self.root)
+
+    def build(self):
+        """Run a build and return the commands which were called."""
+        if os.path.isfile(self.log):
+            os.remove(self.log)
+        unlock(join(self.data_dir, 'lock'))
+        runner = AssetGenRunner(self.config)
+        runner.run()
+        runner.state.close()
+        if not os.path.isfile(self.log):
+            return []
+        return [line.split() for line in open(self.log)]
+
+    def read(self, path):
+        return open(join(self.root, 'out', path), 'rb').read()
+
+    def test_index_map(self):
+        self.build()
+        output = self.read('site.js')
+        index = dec_json(self.read('site.js.map')[len(')]}\n'):])
+        self.assertEqual(index['version'], 3)
+        self.assertEqual(index['file'], 'site.js')
+        sections = index['sections']
+        offsets = [section['offset'] for section in sections]
+        self.assertEqual(offsets, [
+            {'line': line, 'column': 0} for line in (0, 2, 5, 6)
+            ])
+        lines = output.split('\n')
+        # Each module starts at the line given by its section, and the
+        # modules are followed by the reference to the index map.
+        firsts = ['var a = 1;', 'b = 1', 'var raw = 1;', 'var c = 1;']
+        for offset, first in zip(offsets, firsts):
+            self.assertEqual(lines[offset['line']], first)
+        self.assertEqual(len(lines), 8)
+        self.assertEqual(lines[-1], '//@ sourceMappingURL=site.js.map')
+        # The references to the modules' own maps are stripped.
+        self.assertEqual(output.count('sourceMappingURL'), 1)
+        # Raw sources have an empty map, and the others refer to the copy
+        # of their source.
+        self.assertEqual(sections[2]['map'], EMPTY_SOURCEMAP)
+        for idx, name in ((0, 'a.js'), (1, 'b.coffee'), (3, 'c.js')):
+            map = sections[idx]['map']
+            self.assertEqual(len(map['sources']), 1)
+            self.assertTrue(map['sources'][0].endswith(name), map)
+            self.assertFalse('file' in map)
+
+    def test_only_changed_module_minified(self):
+        calls = self.build()
+        self.assertEqual(
+            len([call for call in calls if call[0] == 'uglifyjs2']), 6
+            )
+        write(join(self.root, 'src/c.js'), 'var c = 2;\nvar c2 = 3;\n')
+        calls = self.build()
+        self.assertEqual([call[0] for call in calls], ['uglifyjs2'])
+        self.assertTrue(calls[0][1].endswith('module.js'))
+        index = dec_json(self.read('site.js.map')[len(')]}\n'):])
+        self.assertEqual(index['sections'][-1]['offset']['line'], 6)
+        lines = self.read('site.js').split('\n')
+        self.assertEqual(lines[6:8], ['var c = 2;', 'var c2 = 3;'])
+
+    def test_typescript_program(self):
+        calls = self.build()
+        tsc = [call for call in calls if call[0] == 'tsc']
+        self.assertEqual(len(tsc), 1)
+        self.assertEqual(
+            sorted(os.path.basename(arg) for arg in tsc[0][1:]),
+            ['t1.ts', 't2.ts']
+            )
+        # Editing one file compiles the whole program again, but only the
+        # changed module gets minified.
+        write(join(self.root, 'src/t2.ts'), 'var t2 = t1 + 1;\n')
+        calls = self.build()
+        self.assertEqual([call[0] for call in calls], ['tsc', 'uglifyjs2'])
+        self.assertEqual(len(calls[0]), 3)
+        self.assertEqual(
+            self.read('typed.js'), 'var t1 = 1;\nvar t2 = t1 + 1;'
+            )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+# Public Domain (-) 2010-2012 The Assetgen Authors.
+# See the Assetgen UNLICENSE file for details.
+
+"""Tests for the parallel, dependency-aware scheduler."""
+
+import unittest
+
+from threading import Lock, Thread
+from time import sleep
+
+from assetgen.main import AppExit, schedule
+
+class Recorder(object):
+
+    def __init__(self, delays=None, fail=()):
+        self.delays = delays or {}
+        self.fail = fail
+        self.lock = Lock()
+        self.started = []
+        self.finished = []
+
+    def __call__(self, item):
+        with self.lock:
+            self.started.append(item)
+        sleep(self.delays.get(item, 0))
+        if item in self.fail:
+            raise RuntimeError("failed: %s" % item)
+        with self.lock:
+            self.finished.append(item)
+        return item.upper()
+
+def run(items, graph, func, jobs, timeout=10):
+    """Run the scheduler in a thread, so that a hang fails the test."""
+    outcome = {}
+    def target():
+        try:
+            outcome['result'] = schedule(items, graph, func, jobs)
+        except BaseException, error:
+            outcome['error'] = error
+    thread = Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout)
+    if thread.isAlive():
+        raise AssertionError("The scheduler didn't finish")
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
+
+class TestSchedule(unittest.TestCase):
+
+    def test_results_in_order(self):
+        func = Recorder({'a': 0.05})
+        self.assertEqual(
+            run(['a', 'b', 'c'], {}, func, 3), ['A', 'B', 'C']
+            )
+
+    def test_dependency_order(self):
+        graph = {'d': set(['b', 'c']), 'b': set(['a']), 'c': set(['a'])}
+        for jobs in (1, 2, 4):
+            func = Recorder({'b': 0.02, 'a': 0.01})
+            self.assertEqual(
+                run(['d', 'c', 'b', 'a'], graph, func, jobs),
+                ['D', 'C', 'B', 'A']
+                )
+            finished = func.finished
+            for item, needs in graph.items():
+                for need in needs:
+                    self.assertTrue(
+                        finished.index(need) < func.started.index(item),
+                        (jobs, need, item)
+                        )
+
+    def test_ready_items_start_in_given_order(self):
+        func = Recorder()
+        run(['c', 'a', 'b'], {}, func, 1)
+        self.assertEqual(func.started, ['c', 'a', 'b'])
+
+    def test_external_dependencies_ignored(self):
+        func = Recorder()
+        self.assertEqual(
+            run(['a', 'b'], {'a': set(['x']), 'b': set(['a'])}, func, 2),
+            ['A', 'B']
+            )
+
+    def test_runs_in_parallel(self):
+        lock = Lock()
+        state = {'active': 0, 'peak': 0}
+        def func(item):
+            with lock:
+                state['active'] += 1
+                state['peak'] = max(state['peak'], state['active'])
+            sleep(0.05)
+            with lock:
+                state['active'] -= 1
+        run(range(8), {}, func, 4)
+        self.assertEqual(state['peak'], 4)
+
+    def test_error_stops_the_run(self):
+        graph = {'c': set(['a']), 'd': set(['c'])}
+        func = Recorder({'a': 0.02, 'b': 0.1}, fail=['a'])
+        self.assertRaises(
+            RuntimeError, run, ['a', 'b', 'c', 'd'], graph, func, 2
+            )
+        # Items which were already running get to finish, but nothing else
+        # is started.
+        self.assertEqual(sorted(func.started), ['a', 'b'])
+        self.assertEqual(func.finished, ['b'])
+
+    def test_first_error_is_raised(self):
+        func = Recorder({'b': 0.05}, fail=['a', 'b'])
+        try:
+            run(['a', 'b'], {}, func, 2)
+        except RuntimeError, error:
+            self.assertEqual(str(error), 'failed: a')
+        else:
+            self.fail("No error was raised")
+
+    def test_error_with_single_job(self):
+        func = Recorder(fail=['b'])
+        self.assertRaises(RuntimeError, run, ['a', 'b', 'c'], {}, func, 1)
+        self.assertEqual(func.finished, ['a'])
+
+    def test_cycle(self):
+        graph = {'a': set(['c']), 'b': set(['a']), 'c': set(['b'])}
+        func = Recorder()
+        try:
+            run(['x', 'a', 'b', 'c'], graph, func, 2)
+        except AppExit:
+            pass
+        else:
+            self.fail("No error was raised for the cycle")
+        self.assertEqual(func.started, ['x'])
+
+    def test_self_cycle(self):
+        self.assertRaises(
+            AppExit, run, ['a'], {'a': set(['a'])}, Recorder(), 1
+            )
+
+    def test_empty(self):
+        self.assertEqual(run([], {}, Recorder(), 4), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+# Public Domain (-) 2010-2012 The Assetgen Authors.
+# See the Assetgen UNLICENSE file for details.
+
+"""Tests for the persistent build state."""
+
+import os
+import unittest
+
+from cPickle import dumps
+from hashlib import sha1
+from os.path import isfile, join
+from shutil import rmtree
+from sqlite3 import connect
+from tempfile import gettempdir, mkdtemp
+
+from assetgen.main import AssetGenRunner, StateStore, unlock
+
+CONFIG = """
+generate:
+- site.css:
+    source:
+      - src/a.css
+      - src/b.css
+output.directory: out
+output.fingerprint: true
+output.hashed: false
+state.directory: .state
+"""
+
+def write(path, content):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    file = open(path, 'wb')
+    file.write(content)
+    file.close()
+
+class TestStateStore(unittest.TestCase):
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.path = join(self.root, 'state', 'build.db')
+
+    def tearDown(self):
+        rmtree(self.root)
+
+    def test_round_trip(self):
+        store = StateStore(self.path)
+        store.data['hashes']['a.css'] = ((1, 2, 3), 'abcd')
+        store.data['meta']['snapshot'] = 'xyz'
+        store.save()
+        store.close()
+        store = StateStore(self.path)
+        self.assertEqual(store.data['hashes'], {'a.css': ((1, 2, 3), 'abcd')})
+        self.assertEqual(store.data['meta'], {'snapshot': 'xyz'})
+        # Deleted records are removed from the database.
+        del store.data['hashes']['a.css']
+        store.save()
+        store.close()
+        self.assertEqual(StateStore(self.path).data['hashes'], {})
+
+    def test_corrupt_database(self):
+        write(self.path, 'this is not an sqlite database' * 100)
+        store = StateStore(self.path)
+        self.assertTrue(isfile(self.path + '.corrupt'))
+        self.assertEqual(
+            open(self.path + '.corrupt', 'rb').read(),
+            'this is not an sqlite database' * 100
+            )
+        for records in store.data.values():
+            self.assertEqual(records, {})
+        # A fresh database is usable in its place.
+        store.data['built']['site.css'] = 1
+        store.save()
+        store.close()
+        self.assertEqual(StateStore(self.path).data['built'], {'site.css': 1})
+
+    def test_bad_rows_skipped(self):
+        store = StateStore(self.path)
+        store.data['built']['good.css'] = 1
+        store.data['built']['other.css'] = 2
+        store.save()
+        store.close()
+        db = connect(self.path)
+        rows = [
+            ('built', dumps('bad.css', 2), '\x80\x02garbage'),
+            ('built', 'not a pickle', dumps(3, 2)),
+            ('unknown', dumps('x', 2), dumps(4, 2))
+            ]
+        db.executemany(
+            "INSERT INTO state (kind, key, value) VALUES (?, ?, ?)",
+            [(kind, buffer(key), buffer(value)) for kind, key, value in rows]
+            )
+        db.commit()
+        db.close()
+        store = StateStore(self.path)
+        self.assertEqual(
+            store.data['built'], {'good.css': 1, 'other.css': 2}
+            )
+        self.assertFalse(isfile(self.path + '.corrupt'))
+        store.close()
+        # The unreadable rows are removed from the database.
+        db = connect(self.path)
+        count = db.execute(
+            "SELECT COUNT(*) FROM state WHERE kind = 'built'"
+            ).fetchone()[0]
+        db.close()
+        self.assertEqual(count, 2)
+
+class TestPruneHashes(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.root = root = mkdtemp()
+        self.config = join(root, 'assetgen.yaml')
+        write(self.config, CONFIG)
+        write(join(root, 'src', 'a.css'), 'a { color: red }\n')
+        write(join(root, 'src', 'b.css'), 'b { color: blue }\n')
+        self.data_dir = join(
+            gettempdir(), 'assetgen-%s' % sha1(self.config).hexdigest()[:12]
+            )
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        unlock(join(self.data_dir, 'lock'))
+        rmtree(self.data_dir, ignore_errors=True)
+        rmtree(self.root)
+
+    def get_runner(self):
+        unlock(join(self.data_dir, 'lock'))
+        return AssetGenRunner(self.config)
+
+    def test_stale_digests_pruned(self):
+        runner = self.get_runner()
+        runner.run()
+        hashes = runner.state.data['hashes']
+        self.assertTrue(any(path.endswith('a.css') for path in hashes))
+        runner.state.close()
+        runner = self.get_runner()
+        hashes = runner.state.data['hashes']
+        hashes['/gone/old.css'] = (('info',), 'abcd')
+        write(join(self.root, 'src', 'a.css'), 'a { color: green }\n')
+        runner.run()
+        runner.state.close()
+        hashes = self.get_runner().state.data['hashes']
+        self.assertFalse('/gone/old.css' in hashes)
+        for name in ('a.css', 'b.css'):
+            self.assertTrue(
+                any(path.endswith(name) for path in hashes), name
+                )
+
+if __name__ == '__main__':
+    unittest.main()
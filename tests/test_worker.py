@@ -0,0 +1,127 @@
+# Public Domain (-) 2010-2012 The Assetgen Authors.
+# See the Assetgen UNLICENSE file for details.
+
+"""Tests for the compiler worker protocol and pool."""
+
+import os
+import sys
+import unittest
+
+from cStringIO import StringIO
+from os.path import abspath, dirname
+
+from assetgen.main import WORKERS, Worker, WorkerError, dispatch
+from assetgen.worker import read_message, read_netstring, write_message
+from assetgen.worker import write_netstring
+
+# The stub worker is run with ``python -m``, so it needs to be able to
+# import the package from the child process.
+ROOT = dirname(dirname(abspath(__file__)))
+os.environ['PYTHONPATH'] = os.pathsep.join(
+    filter(None, [ROOT, os.environ.get('PYTHONPATH')])
+    )
+
+CAT_WORKER = [sys.executable, '-m', 'assetgen.worker', 'cat']
+
+class TestFraming(unittest.TestCase):
+
+    def test_netstring_round_trip(self):
+        for data in ('', 'hello', '1:2,', '\x00\n' * 1000):
+            stream = StringIO()
+            write_netstring(stream, data)
+            stream.seek(0)
+            self.assertEqual(read_netstring(stream), data)
+            self.assertEqual(stream.read(), '')
+
+    def test_netstring_encoding(self):
+        stream = StringIO()
+        write_netstring(stream, 'hello')
+        self.assertEqual(stream.getvalue(), '5:hello,')
+
+    def test_message_round_trip(self):
+        stream = StringIO()
+        write_message(stream, {'args': ['-c'], 'cwd': '/'}, 'body, with: 1')
+        write_message(stream, {'status': 0})
+        stream.seek(0)
+        self.assertEqual(
+            read_message(stream), ({'args': ['-c'], 'cwd': '/'}, 'body, with: 1')
+            )
+        self.assertEqual(read_message(stream), ({'status': 0}, ''))
+        self.assertRaises(EOFError, read_message, stream)
+
+    def test_invalid_netstrings(self):
+        for data, error in (
+            ('', EOFError),
+            ('5:hel', EOFError),
+            ('5:hello;', ValueError),
+            ('x:hello,', ValueError),
+            ('9' * 20 + ':', ValueError),
+            ):
+            self.assertRaises(error, read_netstring, StringIO(data))
+
+class TestWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.worker = Worker(CAT_WORKER)
+
+    def tearDown(self):
+        self.worker.stop()
+
+    def test_run(self):
+        worker = self.worker
+        self.assertEqual(worker.run(['cat'], input='hello'), ('hello', '', 0))
+        self.assertEqual(worker.run(['cat'], input='world'), ('world', '', 0))
+        # The same process is reused between jobs.
+        self.assertEqual(worker.count, 1)
+        self.assertEqual(len(worker.idle), 1)
+
+    def test_exit_status(self):
+        out, err, status = self.worker.run(['cat', '/nonexistent/file'])
+        self.assertEqual(out, '')
+        self.assertNotEqual(status, 0)
+        self.assertTrue(err)
+
+    def test_restart_after_kill(self):
+        worker = self.worker
+        worker.run(['cat'], input='hello')
+        process, _ = worker.idle[0]
+        process.kill()
+        process.wait()
+        self.assertEqual(worker.run(['cat'], input='again'), ('again', '', 0))
+        self.assertEqual(worker.count, 1)
+        self.assertNotEqual(worker.idle[0][0].pid, process.pid)
+
+    def test_failed_health_check(self):
+        worker = Worker([sys.executable, '-c', 'pass'])
+        self.assertRaises(WorkerError, worker.run, ['cat'])
+        self.assertEqual(worker.count, 0)
+
+class TestDispatch(unittest.TestCase):
+
+    def tearDown(self):
+        worker = WORKERS.pop('cat', None)
+        if worker:
+            worker.stop()
+
+    def test_worker(self):
+        WORKERS['cat'] = worker = Worker(CAT_WORKER)
+        self.assertEqual(
+            dispatch(['cat'], 'hello', redirect_stderr=1), ('hello', '', 0)
+            )
+        self.assertEqual(len(worker.idle), 1)
+
+    def test_fallback_when_disabled(self):
+        WORKERS['cat'] = worker = Worker([sys.executable, '-c', 'pass'])
+        self.assertEqual(
+            dispatch(['cat'], 'hello', redirect_stderr=1), ('hello', '', 0)
+            )
+        self.assertTrue(worker.disabled)
+        # Once disabled, the worker isn't started again.
+        worker.cmd = None
+        self.assertEqual(
+            dispatch(['cat'], 'again', redirect_stderr=1), ('again', '', 0)
+            )
+        self.assertEqual(worker.count, 0)
+
+if __name__ == '__main__':
+    unittest.main()